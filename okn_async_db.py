@@ -0,0 +1,96 @@
+# -*- encoding: utf-8 -*-#
+# !/usr/bin/python
+
+# Standardbibliotek import
+import asyncio
+import concurrent.futures
+import functools
+
+# Lokal applikasjon import
+from okn_ext_classes import MamutManager
+
+__author__ = 'Øyvind Nystad'
+
+"""
+Egenlagde klasser for asynkron databasetilgang mot Mamut:
+- AsyncMamutDB
+"""
+
+
+class AsyncMamutDB:
+    """Asynkron (asyncio) tilgang til Mamut-databasen.
+
+    Databasemetodene i MamutManager tilbys som coroutines. De
+    blokkerende ODBC-kallene kjøres i en begrenset trådpool, slik at
+    uavhengige oppslag kan kjøres samtidig med asyncio.gather, og
+    overlappe med f.eks. GUI-automatisering. SQL og typecasting er
+    felles med MamutManager, som fortsatt kan brukes synkront.
+
+    :param mamut: MamutManager som brukes for databasekall, ny
+        opprettes dersom None
+    :param max_workers: Maks antall samtidige databasekall, standard
+        er størrelsen på tilkoblingspoolen
+
+    Eksempel:
+        async with AsyncMamutDB() as mamut_db:
+            order_properties, order_prods = await asyncio.gather(
+                mamut_db.get_order_properties(order_num),
+                mamut_db.get_ordered_prods(order_num),
+            )
+    """
+
+    def __init__(self,
+                 mamut: MamutManager | None = None,
+                 *,
+                 max_workers: int | None = None,
+                 ) -> None:
+        self._is_mamut_owned = mamut is None
+        self.mamut = mamut if mamut is not None else MamutManager()
+        # Egen trådpool, da MamutManager.db_executor kan brukes av
+        # metodene som kjøres her
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers or self.mamut.db_pool.max_size,
+            thread_name_prefix='async_mamut_db')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Avslutt trådpool, og MamutManager dersom opprettet her."""
+        self._executor.shutdown()
+        if self._is_mamut_owned:
+            self.mamut.close()
+        return None
+
+    async def _run(self, func, *args, **kwargs):
+        """Kjør blokkerende kall i trådpoolen."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs))
+
+    async def lookup_db(self, sql_statement, params=None, **kwargs):
+        """Asynkron MamutManager.lookup_db."""
+        return await self._run(self.mamut.lookup_db, sql_statement, params,
+                               **kwargs)
+
+    async def get_order_properties(self, order_num, **kwargs):
+        """Asynkron MamutManager.get_order_properties."""
+        return await self._run(self.mamut.get_order_properties, order_num,
+                               **kwargs)
+
+    async def get_ordered_prods(self, order_num):
+        """Asynkron MamutManager.get_ordered_prods."""
+        return await self._run(self.mamut.get_ordered_prods, order_num)
+
+    async def get_prod_num_by_sn(self, serial_num, **kwargs):
+        """Asynkron MamutManager.get_prod_num_by_sn."""
+        return await self._run(self.mamut.get_prod_num_by_sn, serial_num,
+                               **kwargs)
+
+    async def get_serial_number_mask(self, *, prod_num, **kwargs):
+        """Asynkron MamutManager.get_serial_number_mask."""
+        return await self._run(self.mamut.get_serial_number_mask,
+                               prod_num=prod_num, **kwargs)
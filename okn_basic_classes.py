@@ -4,6 +4,8 @@
 # Standardbibliotek import
 import copy
 import ctypes
+import functools
+import keyword
 import msvcrt
 import pyperclip
 import re
@@ -20,12 +22,18 @@ import win32com.client
 # Lokal applikasjon import
 from okn_console_function import console_setting
 from okn_constants import PROGRAM_RE
+from okn_wait import Backoff, wait_until
+from okn_wnd_snapshot import WndInfo, WndSnapshots, WndSource
 
 __author__ = 'Øyvind Nystad'
 
 """
 Egenlagde klasser for grunnleggende Adviuvare-funksjoner
 - NamedList
+- Record, make_record_class
+- LazyRecord, make_lazy_record_class
+- Win32WndSource
+- WndPlacement, CONSOLE_PINNED, LAYOUT_PROFILES
 - BasicWndHandler
 - MenuMaker
 """
@@ -57,7 +65,9 @@ class NamedList():
         return f'{type(self).__name__}({", ".join(items)})'
 
     def __eq__(self, other) -> bool:
-        if hasattr(other, '__dict__'):
+        if isinstance(other, Record):
+            return self.__dict__ == other._asdict()
+        elif hasattr(other, '__dict__'):
             return self.__dict__ == other.__dict__
         else:
             return False
@@ -84,7 +94,9 @@ class NamedList():
             NamedList(a=1, b=2, f=7)
         """
         merged = copy.copy(self)
-        if other and type(self) == type(other):
+        if other and isinstance(other, Record):
+            merged.__dict__.update(other._asdict())
+        elif other and type(self) == type(other):
             for key, value in other.__dict__.items():
                 merged.__dict__[key] = value
         elif isinstance(other, dict):
@@ -94,39 +106,346 @@ class NamedList():
         return merged
 
 
+class Record:
+    """Kompakt rad fra databasespørring, kompatibel med NamedList.
+
+    Baseklasse for klasser laget med make_record_class. Hver kolonne
+    har egen slot, og kolonnenavnene (_fields) deles av alle rader i
+    samme spørring, i stedet for egen __dict__ per rad. Attributter
+    utover kolonnene kan likevel settes, og havner da i __dict__.
+
+    Støtter samme bruk som NamedList: attributt-tilgang, setting og
+    sletting (del), len(), ==, repr og update().
+    """
+
+    __slots__ = ('__dict__',)
+    _fields: tuple = ()
+
+    def __repr__(self) -> str:
+        values = self._asdict()
+        items = (f'{k}={values[k]}' for k in sorted(values))
+        return f'{type(self).__name__}({", ".join(items)})'
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Record):
+            return self._asdict() == other._asdict()
+        elif hasattr(other, '__dict__'):
+            return self._asdict() == other.__dict__
+        else:
+            return False
+
+    def __len__(self) -> int:
+        return len(self._asdict())
+
+    def __copy__(self):
+        duplicate = type(self).__new__(type(self))
+        for key, value in self._asdict().items():
+            setattr(duplicate, key, value)
+        return duplicate
+
+    def _asdict(self) -> dict:
+        """Returner attributter som dict, som NamedList.__dict__."""
+        values = {}
+        for field in self._fields:
+            try:
+                values[field] = getattr(self, field)
+            except AttributeError:      # Slettet attributt
+                pass
+        values.update(self.__dict__)
+        return values
+
+    def update(self, other=None, **kwargs):
+        """Oppdater en Record, se NamedList.update.
+
+        other kan være Record, NamedList eller dict.
+        """
+        merged = copy.copy(self)
+        if other and isinstance(other, (Record, NamedList)):
+            other = (other._asdict() if isinstance(other, Record)
+                     else other.__dict__)
+        if isinstance(other, dict):
+            for key, value in other.items():
+                setattr(merged, key, value)
+        for key, value in kwargs.items():
+            setattr(merged, key, value)
+        return merged
+
+
+class _LazyField:
+    """Felt i LazyRecord, typecaster rå verdi ved første lesing.
+
+    Typecastet verdi lagres i radens __dict__, og overskygger deretter
+    feltet, slik at senere lesing går like raskt som vanlig attributt.
+    """
+
+    __slots__ = ('idx', 'bit', 'name')
+
+    def __init__(self, idx: int, name: str) -> None:
+        self.idx = idx
+        self.bit = 1 << idx
+        self.name = name
+
+    def __get__(self, record, owner=None):
+        if record is None:
+            return self
+        if not record._pending & self.bit:      # Slettet
+            raise AttributeError(
+                f"'{type(record).__name__}' object has no attribute "
+                f"'{self.name}'")
+        value = record._converters[self.idx](record._raw[self.idx])
+        record.__dict__[self.name] = value
+        return value
+
+
+class LazyRecord(Record):
+    """Record som typecaster hvert felt først når det leses.
+
+    Holder rå verdier fra databasedriveren og én typecasting-funksjon
+    per kolonne. Leste og satte felter lagres i __dict__, slik at
+    lesing etterpå er like rask som for NamedList. Setting, sletting,
+    copy og update virker som for Record, uten å typecaste felter som
+    ikke er lest. Baseklasse for klasser laget med
+    make_lazy_record_class.
+
+    :param raw: Rå verdier, én per felt
+    :param converters: Typecasting-funksjon per felt
+    """
+
+    __slots__ = ('_raw', '_converters', '_pending')
+
+    def __init__(self, raw, converters) -> None:
+        self._raw = raw
+        self._converters = converters
+        # Bit per felt som ikke er lest eller slettet, alle i starten
+        self._pending = -1
+
+    def __delattr__(self, name) -> None:
+        field = type(self).__dict__.get(name)
+        if isinstance(field, _LazyField) and self._pending & field.bit:
+            self._pending &= ~field.bit
+            self.__dict__.pop(name, None)
+            return None
+        object.__delattr__(self, name)
+
+    def __copy__(self):
+        duplicate = type(self).__new__(type(self))
+        duplicate._raw = self._raw
+        duplicate._converters = self._converters
+        duplicate._pending = self._pending
+        duplicate.__dict__.update(self.__dict__)
+        return duplicate
+
+
+def _is_valid_fields(fields: tuple, base: type) -> bool:
+    """Angi om kolonnenavnene kan brukes som slots i base."""
+    return len(set(fields)) == len(fields) and all(
+        field.isidentifier() and not keyword.iskeyword(field)
+        and not field.startswith('_') and not hasattr(base, field)
+        for field in fields)
+
+
+@functools.lru_cache(maxsize=256)
+def make_record_class(fields: tuple, base: type = Record) -> type | None:
+    """Lag Record-klasse med én slot per kolonne.
+
+    Klassene caches per kolonneliste, slik at gjentatte spørringer
+    bruker samme klasse. Returnerer None dersom kolonnenavnene ikke
+    kan brukes som slots (ugyldige eller like navn, eller navn som
+    kolliderer med metoder), og NamedList må brukes i stedet.
+
+    Eksempel:
+        ProdRecord = make_record_class(('prod_num', 'qtyorder'))
+        >>> ProdRecord('SPE200', 2)
+        Record(prod_num=SPE200, qtyorder=2)
+    """
+    if not _is_valid_fields(fields, base):
+        return None
+
+    # Genereres som kode, på samme måte som collections.namedtuple,
+    # da dette gir vesentlig raskere oppretting enn setattr i løkke
+    args = ', '.join(fields)
+    body = ''.join(f'    self.{field} = {field}\n' for field in fields)
+    namespace: dict = {}
+    exec(f'def __init__(self, {args}):\n{body or "    pass"}\n', namespace)
+    return type(base.__name__, (base,), {
+        '__slots__': fields,
+        '__init__': namespace['__init__'],
+        '_fields': fields,
+    })
+
+
+
+@functools.lru_cache(maxsize=256)
+def make_lazy_record_class(fields: tuple) -> type | None:
+    """Lag LazyRecord-klasse med ett felt per kolonne.
+
+    Som make_record_class, men radene opprettes med rå verdier og
+    typecasting-funksjoner: LazyRecordClass(raw_row, converters).
+    Returnerer None for kolonnenavn som ikke kan brukes som felter.
+    """
+    if not _is_valid_fields(fields, LazyRecord):
+        return None
+    namespace = {field: _LazyField(idx, field)
+                 for idx, field in enumerate(fields)}
+    # Samme navn som Record, slik at repr ikke endres
+    return type(Record.__name__, (LazyRecord,), {
+        '__slots__': (),
+        '_fields': fields,
+        **namespace,
+    })
+
+
+# Pause mellom opplistinger av vinduer i BasicWndHandler.match_wnds
+WND_MATCH_BACKOFF = Backoff(0.01, max_interval=0.25)
+
+
+@functools.lru_cache(maxsize=128)
+def _compile_title_re(title_re: str, flags: int) -> re.Pattern:
+    """Kompiler regex for vindustittel én gang."""
+    return re.compile(title_re, flags)
+
+
+class Win32WndSource(WndSource):
+    """Opplisting av vinduer i Windows, i én EnumWindows-runde.
+
+    Handle-id, synlighet, tittel og plassering samles i samme
+    tilbakekall, i z-rekkefølge. Plassering leses bare for synlige
+    vinduer.
+    """
+
+    def list_wnds(self) -> list[WndInfo]:
+        """Returner alle vinduer i z-rekkefølge."""
+        wnds: list[WndInfo] = []
+
+        def _add_wnd(wnd_handle, __):
+            is_visible = bool(win32gui.IsWindowVisible(wnd_handle))
+            rect = None
+            if is_visible:
+                try:
+                    rect = win32gui.GetWindowRect(wnd_handle)
+                except Exception:       # pywintypes.error, vindu lukket
+                    pass
+            wnds.append(WndInfo(wnd_handle, is_visible,
+                                win32gui.GetWindowText(wnd_handle), rect))
+            return True
+
+        win32gui.EnumWindows(_add_wnd, None)
+        return wnds
+
+
+# Felles opplisting av vinduer for alle BasicWndHandler
+WND_SNAPSHOTS = WndSnapshots(Win32WndSource())
+
+
+def _escape_title_re(title_re: str) -> str:
+    """Parenteser inni regex-uttrykk for vindustittel må escapes."""
+    return title_re.replace('(', r'\(').replace(')', r'\)')
+
+
+class WndPlacement:
+    """Ønsket tilstand for ett vindu i en layoutprofil.
+
+    Parametere som for BasicWndHandler.wnd_focus. Med is_focused=False
+    plasseres vinduet uten å få fokus.
+
+    Eksempel:
+        WndPlacement(PROGRAM_RE, x=-25, y=-90, w=410, h=440,
+                     is_topmost=True)
+    """
+
+    __slots__ = ('title_re', 'is_maximized', 'is_topmost', 'is_focused',
+                 'x', 'y', 'w', 'h')
+
+    def __init__(self, title_re: str, *,
+                 is_maximized: bool = False,
+                 is_topmost: bool = False,
+                 is_focused: bool = True,
+                 x: int | float | None = None,
+                 y: int | float | None = None,
+                 w: int | float | None = None,
+                 h: int | float | None = None,
+                 ) -> None:
+        self.title_re = title_re
+        self.is_maximized = is_maximized
+        self.is_topmost = is_topmost
+        self.is_focused = is_focused
+        self.x, self.y, self.w, self.h = x, y, w, h
+
+    def __repr__(self) -> str:
+        args = ', '.join(f'{name}={getattr(self, name)!r}'
+                         for name in self.__slots__[1:]
+                         if getattr(self, name) not in (None, False)
+                         or name == 'is_focused')
+        return f'{type(self).__name__}({self.title_re!r}, {args})'
+
+    def placement_kwargs(self) -> dict:
+        """Parametere til BasicWndHandler.place_wnd."""
+        return dict(is_maximized=self.is_maximized,
+                    is_topmost=self.is_topmost,
+                    is_focused=self.is_focused,
+                    x=self.x, y=self.y, w=self.w, h=self.h)
+
+
+# Konsollvindu festet nede til høyre, alltid øverst
+CONSOLE_PINNED = dict(x=-25, y=-90, w=410, h=440, is_topmost=True)
+
+# Navngitte layoutprofiler for BasicWndHandler.apply_layout, vinduer
+# plasseres i én runde. Utvides i underklasser via layout_profiles.
+LAYOUT_PROFILES = {
+    # Konsollvindu i fokus, f.eks. mens meny vises
+    'console': (WndPlacement(PROGRAM_RE),),
+    'console_pinned': (WndPlacement(PROGRAM_RE, **CONSOLE_PINNED),),
+}
+
+
 class BasicWndHandler:
     """Klasse for enkel manipulering av vinduer i Windows.
 
+    Vinduer listes opp via WndSnapshots, slik at oppslag like etter
+    hverandre deler én opplisting.
+
+    :param wnd_snapshots: WndSnapshots, standard WND_SNAPSHOTS
     :param x_pixel_res: Skjermoppløsning i X-retning
     :param y_pixel_res: Skjermoppløsning i Y-retning
 
     Metoder:
         get_active_wnds: Finn alle synlige og aktive vinduer.
+        match_wnds: Finn vinduer for flere tittelmønstre samtidig.
         wnd_focus: Sett fokus på ønsket vindu.
+        focus_wnd: Sett fokus på vindu med kjent handle-id.
+        place_wnd: Plasser vindu, uten endringer dersom allerede på
+            plass.
+        apply_layout: Plasser flere vinduer etter layoutprofil.
+        is_wnd_responsive: Angi om vindu behandler meldinger.
     """
 
-    def __init__(self) -> None:
+    layout_profiles: dict = LAYOUT_PROFILES
+
+    def __init__(self, wnd_snapshots: WndSnapshots | None = None) -> None:
         """Finn skjermens oppløsning."""
+        self.wnd_snapshots = (wnd_snapshots if wnd_snapshots is not None
+                              else WND_SNAPSHOTS)
         self.x_pixel_res: int = win32api.GetSystemMetrics(0)
         self.y_pixel_res: int = win32api.GetSystemMetrics(1)
 
-    def _get_all_wnd_handles(self) -> list[int]:
-        """Returner handle-id for alle vinduer.
+    def _iter_all_wnd_handles(self, max_age: float | None = None):
+        """Generer handle-id for alle vinduer.
 
         Opplistingen er i z-rekkefølge, dermed også i kronologisk
-        rekkefølge etter når vinduene sist var i fokus.
+        rekkefølge etter når vinduene sist var i fokus. Siste
+        opplisting gjenbrukes dersom den er yngre enn max_age.
         """
-        wnd_handles: list[int] = []
-        top_wnd_handle: int = ctypes.windll.user32.GetTopWindow(None)
-        if top_wnd_handle:
-            wnd_handles.append(top_wnd_handle)
-            while True:
-                next_wnd_handle: int = ctypes.windll.user32.GetWindow(
-                    wnd_handles[-1], win32con.GW_HWNDNEXT)
-                if not next_wnd_handle:
-                    break
-                wnd_handles.append(next_wnd_handle)
-        return wnd_handles
+        for wnd in self.wnd_snapshots.take(max_age).wnds:
+            yield wnd.handle
+
+    def _get_all_wnd_handles(self) -> list[int]:
+        """Returner handle-id for alle vinduer, i z-rekkefølge."""
+        return list(self._iter_all_wnd_handles())
+
+    def _iter_titled_wnds(self, max_age: float | None = None):
+        """Generer (handle-id, tittel) for synlige vinduer med tittel,
+        i z-rekkefølge, fra siste opplisting yngre enn max_age."""
+        return self.wnd_snapshots.take(max_age).iter_titled()
 
     def get_focused_wnd_title(self):
         """Finn tittel for fokusert vindu."""
@@ -141,39 +460,82 @@ class BasicWndHandler:
         nedover, indikerer kronologi), handle-id og tittel for
         hvert vindu.
         """
-        all_wnd_handles: list[int] = self._get_all_wnd_handles()
-        active_wnd_handles: list[int] = [
-            wnd_handle for wnd_handle in all_wnd_handles if
-            win32gui.IsWindowVisible(wnd_handle) and
-            win32gui.GetWindowText(wnd_handle)]
-        active_wnds: List[Tuple[int, int, str]] = [
-            (idx, wnd_handle, win32gui.GetWindowText(wnd_handle)) for
-            idx, wnd_handle in enumerate(active_wnd_handles)]
+        active_wnds: list[tuple[int, int, str]] = [
+            (idx, wnd_handle, wnd_title) for
+            idx, (wnd_handle, wnd_title) in enumerate(
+                self._iter_titled_wnds())]
         return(active_wnds)
 
+    def match_wnds(self, title_res, *,
+                   is_case_sensitive: bool = True,
+                   is_any: bool = False,
+                   timeout: float = 2.0,
+                   ) -> dict:
+        """Finn vinduer for flere tittelmønstre, i én opplisting.
+
+        For hvert mønster (re.match mot tittel) velges vinduet med
+        lavest z-verdi, dvs. sist i fokus. Første forsøk kan gjenbruke
+        siste opplisting (WndSnapshots), deretter listes vinduene opp
+        på nytt, med økende pause (WND_MATCH_BACKOFF), inntil alle
+        mønstre (is_any=True: minst ett) har treff, eller timeout.
+
+        :param title_res: dict med regex per navn, eller liste av regex
+            (som da også er navn)
+        :param is_case_sensitive: Angi om store og små bokstaver skal
+            tas hensyn til
+        :param is_any: Avslutt når minst ett mønster har treff
+        :param timeout: Maks ventetid, 0 gir én opplisting
+
+        :return: dict med (wnd_handle, wnd_title) per navn, None for
+            mønstre uten treff
+
+        Eksempel:
+            wnds = handler.match_wnds({'mamut': MAMUT_RE,
+                                       'pdf': '.*PDF.*'},
+                                      is_any=True, timeout=5.)
+        """
+        if not isinstance(title_res, dict):
+            title_res = {title_re: title_re for title_re in title_res}
+        flags = 0 if is_case_sensitive else re.IGNORECASE
+        patterns = {name: _compile_title_re(title_re, flags)
+                    for name, title_re in title_res.items()}
+        matches = dict.fromkeys(patterns)
+        pass_count = 0
+
+        def _match_all():
+            """Én opplisting, returner om nok mønstre har treff."""
+            nonlocal pass_count
+            matches.update(dict.fromkeys(patterns))
+            unmatched = dict(patterns)
+            # Første forsøk kan gjenbruke siste opplisting
+            max_age = 0. if pass_count else None
+            pass_count += 1
+            for wnd_handle, wnd_title in self._iter_titled_wnds(max_age):
+                for name, pattern in list(unmatched.items()):
+                    if pattern.match(wnd_title):
+                        matches[name] = (wnd_handle, wnd_title)
+                        del unmatched[name]
+                if not unmatched:
+                    break
+            if is_any:
+                return len(unmatched) < len(patterns)
+            return not unmatched
+
+        wait_until(_match_all, timeout, backoff=WND_MATCH_BACKOFF,
+                   name='BasicWndHandler.match_wnds')
+        return matches
+
     def _get_wnd_match(self,
                        is_case_sensitive,
                        timeout: float,
                        title_re: str,
                        is_verbose) -> int | None:
         """Finn ønsket vindu."""
-        init_time = time.time()
-        wnd_matches: list = []
-
-        while not wnd_matches and time.time() - init_time < timeout:
-            active_wnds = self.get_active_wnds()
-
-            for wnd in active_wnds:
-                if is_case_sensitive:
-                    if re.match(title_re, wnd[2]):
-                        wnd_matches.append(wnd)
-                else:
-                    if re.match(title_re, wnd[2], re.IGNORECASE):
-                        wnd_matches.append(wnd)
-        if wnd_matches:
-
-            wnd_handle = wnd_matches[0][1]
-            wnd_title = wnd_matches[0][2]
+        wnd_match = self.match_wnds([title_re],
+                                    is_case_sensitive=is_case_sensitive,
+                                    timeout=timeout)[title_re]
+        if wnd_match:
+            wnd_handle, wnd_title = wnd_match
             if is_verbose:
                 print(f"Fant vindu {wnd_handle} - '{wnd_title}'")
         else:
@@ -185,7 +547,14 @@ class BasicWndHandler:
         return wnd_handle, wnd_title
 
     def _get_updated_wnd_vals(self, wnd_handle, x, y, w, h):
-        x_left, y_upper, x_right, y_lower = win32gui.GetWindowRect(wnd_handle)
+        return self._calc_wnd_vals(win32gui.GetWindowRect(wnd_handle),
+                                   x, y, w, h)
+
+    def _calc_wnd_vals(self, rect, x, y, w, h):
+        """Beregn ny x, y, w og h fra vinduets plassering rect
+        (x_left, y_upper, x_right, y_lower), for både endring og
+        kontroll av om vinduet allerede er på plass."""
+        x_left, y_upper, x_right, y_lower = rect
 
         # Beregning av ny w
         if isinstance(w, int):
@@ -284,45 +653,170 @@ class BasicWndHandler:
         """
 
         # Parenteser inni regex-uttrykk må escapes med \-tegn
-        title_re = title_re.replace('(', r'\(')
-        title_re = title_re.replace(')', r'\)')
+        title_re = _escape_title_re(title_re)
 
         wnd_handle, wnd_title = self._get_wnd_match(is_case_sensitive, timeout,
                                               title_re, is_verbose)
 
         if wnd_handle:
-            # Gjør vindu synlig
-            win32gui.ShowWindow(
-                wnd_handle,
-                win32con.SW_MAXIMIZE if is_maximized else   # 3
-                win32con.SW_NORMAL)                         # 1
-
-            if is_topmost:                 # Vindu alltid øverst
-                win32gui.SetWindowPos(
-                    wnd_handle, win32con.HWND_TOPMOST, 0, 0, 0, 0,
-                    win32con.SWP_NOSIZE | win32con.SWP_NOMOVE)
-
-            if any([x, y, w, h]):
-                x_new, y_new, w_new, h_new = self._get_updated_wnd_vals(
-                    wnd_handle, x, y, w, h)
-                win32gui.MoveWindow(wnd_handle, x_new, y_new, w_new, h_new, 0)
-
-            # Gir vindu fokus
-            try:
-                win32gui.SetForegroundWindow(wnd_handle)
-            except Exception:           # pywintypes.error
-                # Iblant feiler win32gui.SetForegroundWindow(). Fiks fra
-                # https://stackoverflow.com/a/15503675 - send først ett
-                # Alt-knappetrykk til vindu.
-                win32com.client.Dispatch('WScript.Shell').SendKeys('%')
-                win32gui.SetForegroundWindow(wnd_handle)
-            # Sannsynligvis nødvendig pause, evt. juster opp dersom
-            # pywinauto.findwindows.ElementNotFoundError oppstår
-            time.sleep(0.3)
+            self.focus_wnd(wnd_handle, is_maximized=is_maximized,
+                           is_topmost=is_topmost, x=x, y=y, w=w, h=h)
 
         return dict(wnd_handle=wnd_handle,
                     wnd_title=wnd_title)
 
+    def focus_wnd(self, wnd_handle: int, *,
+                  is_maximized: bool = False,
+                  is_topmost: bool = False,
+                  x: int | float | None = None,
+                  y: int | float | None = None,
+                  w: int | float | None = None,
+                  h: int | float | None = None,
+                  ) -> None:
+        """Sett fokus på vindu med kjent handle-id, f.eks. fra
+        match_wnds. Parametere som for wnd_focus.
+        """
+        self.place_wnd(wnd_handle, is_maximized=is_maximized,
+                       is_topmost=is_topmost, x=x, y=y, w=w, h=h)
+        return None
+
+    def _is_wnd_placed(self, wnd_handle: int, *,
+                       is_maximized: bool,
+                       is_topmost: bool,
+                       is_focused: bool,
+                       x, y, w, h) -> bool:
+        """Angi om vinduet allerede er som ønsket, kun med lesing av
+        tilstand. Plassering av maksimert vindu kan ikke kontrolleres,
+        og gir alltid False."""
+        if is_focused and (ctypes.windll.user32.GetForegroundWindow()
+                           != wnd_handle):
+            return False
+        if win32gui.IsIconic(wnd_handle) or \
+                bool(win32gui.IsZoomed(wnd_handle)) != is_maximized:
+            return False
+        if is_topmost and not (
+                win32gui.GetWindowLong(wnd_handle, win32con.GWL_EXSTYLE)
+                & win32con.WS_EX_TOPMOST):
+            return False
+        if any([x, y, w, h]):
+            if is_maximized:
+                return False
+            rect = win32gui.GetWindowRect(wnd_handle)
+            x_left, y_upper, x_right, y_lower = rect
+            return (self._calc_wnd_vals(rect, x, y, w, h)
+                    == (x_left, y_upper, x_right - x_left, y_lower - y_upper))
+        return True
+
+    def place_wnd(self, wnd_handle: int, *,
+                  is_maximized: bool = False,
+                  is_topmost: bool = False,
+                  is_focused: bool = True,
+                  x: int | float | None = None,
+                  y: int | float | None = None,
+                  w: int | float | None = None,
+                  h: int | float | None = None,
+                  ) -> bool:
+        """Plasser vindu med kjent handle-id, og evt. sett fokus.
+
+        Er vinduet allerede i ønsket tilstand (fokus, maksimert,
+        alltid øverst og plassering), gjøres ingen endringer og
+        ventes ikke på fokus. Parametere som for wnd_focus, med
+        is_focused=False plasseres vinduet uten å få fokus.
+
+        :return: True dersom vinduet ble endret
+        """
+        if self._is_wnd_placed(wnd_handle, is_maximized=is_maximized,
+                               is_topmost=is_topmost, is_focused=is_focused,
+                               x=x, y=y, w=w, h=h):
+            return False
+
+        # Gjør vindu synlig
+        win32gui.ShowWindow(
+            wnd_handle,
+            win32con.SW_MAXIMIZE if is_maximized else       # 3
+            win32con.SW_NORMAL if is_focused else           # 1
+            win32con.SW_SHOWNOACTIVATE)                     # 4
+
+        if is_topmost:                 # Vindu alltid øverst
+            win32gui.SetWindowPos(
+                wnd_handle, win32con.HWND_TOPMOST, 0, 0, 0, 0,
+                win32con.SWP_NOSIZE | win32con.SWP_NOMOVE
+                | (0 if is_focused else win32con.SWP_NOACTIVATE))
+
+        if any([x, y, w, h]):
+            x_new, y_new, w_new, h_new = self._get_updated_wnd_vals(
+                wnd_handle, x, y, w, h)
+            win32gui.MoveWindow(wnd_handle, x_new, y_new, w_new, h_new, 0)
+
+        # z-rekkefølge og plassering er endret
+        self.wnd_snapshots.invalidate()
+        if not is_focused:
+            return True
+
+        # Gir vindu fokus
+        try:
+            win32gui.SetForegroundWindow(wnd_handle)
+        except Exception:           # pywintypes.error
+            # Iblant feiler win32gui.SetForegroundWindow(). Fiks fra
+            # https://stackoverflow.com/a/15503675 - send først ett
+            # Alt-knappetrykk til vindu.
+            win32com.client.Dispatch('WScript.Shell').SendKeys('%')
+            win32gui.SetForegroundWindow(wnd_handle)
+        # Vent til vinduet faktisk har fokus, i stedet for fast
+        # pause. Evt. juster opp timeout dersom
+        # pywinauto.findwindows.ElementNotFoundError oppstår
+        wait_until(lambda: (ctypes.windll.user32.GetForegroundWindow()
+                            == wnd_handle),
+                   1., name='BasicWndHandler.wnd_focus')
+        return True
+
+    def apply_layout(self, profile, *,
+                     timeout: float = 2.0,
+                     ) -> list[tuple[int, str] | None]:
+        """Plasser vinduer etter layoutprofil, i én runde.
+
+        Alle vinduer i profilen søkes opp i samme opplisting
+        (match_wnds). Vinduer uten fokus plasseres først, slik at
+        vindu med fokus havner øverst. Vinduer som allerede er på plass
+        endres ikke (place_wnd).
+
+        :param profile: Navn i self.layout_profiles, eller sekvens av
+            WndPlacement
+        :param timeout: Maks ventetid på at vinduene finnes
+
+        :return: (wnd_handle, wnd_title) per WndPlacement i profilen,
+            None for vinduer som ikke ble funnet
+
+        Eksempel:
+            handler.apply_layout('console_pinned')
+        """
+        placements = (self.layout_profiles[profile]
+                      if isinstance(profile, str) else tuple(profile))
+        wnd_matches = self.match_wnds(
+            {idx: _escape_title_re(placement.title_re)
+             for idx, placement in enumerate(placements)},
+            timeout=timeout)
+        for idx, placement in sorted(enumerate(placements),
+                                     key=lambda item: item[1].is_focused):
+            if wnd_matches[idx] is not None:
+                self.place_wnd(wnd_matches[idx][0],
+                               **placement.placement_kwargs())
+        return [wnd_matches[idx] for idx in range(len(placements))]
+
+    def is_wnd_responsive(self, wnd_handle, timeout: float = 0.1) -> bool:
+        """Angi om vinduets tråd behandler meldinger innen timeout.
+
+        Et program som f.eks. lagrer i GUI-tråden svarer ikke før det
+        er ferdig, slik at dette kan brukes med wait_until.
+        """
+        try:
+            win32gui.SendMessageTimeout(
+                wnd_handle, win32con.WM_NULL, 0, 0,
+                win32con.SMTO_ABORTIFHUNG, int(timeout * 1000))
+        except Exception:               # pywintypes.error ved timeout
+            return False
+        return True
+
 
 class MenuMaker:
     def __init__(self,
@@ -368,7 +862,7 @@ class MenuMaker:
                 print(self._shout(f'[{key}]') + ' ' + option_line)
 
         console_setting(state='ready')
-        self.wndhandler.wnd_focus(title_re=PROGRAM_RE)
+        self.wndhandler.apply_layout('console')
         pressed_key = None
 
         while True:
@@ -380,13 +874,7 @@ class MenuMaker:
                 time.sleep(0.3)
                 print("\r" + " " * 30, end="\r")
 
-        self.wndhandler.wnd_focus(title_re=PROGRAM_RE,
-                                  x=-25,
-                                  y=-90,
-                                  w=410,
-                                  h=440,
-                                  is_maximized=False,
-                                  is_topmost=True)
+        self.wndhandler.apply_layout('console_pinned')
 
         console_setting(state='busy')
 
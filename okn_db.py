@@ -0,0 +1,1120 @@
+# -*- encoding: utf-8 -*-#
+# !/usr/bin/python
+
+# Standardbibliotek import
+import array
+import bisect
+import collections
+import contextlib
+import copy
+import datetime
+import functools
+import hashlib
+import logging
+import logging.handlers
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+# Tredjeparts bibliotek import
+import pendulum
+
+
+__author__ = 'Øyvind Nystad'
+
+"""
+Egenlagde klasser for databasetilgang, uavhengig av databasedriver
+(DB-API 2.0), f.eks. pypyodbc mot Mamut eller sqlite3 lokalt:
+- SqlServerBackend      Mamut-databasen på SQL Server (ODBC)
+- SqliteBackend         Lokal SQLite-database, f.eks. testdata
+- get_backend           Velg database ut fra konfigurasjon
+- StatementCache        Gjenbruk av forberedte SQL-setninger
+- ConnectionPool        Gjenbruk av åpne databasetilkoblinger
+- ResultCache           Cache av spørreresultater med levetid (TTL)
+- SingleFlight          Like spørringer som kjører samtidig, kjøres én gang
+- normalize_sql         SQL-tekst uten forskjeller i mellomrom
+- QueryStats            Tidsmåling per kallsted og logg for trege spørringer
+- autoconvert           Typecasting av enkeltverdi fra database
+- build_converters      Velg typecasting per kolonne i spørreresultat
+- convert_rows          Typecast spørreresultat kolonnevis
+- convert_columns       Som convert_rows, men returner kolonner
+- make_column_arrays    Kolonner som typede arrays (NumPy hvis installert)
+"""
+
+
+# Antall rader som undersøkes ved valg av typecasting per kolonne
+CONVERTER_SAMPLE_SIZE = 50
+
+# Samme mønster som pendulum.from_format(val, 'YYYY-MM-DD HH:mm:SS')
+# gir. NB: 'SS' er hundredeler i pendulum, ikke sekunder, slik at
+# '2021-05-04 10:20:30' blir 10:20:00.30. Beholdt for å gi samme
+# resultat som tidligere.
+_DATETIME_RE = re.compile(
+    r'(\d{1,4})-(\d\d?)-([0-9 ]\d?) (\d\d?):(\d\d?):(\d{1,3})')
+
+# Mulige førstetegn i tekst som float() kan tolke
+_FLOAT_START_CHARS = frozenset('+-.iInN')
+
+# Største heltall som kan gå via float uten tap av presisjon
+_MAX_EXACT_INT = 2 ** 53
+
+
+class SqlServerBackend:
+    """Mamut-databasen på SQL Server, via pypyodbc.
+
+    :param connection_string: ODBC-tilkoblingsstreng
+    """
+
+    name = 'sqlserver'
+    # Støtter CROSS/OUTER APPLY, se MamutManager.get_order_properties
+    is_apply_supported = True
+
+    def __init__(self, connection_string: str = (r'Driver={SQL Server};'
+                                                 r'Server=[SERVER NAME]t;'
+                                                 r'Database=[DB NAME];'
+                                                 r'uid=[UID];'
+                                                 r'pwd=[PWD]'),
+                 ) -> None:
+        self.connection_string = connection_string
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}()'
+
+    def connect(self):
+        """Åpne ny tilkobling mot Mamut-databasen."""
+        # Importeres ved behov, slik at okn_db kan brukes uten
+        # ODBC-driver, f.eks. mot SQLite
+        import pypyodbc
+
+        # autocommit, slik at gjenbrukte tilkoblinger ikke blir stående
+        # med åpen transaksjon mellom spørringene
+        return pypyodbc.connect(self.connection_string, autocommit=True)
+
+
+class _ChecksumAgg:
+    """Som CHECKSUM_AGG i SQL Server, for SqliteBackend: XOR av
+    heltallene, uavhengig av rekkefølge. NULL hoppes over."""
+
+    def __init__(self) -> None:
+        self.checksum = None
+
+    def step(self, val) -> None:
+        if val is not None:
+            self.checksum = (self.checksum or 0) ^ int(val)
+
+    def finalize(self):
+        return self.checksum
+
+
+class SqliteBackend:
+    """Lokal SQLite-database med samme tabeller som Mamut.
+
+    Brukes f.eks. med testdata fra okn_db_fixtures, for testing og
+    ytelsesmåling uten tilgang til Mamut-serveren. Funksjoner som
+    mangler i SQLite (CONCAT, CHECKSUM, CHECKSUM_AGG, HASHBYTES)
+    legges til per tilkobling.
+
+    :param path: Sti til SQLite-databasefil
+    """
+
+    name = 'sqlite'
+    is_apply_supported = False
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.path!r})'
+
+    def connect(self):
+        """Åpne ny tilkobling mot SQLite-databasen."""
+        # Tilkoblinger lånes ut fra pool til én tråd om gangen
+        conn = sqlite3.connect(self.path, check_same_thread=False,
+                               isolation_level=None)
+        conn.create_function(
+            'CONCAT', -1,
+            lambda *args: ''.join('' if e is None else str(e) for e in args),
+            deterministic=True)
+        # Som CHECKSUM i SQL Server: heltall som endres med verdiene
+        conn.create_function(
+            'CHECKSUM', -1,
+            lambda *args: zlib.crc32(repr(args).encode()) - 2 ** 31,
+            deterministic=True)
+        conn.create_aggregate('CHECKSUM_AGG', 1, _ChecksumAgg)
+        # Som HASHBYTES i SQL Server, f.eks. HASHBYTES('SHA2_256', tekst)
+        conn.create_function(
+            'HASHBYTES', 2,
+            lambda algorithm, val: None if val is None else hashlib.new(
+                algorithm.lower().replace('sha2_', 'sha'),
+                str(val).encode()).digest(),
+            deterministic=True)
+        return conn
+
+
+def get_backend(name: str | None = None):
+    """Velg database ut fra konfigurasjon.
+
+    :param name: 'sqlserver' eller 'sqlite'. Standard er
+        miljøvariabelen OKN_DB_BACKEND, evt. 'sqlserver'. For
+        'sqlite' angis databasefil med OKN_DB_SQLITE_PATH.
+    """
+    name = (name or os.environ.get('OKN_DB_BACKEND', 'sqlserver')).lower()
+    if name == 'sqlserver':
+        return SqlServerBackend()
+    elif name == 'sqlite':
+        path = os.environ.get('OKN_DB_SQLITE_PATH')
+        assert path, "OKN_DB_SQLITE_PATH må angi SQLite-databasefil"
+        return SqliteBackend(path)
+    raise ValueError(f"Ukjent database-backend {name}, forventet "
+                     "'sqlserver' eller 'sqlite'")
+
+
+class StatementCache:
+    """Cache av forberedte SQL-setninger for én databasetilkobling.
+
+    Én cursor per SQL-tekst, forberedt med cursor.prepare dersom
+    driveren har dette (pypyodbc). Med bind-parametere (?) i stedet
+    for verdier i SQL-teksten kan samme setning og spørreplan
+    dermed gjenbrukes for alle verdier. Eldste setning lukkes når
+    cachen er full.
+
+    :param conn: DB-API-tilkobling
+    :param max_size: Maks antall cachede setninger
+
+    Eksempel:
+        statements = StatementCache(conn)
+        cursor = statements.execute('SELECT name FROM g_contac '
+                                    'WHERE custid = ?', [1234])
+        rows = cursor.fetchall()
+        statements.release('SELECT name ...', cursor)
+    """
+
+    def __init__(self, conn, *, max_size: int = 32) -> None:
+        self.conn = conn
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cursors: collections.OrderedDict = collections.OrderedDict()
+
+    def acquire(self, sql_statement: str):
+        """Lån cursor forberedt for sql_statement."""
+        cursor = self._cursors.pop(sql_statement, None)
+        if cursor is not None:
+            self.hits += 1
+            return cursor
+        self.misses += 1
+        cursor = self.conn.cursor()
+        if hasattr(cursor, 'prepare'):
+            cursor.prepare(sql_statement)
+        return cursor
+
+    def execute(self, sql_statement: str, params=None):
+        """Lån cursor og eksekver sql_statement med params."""
+        cursor = self.acquire(sql_statement)
+        try:
+            cursor.execute(sql_statement, list(params or ()))
+        except Exception:
+            cursor.close()
+            raise
+        return cursor
+
+    def release(self, sql_statement: str, cursor) -> None:
+        """Lever cursor tilbake, resultatet må være ferdig lest."""
+        old_cursor = self._cursors.pop(sql_statement, None)
+        if old_cursor is not None:
+            old_cursor.close()
+        self._cursors[sql_statement] = cursor
+        while len(self._cursors) > self.max_size:
+            self._cursors.popitem(last=False)[1].close()
+
+    def close(self) -> None:
+        """Lukk alle cachede cursorer."""
+        for cursor in self._cursors.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        self._cursors.clear()
+
+
+class ConnectionPool:
+    """Begrenset pool av gjenbrukbare databasetilkoblinger.
+
+    Tilkoblinger opprettes ved behov via connect, og legges tilbake
+    i poolen etter bruk i stedet for å lukkes. Sist brukte tilkobling
+    lånes ut først, slik at varme tilkoblinger gjenbrukes og de
+    øvrige kan utløpe etter idle_timeout.
+
+    :param connect: Funksjon uten argumenter som returnerer ny
+        DB-API-tilkobling
+    :param max_size: Maks antall samtidig åpne tilkoblinger
+    :param idle_timeout: Sekunder en ubrukt tilkobling kan ligge i
+        poolen før den lukkes
+    :param checkout_timeout: Sekunder det ventes på ledig tilkobling
+        før TimeoutError
+    :param check_idle_after: Tilkoblinger som har ligget ubrukt
+        lenger enn dette (sekunder) helsesjekkes ved utlån
+    :param ping_sql: SQL-setning brukt ved helsesjekk
+    :param statement_cache_size: Maks antall forberedte SQL-setninger
+        per tilkobling, se statements()
+
+    Eksempel:
+        pool = ConnectionPool(lambda: sqlite3.connect('test.db'))
+        with pool.connection() as conn:
+            conn.cursor().execute('SELECT 1')
+        pool.close()
+    """
+
+    def __init__(self,
+                 connect,
+                 *,
+                 max_size: int = 4,
+                 idle_timeout: float = 300.,
+                 checkout_timeout: float = 10.,
+                 check_idle_after: float = 5.,
+                 ping_sql: str = 'SELECT 1',
+                 statement_cache_size: int = 32,
+                 ) -> None:
+        assert max_size >= 1, f"max_size må være minst 1, mottok {max_size}"
+        self._connect = connect
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.check_idle_after = check_idle_after
+        self.ping_sql = ping_sql
+        self.statement_cache_size = statement_cache_size
+
+        self._cond = threading.Condition()
+        self._idle: list = []           # [(tilkobling, sist brukt), ...]
+        self._size = 0                  # Åpne tilkoblinger, inkl. utlånte
+        self._is_closed = False
+        self._statement_caches: dict = {}   # {id(tilkobling): cache}
+        self._statement_stats = dict(hits=0, misses=0)
+        self._stats = dict(hits=0, misses=0, checkouts=0, discarded=0,
+                           wait_total=0., wait_max=0.)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _close_conn(self, conn) -> None:
+        """Lukk tilkobling, feil ved lukking ignoreres."""
+        statements = self._statement_caches.pop(id(conn), None)
+        try:
+            if statements is not None:
+                with self._cond:
+                    self._statement_stats['hits'] += statements.hits
+                    self._statement_stats['misses'] += statements.misses
+                statements.close()
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn) -> bool:
+        """Helsesjekk av tilkobling med enkel SQL-setning."""
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.ping_sql)
+            cursor.fetchall()
+            cursor.close()
+        except Exception:
+            return False
+        return True
+
+    def _evict_expired(self, now: float) -> list:
+        """Fjern utløpte tilkoblinger fra poolen, kalles med lås."""
+        expired = [conn for conn, last_used in self._idle
+                   if now - last_used > self.idle_timeout]
+        if expired:
+            self._idle = [(conn, last_used) for conn, last_used in self._idle
+                          if now - last_used <= self.idle_timeout]
+            self._size -= len(expired)
+        return expired
+
+    def acquire(self):
+        """Lån tilkobling fra poolen, opprett ny ved behov.
+
+        Venter inntil checkout_timeout sekunder dersom alle
+        tilkoblinger er utlånt.
+        """
+        t_start = time.monotonic()
+        while True:
+            conn = None
+            idle_time = 0.
+            is_new = False
+            is_timeout = False
+            expired: list = []
+            with self._cond:
+                assert not self._is_closed, "Tilkoblingspoolen er lukket"
+                while True:
+                    now = time.monotonic()
+                    expired += self._evict_expired(now)
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        idle_time = now - last_used
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        is_new = True
+                        break
+                    remaining = self.checkout_timeout - (now - t_start)
+                    if remaining <= 0:
+                        is_timeout = True
+                        break
+                    self._cond.wait(remaining)
+
+            for expired_conn in expired:
+                self._close_conn(expired_conn)
+
+            if is_timeout:
+                raise TimeoutError(
+                    "Ingen ledig databasetilkobling etter "
+                    f"{self.checkout_timeout} sek (max_size={self.max_size})")
+
+            if is_new:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif (idle_time > self.check_idle_after
+                  and not self._is_healthy(conn)):
+                # Død tilkobling, forkast og prøv på nytt
+                self._close_conn(conn)
+                with self._cond:
+                    self._size -= 1
+                    self._stats['discarded'] += 1
+                    self._cond.notify()
+                continue
+
+            wait_time = time.monotonic() - t_start
+            with self._cond:
+                self._stats['checkouts'] += 1
+                self._stats['misses' if is_new else 'hits'] += 1
+                self._stats['wait_total'] += wait_time
+                self._stats['wait_max'] = max(self._stats['wait_max'],
+                                              wait_time)
+            return conn
+
+    def release(self, conn, *, discard: bool = False) -> None:
+        """Lever tilkobling tilbake til poolen.
+
+        Med discard=True, eller dersom poolen er lukket, lukkes
+        tilkoblingen i stedet.
+        """
+        with self._cond:
+            if discard or self._is_closed:
+                self._size -= 1
+                if discard:
+                    self._stats['discarded'] += 1
+                is_kept = False
+            else:
+                self._idle.append((conn, time.monotonic()))
+                is_kept = True
+            self._cond.notify()
+        if not is_kept:
+            self._close_conn(conn)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Lån tilkobling i with-blokk.
+
+        Ved unntak i blokken forkastes tilkoblingen, da den kan være
+        i ukjent tilstand.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self) -> None:
+        """Lukk alle ledige tilkoblinger, utlånte lukkes ved retur."""
+        with self._cond:
+            self._is_closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, __ in idle:
+            self._close_conn(conn)
+
+    def statements(self, conn) -> StatementCache:
+        """Returner cache av forberedte SQL-setninger for tilkobling.
+
+        Cachen følger tilkoblingen, og lukkes sammen med denne.
+        """
+        statements = self._statement_caches.get(id(conn))
+        if statements is None or statements.conn is not conn:
+            statements = StatementCache(conn,
+                                        max_size=self.statement_cache_size)
+            self._statement_caches[id(conn)] = statements
+        return statements
+
+    def statement_stats(self) -> dict:
+        """Returner treff og bom for cache av forberedte SQL-setninger."""
+        with self._cond:
+            stats = dict(self._statement_stats)
+            for statements in list(self._statement_caches.values()):
+                stats['hits'] += statements.hits
+                stats['misses'] += statements.misses
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.
+        return stats
+
+    def stats(self) -> dict:
+        """Returner statistikk for poolen.
+
+        hits: utlån av eksisterende tilkobling
+        misses: utlån som krevde ny tilkobling
+        wait_total, wait_max: ventetid ved utlån (sekunder)
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+        stats['wait_avg'] = (stats['wait_total'] / stats['checkouts']
+                             if stats['checkouts'] else 0.)
+        return stats
+
+
+class ResultCache:
+    """Cache av spørreresultater, med levetid per spørringsfamilie.
+
+    Hvert resultat lagres under en familie (f.eks. 'customer'), som
+    bestemmer levetiden, og evt. merkelapper (tags) som gjør det
+    mulig å fjerne alle resultater knyttet til f.eks. en ordre.
+    Når cachen er full, fjernes minst nylig brukte resultat.
+
+    Resultatene kopieres rad for rad ved lagring og uthenting, slik
+    at endringer hos kaller ikke påvirker cachen.
+
+    :param ttls: dict med levetid i sekunder per familie
+    :param max_size: Maks antall resultater i cachen
+    :param clock: Tidsfunksjon, kan byttes ut ved testing
+
+    Eksempel:
+        cache = ResultCache(ttls={'customer': 3600.})
+        cache.put(key, rows, family='customer', tags=[('cust', 1234)])
+        is_found, rows = cache.get(key)
+        cache.invalidate(tag=('cust', 1234))
+    """
+
+    def __init__(self, *,
+                 ttls: dict,
+                 max_size: int = 512,
+                 clock=time.monotonic,
+                 ) -> None:
+        self.ttls = dict(ttls)
+        self.max_size = max_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        # {nøkkel: (utløpstid, familie, tags, resultat)}
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+        self._keys_by_tag: dict = collections.defaultdict(set)
+        self._stats = dict(hits=0, misses=0, expired=0, evicted=0,
+                           invalidated=0)
+
+    @staticmethod
+    def _copy_rows(rows) -> list:
+        return [copy.copy(row) if row is not None else None for row in rows]
+
+    def _remove(self, key) -> None:
+        """Fjern resultat, kalles med lås."""
+        __, __, tags, __ = self._entries.pop(key)
+        for tag in tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+    def get(self, key) -> tuple[bool, list | None]:
+        """Hent kopi av resultat, returner (funnet, resultat)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return False, None
+            if entry[0] <= self._clock():
+                self._remove(key)
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            rows = entry[3]
+        return True, self._copy_rows(rows)
+
+    def put(self, key, rows, *, family: str, tags=()) -> None:
+        """Lagre kopi av resultat under familie og evt. tags."""
+        assert family in self.ttls, \
+            f"Ukjent familie {family}, forventet en av {list(self.ttls)}"
+        rows = self._copy_rows(rows)
+        tags = tuple(tags)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self._clock() + self.ttls[family],
+                                  family, tags, rows)
+            for tag in tags:
+                self._keys_by_tag[tag].add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self._stats['evicted'] += 1
+
+    def invalidate(self, *, family: str | None = None, tag=None) -> int:
+        """Fjern resultater i familie og/eller med tag.
+
+        Uten argumenter tømmes hele cachen. Returnerer antall
+        fjernede resultater.
+        """
+        with self._lock:
+            if tag is not None:
+                keys = set(self._keys_by_tag.get(tag, ()))
+            else:
+                keys = set(self._entries)
+            if family is not None:
+                keys = {key for key in keys
+                        if self._entries[key][1] == family}
+            for key in keys:
+                self._remove(key)
+            self._stats['invalidated'] += len(keys)
+        return len(keys)
+
+    def stats(self) -> dict:
+        """Returner statistikk for cachen."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.
+        return stats
+
+
+class _Flight:
+    """Operasjon som kjører i SingleFlight."""
+
+    __slots__ = ('owner', 'event', 'waiter_count', 'result', 'error')
+
+    def __init__(self, owner: int) -> None:
+        self.owner = owner
+        self.event = threading.Event()
+        self.waiter_count = 0
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Samkjøring av like operasjoner som kjører samtidig.
+
+    Kall med samme nøkkel som en operasjon som allerede kjører, venter
+    på denne og får kopi av resultatet (evt. samme unntak), i stedet
+    for å kjøre operasjonen på nytt. Har noen ventet, får også den
+    som kjørte operasjonen kopi, slik at ingen kallere deler
+    resultatobjekt. Nøkler som ikke kan hashes kjøres uten samkjøring.
+
+    :param copy_result: Funksjon som kopierer resultat
+
+    Eksempel:
+        flights = SingleFlight()
+        rows, is_shared = flights.run(key, lambda: execute(sql, params))
+    """
+
+    def __init__(self, *, copy_result=copy.copy) -> None:
+        self._copy_result = copy_result
+        self._lock = threading.Lock()
+        # {nøkkel: _Flight}
+        self._flights: dict = {}
+        self._stats = dict(executions=0, shared=0)
+
+    def run(self, key, func) -> tuple:
+        """Kjør func, eller vent på kjørende operasjon med samme nøkkel.
+
+        Returnerer (resultat, is_shared), der is_shared angir at
+        resultatet kom fra en annen kallers kjøring.
+        """
+        try:
+            hash(key)
+            is_hashable = True
+        except TypeError:
+            is_hashable = False
+
+        owner = threading.get_ident()
+        is_leader = False
+        with self._lock:
+            flight = self._flights.get(key) if is_hashable else None
+            if flight is None and is_hashable:
+                flight = self._flights[key] = _Flight(owner)
+                is_leader = True
+            elif flight is not None and flight.owner != owner:
+                flight.waiter_count += 1
+            else:
+                # Uten samkjøring, eller samme nøkkel fra func selv, som
+                # ellers ville ventet på seg selv
+                flight = None
+            self._stats['executions' if flight is None or is_leader
+                        else 'shared'] += 1
+        if flight is None:
+            return func(), False
+
+        if not is_leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return self._copy_result(flight.result), True
+
+        try:
+            flight.result = func()
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                has_waiters = flight.waiter_count > 0
+            flight.event.set()
+        # Ventende kallere kopierer flight.result, som ikke gis videre
+        if has_waiters:
+            return self._copy_result(flight.result), False
+        return flight.result, False
+
+    def stats(self) -> dict:
+        """Returner antall kjøringer, delte resultater og andel spart."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._flights)
+        calls = stats['executions'] + stats['shared']
+        stats['saved_rate'] = stats['shared'] / calls if calls else 0.
+        return stats
+
+
+# SQL-tekst deles i strenger/navn i anførselstegn eller klammer, som
+# beholdes, og mellomrom, som slås sammen
+_SQL_TOKEN_RE = re.compile(r"""('(?:[^']|'')*'|"[^"]*"|\[[^\]]*\])|\s+""")
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql_statement: str) -> str:
+    """SQL-tekst med mellomrom og linjeskift slått sammen til ett.
+
+    Tekst i anførselstegn og klammer ([navn]) endres ikke. Brukes
+    som nøkkel for like spørringer, f.eks. i SingleFlight.
+    """
+    return _SQL_TOKEN_RE.sub(lambda match: match.group(1) or ' ',
+                             sql_statement).strip()
+
+
+class QueryStats:
+    """Tidsmåling av spørringer, samlet per kallsted.
+
+    For hver spørring registreres total tid og tid per fase (connect,
+    execute, fetch, convert), antall rader og kolonner, og metoden som
+    gjorde spørringen. Per kallsted samles antall, tider og histogram
+    over total tid (grenser i HISTOGRAM_BOUNDS). Spørringer som tar
+    lengre tid enn slow_threshold skrives til loggeren
+    'okn_db.slow_query' med SQL-tekst og bind-parametere, og til
+    roterende loggfil dersom slow_log_path er gitt.
+
+    :param slow_threshold: Sekunder før spørring regnes som treg
+    :param slow_log_path: Loggfil for trege spørringer
+    :param max_bytes: Maks størrelse per loggfil før rotering
+    :param backup_count: Antall gamle loggfiler som beholdes
+    :param is_enabled: False slår av registrering
+
+    Eksempel:
+        stats = QueryStats(slow_threshold=0.2, slow_log_path='slow.log')
+        stats.record('MamutManager.open_customer', sql_statement=sql,
+                     params=[1234], elapsed=0.3, rows=1, cols=1,
+                     phases=dict(connect=0.01, execute=0.25, fetch=0.03,
+                                 convert=0.01))
+        print(stats.format_report())
+    """
+
+    PHASES = ('connect', 'execute', 'fetch', 'convert')
+    # Øvre grenser (sekunder) for histogram, siste bøtte er uten grense
+    HISTOGRAM_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05,
+                        0.1, 0.2, 0.5, 1., 2., 5.)
+
+    def __init__(self, *,
+                 slow_threshold: float = 0.5,
+                 slow_log_path: str | None = None,
+                 max_bytes: int = 1_000_000,
+                 backup_count: int = 5,
+                 is_enabled: bool = True,
+                 ) -> None:
+        self.slow_threshold = slow_threshold
+        self.is_enabled = is_enabled
+        self._lock = threading.Lock()
+        self._call_sites: dict = {}
+        self.slow_logger = logging.getLogger('okn_db.slow_query')
+        # Ingen utskrift til konsoll uten konfigurert logging
+        if not self.slow_logger.handlers:
+            self.slow_logger.addHandler(logging.NullHandler())
+        if slow_log_path is not None:
+            self._add_log_file(slow_log_path, max_bytes, backup_count)
+
+    def _add_log_file(self, path, max_bytes, backup_count) -> None:
+        """Legg til roterende loggfil, én gang per fil."""
+        path = os.path.abspath(path)
+        for handler in self.slow_logger.handlers:
+            if getattr(handler, 'baseFilename', None) == path:
+                return None
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count,
+            encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        self.slow_logger.addHandler(handler)
+        self.slow_logger.setLevel(logging.WARNING)
+        return None
+
+    @staticmethod
+    def call_site(skip_names=(), depth: int = 2) -> str:
+        """Navn på metoden som kalte, f.eks. 'MamutManager.open_customer'.
+
+        :param skip_names: Funksjonsnavn som hoppes over, f.eks.
+            hjelpemetoder som videresender spørringen
+        :param depth: Antall rammer opp til første kandidat
+        """
+        frame = sys._getframe(depth)
+        while frame is not None and frame.f_code.co_name in skip_names:
+            frame = frame.f_back
+        if frame is None:
+            return '<ukjent>'
+        code = frame.f_code
+        return getattr(code, 'co_qualname', code.co_name)
+
+    def record(self, call_site: str, *,
+               sql_statement: str,
+               params,
+               elapsed: float,
+               rows: int,
+               cols: int,
+               phases: dict | None = None,
+               is_cached: bool = False) -> None:
+        """Registrer én spørring.
+
+        :param elapsed: Total tid (sekunder)
+        :param phases: Tid per fase i PHASES, mangler ved treff i cache
+        :param is_cached: Resultatet kom fra cache
+        """
+        with self._lock:
+            site = self._call_sites.get(call_site)
+            if site is None:
+                site = self._call_sites[call_site] = dict(
+                    count=0, cached=0, total=0., max=0., rows=0, cols=0,
+                    phases=dict.fromkeys(self.PHASES, 0.),
+                    histogram=[0] * (len(self.HISTOGRAM_BOUNDS) + 1))
+            site['count'] += 1
+            site['total'] += elapsed
+            if elapsed > site['max']:
+                site['max'] = elapsed
+            site['rows'] += rows
+            site['cols'] = cols
+            site['histogram'][
+                bisect.bisect_left(self.HISTOGRAM_BOUNDS, elapsed)] += 1
+            if is_cached:
+                site['cached'] += 1
+            if phases:
+                site_phases = site['phases']
+                for phase, phase_time in phases.items():
+                    site_phases[phase] += phase_time
+
+        if elapsed >= self.slow_threshold:
+            phases_text = ' '.join(f'{phase}={phase_time * 1000:.1f}'
+                                   for phase, phase_time
+                                   in (phases or {}).items())
+            self.slow_logger.warning(
+                "%.1f ms %s rows=%d cols=%d %s sql=%r params=%r",
+                elapsed * 1000, call_site, rows, cols, phases_text,
+                ' '.join(sql_statement.split()), list(params or ()))
+        return None
+
+    def stats(self) -> dict:
+        """Kopi av statistikk per kallsted, med snittid (mean)."""
+        with self._lock:
+            call_sites = {
+                call_site: dict(site, phases=dict(site['phases']),
+                                histogram=list(site['histogram']))
+                for call_site, site in self._call_sites.items()}
+        for site in call_sites.values():
+            site['mean'] = site['total'] / site['count']
+        return call_sites
+
+    def reset(self) -> None:
+        """Nullstill statistikken."""
+        with self._lock:
+            self._call_sites.clear()
+        return None
+
+    def format_report(self) -> str:
+        """Tabell over kallsteder, sortert etter samlet tid."""
+        lines = [f"{'Kallsted':<48}{'antall':>8}{'cache':>7}"
+                 f"{'snitt ms':>10}{'maks ms':>10}{'sum ms':>10}"]
+        call_sites = sorted(self.stats().items(),
+                            key=lambda item: -item[1]['total'])
+        for call_site, site in call_sites:
+            lines.append(f"{call_site[:47]:<48}{site['count']:>8}"
+                         f"{site['cached']:>7}"
+                         f"{site['mean'] * 1000:>10.1f}"
+                         f"{site['max'] * 1000:>10.1f}"
+                         f"{site['total'] * 1000:>10.1f}")
+        return '\n'.join(lines)
+
+
+def _parse_datetime(val: str):
+    """Rask erstatning for pendulum.from_format(val, 'YYYY-MM-DD HH:mm:SS').
+
+    Returnerer pendulum.DateTime, eller None dersom val ikke er
+    gyldig tidspunkt.
+    """
+    match = _DATETIME_RE.fullmatch(val)
+    if match is None:
+        return None
+    year, month, day, hour, minute, hundredths = match.groups()
+    try:
+        return pendulum.datetime(int(year), int(month), int(day),
+                                 int(hour), int(minute), 0,
+                                 int(hundredths) * 10000)
+    except ValueError:
+        return None
+
+
+def _is_leading_zero_str(val: str) -> bool:
+    """Angi om tekst har innledende null, og dermed ikke skal typecastes."""
+    return val != '0' and val.startswith('0') and not val.startswith('0.')
+
+
+def _convert_text(val: str):
+    """Typecast tekst som allerede er strippet for mellomrom."""
+    if _is_leading_zero_str(val):
+        return val
+    # float() feiler uansett for tekst som ikke starter med siffer,
+    # fortegn, punktum, inf eller nan - unngår kostbart unntak
+    if val and (val[0].isdecimal() or val[0] in _FLOAT_START_CHARS):
+        try:
+            num = float(val)
+        except ValueError:
+            pass
+        else:
+            return int(num) if num.is_integer() else num
+    parsed = _parse_datetime(val)
+    return val if parsed is None else parsed
+
+
+def autoconvert(val):
+    """Typecaster verdi til mest passende type.
+
+    Verdier hentet via SQL-spørring har allerede variabeltypen
+    slik den er definert i Mamut-databasen, men det kan være
+    hensiktsmessig å overstyre typen og bearbeide/parse
+    verdiene ytterligere. Returnerer verdi av type
+    bool, int, float, pendulum.datetime eller str.
+
+    Eksempel:
+        1234 -> int
+        '1234' -> int
+        '1234.0' -> int
+        '1234.5' -> float
+        '01234' -> str
+        '0' -> int
+    """
+    if isinstance(val, bool) or val is None:
+        return val
+    # Uvisst om replace er nødvendig
+    return _convert_text(str(val).strip().replace('\r', '\n'))
+
+
+def _convert_passthrough(val):
+    """Typecasting for kolonne med bool-verdier."""
+    if val is None or type(val) is bool:
+        return val
+    return autoconvert(val)
+
+
+def _convert_int(val):
+    """Typecasting for kolonne med int-verdier."""
+    if type(val) is int and -_MAX_EXACT_INT <= val <= _MAX_EXACT_INT:
+        return val
+    return autoconvert(val)
+
+
+def _convert_float(val):
+    """Typecasting for kolonne med float-verdier."""
+    if type(val) is float:
+        return int(val) if val.is_integer() else val
+    return autoconvert(val)
+
+
+def _convert_str(val):
+    """Typecasting for kolonne med tekstverdier."""
+    if type(val) is str:
+        return _convert_text(val.strip().replace('\r', '\n'))
+    return autoconvert(val)
+
+
+def _convert_leading_zero_str(val):
+    """Typecasting for tekstkolonne med innledende null, f.eks. postnr."""
+    if type(val) is str:
+        val = val.strip().replace('\r', '\n')
+        return val if _is_leading_zero_str(val) else _convert_text(val)
+    return autoconvert(val)
+
+
+def _convert_datetime(val):
+    """Typecasting for kolonne med datetime-verdier."""
+    # str(val) gir 'YYYY-MM-DD HH:MM:SS' kun uten mikrosekunder og
+    # tidssone, og år før 1000 gir innledende null (-> str)
+    if (type(val) is datetime.datetime and not val.microsecond
+            and val.tzinfo is None and val.year >= 1000):
+        return pendulum.datetime(val.year, val.month, val.day,
+                                 val.hour, val.minute, 0,
+                                 val.second * 10000)
+    return autoconvert(val)
+
+
+_CONVERTER_BY_TYPE = {
+    bool: _convert_passthrough,
+    int: _convert_int,
+    float: _convert_float,
+    str: _convert_str,
+    datetime.datetime: _convert_datetime,
+}
+
+
+def build_converters(description, sample_rows) -> list:
+    """Velg én typecasting-funksjon per kolonne.
+
+    Valget gjøres ut fra typene i første rader (sample_rows), evt.
+    type_code i cursor.description dersom kolonnen bare har None.
+    Alle funksjonene gir samme resultat som autoconvert, også for
+    verdier som avviker fra kolonnens forventede type.
+
+    :param description: cursor.description fra DB-API-spørring
+    :param sample_rows: De første radene i spørreresultatet
+    """
+    converters = []
+    for idx, col_descr in enumerate(description):
+        sample_types = {type(row[idx]) for row in sample_rows
+                        if row[idx] is not None}
+        if not sample_types and isinstance(col_descr[1], type):
+            sample_types = {col_descr[1]}
+
+        if sample_types == {str} and all(
+                _is_leading_zero_str(row[idx].strip())
+                for row in sample_rows if row[idx] is not None):
+            converter = _convert_leading_zero_str
+        elif len(sample_types) == 1:
+            converter = _CONVERTER_BY_TYPE.get(sample_types.pop(),
+                                               autoconvert)
+        else:
+            converter = autoconvert
+        converters.append(converter)
+    return converters
+
+
+def convert_columns(rows, converters) -> list:
+    """Typecast rader kolonnevis, returner liste med én liste per
+    kolonne."""
+    if not rows:
+        return [[] for __ in converters]
+    return [list(map(converter, column))
+            for converter, column in zip(converters, zip(*rows))]
+
+
+def convert_rows(rows, converters) -> list:
+    """Typecast rader kolonnevis, returner liste av tupler."""
+    if not rows:
+        return []
+    return list(zip(*convert_columns(rows, converters)))
+
+
+def _import_numpy():
+    """NumPy hvis installert, ellers None."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _to_utc_naive(val: datetime.datetime) -> datetime.datetime:
+    """Datetime uten tidssone, i UTC (for datetime64)."""
+    if val.tzinfo is not None:
+        val = val.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return val
+
+
+def _column_kind(column) -> str:
+    """Kolonnetype ut fra typecastede verdier: 'bool', 'int',
+    'float', 'datetime' eller 'object'."""
+    val_types = set(map(type, column))
+    has_none = type(None) in val_types
+    val_types.discard(type(None))
+    if not val_types:
+        return 'object'
+    if val_types == {bool}:
+        return 'object' if has_none else 'bool'
+    if val_types == {int} and not has_none:
+        if all(-2 ** 63 <= val < 2 ** 63 for val in column):
+            return 'int'
+        return 'object'
+    if val_types <= {int, float}:
+        return 'float'
+    if all(issubclass(val_type, datetime.datetime)
+           for val_type in val_types):
+        return 'datetime'
+    return 'object'
+
+
+def make_column_arrays(col_headers, columns) -> dict:
+    """Lag typet array per kolonne fra convert_columns.
+
+    Med NumPy (valgfritt, importeres ved første kall):
+        bool          -> bool
+        int           -> int64
+        int/float     -> float64, None blir nan
+        datetime      -> datetime64[us] i UTC, None blir NaT
+        øvrige        -> object (str m.m. uendret)
+    Uten NumPy brukes array.array('q') og array.array('d') for tall,
+    og liste for øvrige kolonner.
+
+    Returnerer dict {kolonnenavn: array} i kolonnerekkefølge.
+    """
+    numpy = _import_numpy()
+    arrays = {}
+    for col_header, column in zip(col_headers, columns):
+        kind = _column_kind(column)
+        if kind == 'float':
+            column = [float('nan') if val is None else val
+                      for val in column]
+        elif kind == 'datetime':
+            column = [None if val is None else _to_utc_naive(val)
+                      for val in column]
+
+        if numpy is not None:
+            dtype = dict(bool=bool, int=numpy.int64, float=numpy.float64,
+                         datetime='datetime64[us]').get(kind, object)
+            if dtype is object:
+                col_array = numpy.empty(len(column), dtype=object)
+                col_array[:] = column
+            else:
+                col_array = numpy.array(column, dtype=dtype)
+        elif kind == 'int':
+            col_array = array.array('q', column)
+        elif kind == 'float':
+            col_array = array.array('d', column)
+        else:
+            col_array = column
+        arrays[col_header] = col_array
+    return arrays
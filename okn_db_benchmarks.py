@@ -0,0 +1,486 @@
+# -*- encoding: utf-8 -*-#
+# !/usr/bin/python
+
+# Standardbibliotek import
+import contextlib
+import datetime
+import gc
+import io
+import os
+import random
+import tempfile
+import statistics
+import time
+import tracemalloc
+
+# Lokal applikasjon import
+from okn_basic_classes import NamedList, make_lazy_record_class, \
+    make_record_class
+from okn_db import CONVERTER_SAMPLE_SIZE, build_converters, convert_rows
+
+__author__ = 'Øyvind Nystad'
+
+"""
+Ytelsesmålinger for databaselaget, kjøres med
+python okn_db_benchmarks.py:
+- bench_records         Record mot NamedList, minne og oppretting
+- bench_order_properties  Én SQL-setning mot tre spørringer per ordre
+- bench_fixture_queries Spørringer mot syntetiske data i SQLite
+- bench_serial_number_masks  Masker for alle apparater i én spørring
+- bench_query_stats     Kostnad ved tidsmåling av lookup_db
+- bench_columns         Records mot kolonner (as_columns) for analyse
+- bench_lazy_records    Typecasting ved lesing (is_lazy) mot med en gang
+"""
+
+
+def _measure(func, *, repeat: int = 5) -> tuple[float, int]:
+    """Mål kjøretid og minnebruk for func.
+
+    Returnerer beste kjøretid (sekunder) av repeat forsøk, og
+    minnebruk (bytes) for objektene func returnerer.
+    """
+    best_time = float('inf')
+    for __ in range(repeat):
+        gc.collect()
+        t_start = time.perf_counter()
+        result = func()
+        best_time = min(best_time, time.perf_counter() - t_start)
+        del result
+
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    mem_usage = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return best_time, mem_usage
+
+
+def _print_result(title: str, results: dict, row_count: int) -> None:
+    """Skriv ut kjøretid og minnebruk per variant."""
+    print(f"\n{title.upper()}")
+    for name, (run_time, mem_usage) in results.items():
+        print(f"{name:<24}{run_time * 1000:10.1f} ms"
+              f"{mem_usage / row_count:10.0f} bytes/rad")
+
+
+def bench_records(row_count: int = 10000, col_count: int = 6) -> dict:
+    """Sammenlign Record og NamedList for rader fra lookup_db.
+
+    Returnerer dict med (kjøretid, minnebruk) per variant.
+    """
+    col_headers = tuple(f'col_{idx}' for idx in range(col_count))
+    rows = [tuple(f'{row_idx}-{idx}' for idx in range(col_count))
+            for row_idx in range(row_count)]
+
+    def _named_lists():
+        return [NamedList(**dict(zip(col_headers, row))) for row in rows]
+
+    def _records():
+        record_cls = make_record_class(col_headers)
+        return [record_cls(*row) for row in rows]
+
+    # Kontroller at variantene er likeverdige før måling
+    assert _named_lists()[-1] == _records()[-1], "Ulikt resultat"
+
+    # Minnebruk for radverdiene selv trekkes ikke fra, de er like
+    results = {
+        'NamedList': _measure(_named_lists),
+        'Record': _measure(_records),
+    }
+    _print_result(f'{row_count} rader x {col_count} kolonner', results,
+                  row_count)
+    return results
+
+
+def _measure_latency(func, args_list, *, repeat: int = 3) -> dict:
+    """Mål kjøretid per kall av func for hvert element i args_list.
+
+    Returnerer dict med median, min og maks (sekunder).
+    """
+    latencies = []
+    for __ in range(repeat):
+        for args in args_list:
+            t_start = time.perf_counter()
+            func(*args)
+            latencies.append(time.perf_counter() - t_start)
+    return dict(median=statistics.median(latencies),
+                min=min(latencies),
+                max=max(latencies))
+
+
+def _print_latencies(title: str, results: dict) -> None:
+    """Skriv ut kjøretid per variant."""
+    print(f"\n{title.upper()}")
+    for name, latency in results.items():
+        print(f"{name:<32}"
+              f"median {latency['median'] * 1000:8.1f} ms  "
+              f"min {latency['min'] * 1000:8.1f} ms  "
+              f"maks {latency['max'] * 1000:8.1f} ms")
+
+
+def bench_order_properties(mamut, order_nums, *, repeat: int = 3) -> dict:
+    """Sammenlign innlasting av ordreegenskaper.
+
+    Én SQL-setning mot tre spørringer (ordre, hovedkontor og
+    kontaktperson), både samtidig og sekvensielt som tidligere.
+    Resultatene kontrolleres for likhet før måling. Cache av
+    spørreresultater brukes ikke.
+
+    :param mamut: MamutManager med tilkobling til database
+    :param order_nums: Ordrenumre som lastes inn
+    """
+    for order_num in order_nums:
+        single = mamut.get_order_properties(order_num, use_cache=False)
+        multi = mamut.get_order_properties(order_num, use_cache=False,
+                                           is_single_statement=False)
+        assert single == multi, \
+            f"Ulikt resultat for ordre {order_num}:\n{single}\n{multi}"
+
+    args_list = [(order_num,) for order_num in order_nums]
+    results = {
+        'Én SQL-setning': _measure_latency(
+            mamut._load_order_properties, args_list, repeat=repeat),
+        'Tre spørringer, samtidig': _measure_latency(
+            lambda order_num: mamut._load_order_properties_multi(
+                order_num, use_cache=False),
+            args_list, repeat=repeat),
+        'Tre spørringer, sekvensielt': _measure_latency(
+            lambda order_num: mamut._load_order_properties_multi(
+                order_num, use_cache=False, is_concurrent=False),
+            args_list, repeat=repeat),
+    }
+    _print_latencies(f'Ordreegenskaper, {len(order_nums)} ordrer', results)
+    return results
+
+
+def bench_fixture_queries(scale: str = '1k', *, sample_size: int = 20,
+                          repeat: int = 3) -> dict:
+    """Mål spørringer mot syntetiske data i SQLite (okn_db_fixtures).
+
+    Gir sammenlignbare tall uten tilgang til Mamut-serveren. Databasen
+    lages i midlertidig mappe og slettes etterpå.
+
+    :param scale: Datamengde, se okn_db_fixtures.FIXTURE_SCALES
+    :param sample_size: Antall tilfeldige ordrer som slås opp
+    """
+    # Importeres her, okn_ext_classes krever Windows-moduler
+    from okn_db import SqliteBackend
+    from okn_db_fixtures import FIXTURE_SCALES, create_fixture_db
+    from okn_ext_classes import MamutManager, ProdClassIndex
+    from okn_constants import SN_PROD_NUMS
+
+    order_line_count = FIXTURE_SCALES[scale]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, f'mamut_fixture_{scale}.db')
+        t_start = time.perf_counter()
+        create_fixture_db(path, order_line_count=order_line_count)
+        print(f"\nLaget testdatabase med {order_line_count} ordrelinjer "
+              f"på {time.perf_counter() - t_start:.1f} s")
+
+        # Egen ProdClassIndex, da testdata varierer med scale
+        with MamutManager(backend=SqliteBackend(path),
+                          prod_class_index=ProdClassIndex()) as mamut:
+            order_count = mamut.lookup_db(
+                "SELECT COUNT(*) AS order_count FROM g_order")[0].order_count
+            rnd = random.Random(0)
+            order_nums = [(100_000 + rnd.randint(1, order_count),)
+                          for __ in range(sample_size)]
+            prod_nums = [(prod_num,) for prod_num in SN_PROD_NUMS]
+
+            # get_ordered_prods skriver ut varelisten
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = {
+                    'get_ordered_prods': _measure_latency(
+                        mamut.get_ordered_prods, order_nums, repeat=repeat),
+                    'get_order_properties': _measure_latency(
+                        lambda order_num: mamut.get_order_properties(
+                            order_num, use_cache=False),
+                        order_nums, repeat=repeat),
+                    'get_serial_number_mask': _measure_latency(
+                        lambda prod_num: mamut.get_serial_number_mask(
+                            prod_num=prod_num, use_cache=False),
+                        prod_nums, repeat=repeat),
+                }
+    _print_latencies(f'SQLite-testdata, skala {scale}', results)
+    return results
+
+
+def _zip_serial_number_mask(serial_numbers) -> str:
+    """Maske med zip og set per posisjon, som tidligere i
+    MamutManager.get_serial_number_mask."""
+    if not serial_numbers:
+        return 'xxx'
+    zipped_serial_numbers = list(zip(*serial_numbers))
+    return ''.join(set(e).pop() if len(set(e)) == 1 else 'x'
+                   for e in zipped_serial_numbers)
+
+
+def bench_serial_number_masks(serials_per_prod: int = 100_000, *,
+                              repeat: int = 3) -> dict:
+    """Mål serienummer-masker for alle apparater (SN_PROD_NUMS).
+
+    Sammenligner maske-bygging alene (zip mot fortløpende maske), og
+    hele spørringen: én spørring per produkt mot én for alle.
+    Serienumrene lages i SQLite med okn_db_fixtures.
+
+    :param serials_per_prod: Ledige og utleverte serienumre per apparat
+    """
+    # Importeres her, okn_ext_classes krever Windows-moduler
+    from okn_db import SqliteBackend
+    from okn_db_fixtures import create_fixture_db
+    from okn_ext_classes import MamutManager, make_serial_number_mask
+    from okn_constants import SN_PROD_NUMS
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = create_fixture_db(os.path.join(tmp_dir, 'mamut_sn.db'),
+                                 serials_per_prod=serials_per_prod)
+
+        with MamutManager(backend=SqliteBackend(path)) as mamut:
+            serial_numbers = [
+                str(e.serialnr) for e in mamut.lookup_db(
+                    "SELECT serialnr FROM g_storeitem "
+                    "WHERE fk_product = ("
+                    "SELECT pk_prodid FROM g_prod WHERE prodid = ?)",
+                    [SN_PROD_NUMS[0]], use_cache=False)]
+
+            def _per_prod():
+                return {prod_num: mamut.get_serial_number_mask(
+                    prod_num=prod_num, use_cache=False)
+                    for prod_num in SN_PROD_NUMS}
+
+            assert (_zip_serial_number_mask(serial_numbers)
+                    == make_serial_number_mask(serial_numbers))
+            assert _per_prod() == mamut.get_serial_number_masks(), \
+                "Ulikt resultat"
+
+            results = {
+                'Maske, zip': _measure_latency(
+                    _zip_serial_number_mask, [(serial_numbers,)],
+                    repeat=repeat),
+                'Maske, fortløpende': _measure_latency(
+                    make_serial_number_mask, [(serial_numbers,)],
+                    repeat=repeat),
+                'Spørring per produkt': _measure_latency(
+                    _per_prod, [()], repeat=repeat),
+                'Én spørring, alle produkter': _measure_latency(
+                    mamut.get_serial_number_masks, [()], repeat=repeat),
+            }
+    _print_latencies(f'Serienummer-masker, {len(SN_PROD_NUMS)} apparater x '
+                     f'{serials_per_prod} serienumre', results)
+    return results
+
+
+def bench_query_stats(query_count: int = 5000, *, repeat: int = 5) -> dict:
+    """Mål kostnaden ved tidsmåling (QueryStats) i lookup_db.
+
+    Samme enkle spørring mot SQLite-testdata med og uten
+    registrering. Gir kostnad per spørring, som er uavhengig av hvor
+    lang tid spørringen selv tar mot Mamut.
+
+    :param query_count: Antall spørringer per måling
+    """
+    # Importeres her, okn_ext_classes krever Windows-moduler
+    from okn_db import SqliteBackend
+    from okn_db_fixtures import create_fixture_db
+    from okn_ext_classes import MamutManager
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = create_fixture_db(os.path.join(tmp_dir, 'mamut_stats.db'))
+        with MamutManager(backend=SqliteBackend(path)) as mamut:
+            # Ingen spørring er treg, loggen påvirker ikke målingen
+            mamut.query_stats.slow_threshold = float('inf')
+
+            def _lookups():
+                for idx in range(query_count):
+                    mamut.lookup_db(
+                        "SELECT name FROM g_contac WHERE custid = ?",
+                        [10_001 + idx % 20])
+
+            # Vekselvis med og uten, beste tid gir minst støy
+            results = {False: float('inf'), True: float('inf')}
+            for __ in range(repeat):
+                for is_enabled in (False, True):
+                    mamut.query_stats.is_enabled = is_enabled
+                    run_time, __ = _measure(_lookups, repeat=1)
+                    results[is_enabled] = min(results[is_enabled],
+                                              run_time / query_count)
+
+            # Registrering alene, som i lookup_db
+            mamut.query_stats.is_enabled = True
+            t_start = time.perf_counter()
+            for __ in range(query_count):
+                mamut._record_query(
+                    "SELECT name FROM g_contac WHERE custid = ?", [10_001],
+                    elapsed=1e-4, rows=1, cols=1,
+                    phases=dict(connect=0., execute=0., fetch=0.,
+                                convert=0.))
+            record_time = (time.perf_counter() - t_start) / query_count
+            report = mamut.query_stats.format_report()
+
+    overhead = results[True] - results[False]
+    print(f"\nTIDSMÅLING AV {query_count} SPØRRINGER")
+    print(f"{'Uten registrering':<24}{results[False] * 1e6:10.1f} us")
+    print(f"{'Med registrering':<24}{results[True] * 1e6:10.1f} us")
+    print(f"{'Differanse':<24}{overhead * 1e6:10.1f} us "
+          f"({overhead / results[False]:.1%})")
+    print(f"{'Registrering alene':<24}{record_time * 1e6:10.1f} us")
+    print(report)
+    return dict(disabled=results[False], enabled=results[True],
+                overhead=overhead, record=record_time)
+
+
+def bench_columns(order_line_count: int = 100_000, *,
+                  repeat: int = 3) -> dict:
+    """Sammenlign records og kolonner (as_columns=True) i lookup_db.
+
+    Henter alle ordrelinjer fra SQLite-testdata, og summerer antall
+    og antall linjer per ordre. Med kolonner brukes NumPy dersom
+    installert.
+
+    :param order_line_count: Antall ordrelinjer i testdata
+    """
+    # Importeres her, okn_ext_classes krever Windows-moduler
+    from okn_db import SqliteBackend, _import_numpy
+    from okn_db_fixtures import create_fixture_db
+    from okn_ext_classes import MamutManager
+
+    numpy = _import_numpy()
+    sql_statement = "SELECT linkid, prodid, qtyorder FROM g_orderl"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = create_fixture_db(os.path.join(tmp_dir, 'mamut_cols.db'),
+                                 order_line_count=order_line_count)
+        with MamutManager(backend=SqliteBackend(path)) as mamut:
+
+            def _records():
+                qty_by_order = {}
+                for line in mamut.lookup_db(sql_statement):
+                    qty_by_order[line.linkid] = (
+                        qty_by_order.get(line.linkid, 0.) + line.qtyorder)
+                return qty_by_order
+
+            def _columns():
+                columns = mamut.lookup_db(sql_statement, as_columns=True)
+                if numpy is None:
+                    qty_by_order = {}
+                    for linkid, qty in zip(columns['linkid'],
+                                           columns['qtyorder']):
+                        qty_by_order[linkid] = (
+                            qty_by_order.get(linkid, 0.) + qty)
+                    return qty_by_order
+                # Sortert etter ordre, deretter sum per gruppe
+                order = numpy.argsort(columns['linkid'], kind='stable')
+                linkids = columns['linkid'][order]
+                starts = numpy.flatnonzero(numpy.r_[True, linkids[1:]
+                                                    != linkids[:-1]])
+                sums = numpy.add.reduceat(columns['qtyorder'][order],
+                                          starts)
+                return dict(zip(linkids[starts].tolist(), sums.tolist()))
+
+            records_result = _records()
+            columns_result = _columns()
+            assert records_result.keys() == columns_result.keys() and all(
+                abs(records_result[key] - columns_result[key]) < 1e-6
+                for key in records_result), "Ulikt resultat"
+
+            results = {
+                'Records': _measure(_records, repeat=repeat),
+                'Kolonner' + (' (NumPy)' if numpy else ' (array)'):
+                    _measure(_columns, repeat=repeat),
+            }
+            # Minnebruk for selve spørreresultatet
+            result_mem = {
+                'Records': _measure(lambda: mamut.lookup_db(
+                    sql_statement), repeat=1)[1],
+                'Kolonner': _measure(lambda: mamut.lookup_db(
+                    sql_statement, as_columns=True), repeat=1)[1],
+            }
+    _print_result(f'Sum per ordre, {order_line_count} ordrelinjer',
+                  results, order_line_count)
+    print("Minne for spørreresultat: " + ', '.join(
+        f"{name} {mem_usage / order_line_count:.0f} bytes/rad"
+        for name, mem_usage in result_mem.items()))
+    return results
+
+
+def bench_lazy_records(row_count: int = 10000, col_count: int = 30, *,
+                       used_col_count: int = 3, repeat: int = 5) -> dict:
+    """Sammenlign Record og LazyRecord (lookup_db med is_lazy=True).
+
+    Rå rader som fra databasedriveren, med tekst med mellomrom,
+    tall, datoer og None, typecastes og leses enten med få felter
+    (used_col_count) eller alle felter per rad.
+
+    Returnerer dict med (kjøretid, minnebruk) per variant.
+    """
+    col_headers = tuple(f'col_{idx}' for idx in range(col_count))
+    base_date = datetime.datetime(2024, 1, 1, 8, 30)
+
+    def _raw_value(row_idx, col_idx):
+        kind = col_idx % 5
+        if kind == 0:
+            return f'Tekst {row_idx}-{col_idx}    '
+        elif kind == 1:
+            return row_idx * col_idx
+        elif kind == 2:
+            return row_idx / 7.
+        elif kind == 3:
+            return base_date + datetime.timedelta(minutes=row_idx)
+        return None if row_idx % 3 else f'0{row_idx}'
+
+    raw_rows = [tuple(_raw_value(row_idx, col_idx)
+                      for col_idx in range(col_count))
+                for row_idx in range(row_count)]
+    description = [(name, None) for name in col_headers]
+    converters = build_converters(description,
+                                  raw_rows[:CONVERTER_SAMPLE_SIZE])
+    used_fields = col_headers[:used_col_count]
+
+    def _eager():
+        record_cls = make_record_class(col_headers)
+        return [record_cls(*row)
+                for row in convert_rows(raw_rows, converters)]
+
+    def _lazy():
+        record_cls = make_lazy_record_class(col_headers)
+        return [record_cls(row, converters) for row in raw_rows]
+
+    def _read(make_rows, fields):
+        def _run():
+            rows = make_rows()
+            for row in rows:
+                for field in fields:
+                    getattr(row, field)
+            return rows
+        return _run
+
+    # Kontroller at variantene er likeverdige før måling
+    assert _eager() == _lazy(), "Ulikt resultat"
+
+    # Rå rader telles ikke i minnebruk, men holdes i live av LazyRecord
+    results = {}
+    for title, fields in ((f'{used_col_count} felter', used_fields),
+                          ('alle felter', col_headers)):
+        results[f'Record, {title}'] = _measure(_read(_eager, fields),
+                                               repeat=repeat)
+        results[f'LazyRecord, {title}'] = _measure(_read(_lazy, fields),
+                                                   repeat=repeat)
+    _print_result(f'{row_count} rader x {col_count} kolonner, typecasting',
+                  results, row_count)
+    return results
+
+
+def main() -> None:
+    """Kjør alle ytelsesmålinger."""
+    bench_records()
+    bench_fixture_queries()
+    bench_serial_number_masks()
+    bench_query_stats()
+    bench_columns()
+    bench_lazy_records()
+    return None
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+# -*- encoding: utf-8 -*-#
+# !/usr/bin/python
+
+# Standardbibliotek import
+import itertools
+import os
+import random
+import sqlite3
+import sys
+
+# Lokal applikasjon import
+from okn_constants import LIC_RENEWAL_PROD_NUMS, MOUTHPIECES_PROD_NUMS, \
+    SN_PROD_NUMS
+
+__author__ = 'Øyvind Nystad'
+
+"""
+Syntetiske testdata for Mamut-databasen i SQLite, for testing og
+ytelsesmåling uten tilgang til Mamut-serveren (se okn_db.SqliteBackend):
+- SCHEMA_SQL            Kopi av brukte tabeller og kolonner fra Mamut
+- create_fixture_db     Lag SQLite-database med testdata
+
+Kjøres med python okn_db_fixtures.py [1k|100k|1m] [databasefil]
+"""
+
+
+# Antall ordrelinjer per skala
+FIXTURE_SCALES = {
+    '1k': 1_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+}
+
+STORAGE_NAME = 'A1: Salgsvarer for salg, internt (Diagnostica)'
+
+SCHEMA_SQL = """
+CREATE TABLE g_clisys (
+    id              INTEGER,
+    nr              INTEGER,
+    descr           TEXT
+);
+CREATE TABLE g_currency (
+    currencyid      INTEGER PRIMARY KEY,
+    isocode         TEXT
+);
+CREATE TABLE w_delitypes (
+    uniqueid        INTEGER PRIMARY KEY,
+    [freetext]      TEXT
+);
+CREATE TABLE g_contac (
+    contid          INTEGER PRIMARY KEY,
+    custid          INTEGER,
+    name            TEXT,
+    countrycodecustomer INTEGER,
+    email           TEXT,
+    enterno         TEXT,
+    vend            INTEGER,
+    cooporate       INTEGER
+);
+CREATE TABLE g_cpers (
+    pk_cpersid      INTEGER PRIMARY KEY,
+    contid          INTEGER,
+    firstname       TEXT,
+    lastname        TEXT,
+    email           TEXT
+);
+CREATE TABLE g_deli (
+    pk_deliid       INTEGER PRIMARY KEY,
+    sourceid        INTEGER,
+    adrtype         INTEGER,
+    zipcode         TEXT
+);
+CREATE TABLE g_prod (
+    pk_prodid       INTEGER PRIMARY KEY,
+    prodid          TEXT,
+    usestore        INTEGER
+);
+CREATE TABLE g_store (
+    pk_storeid      INTEGER PRIMARY KEY,
+    description     TEXT
+);
+CREATE TABLE g_storeitem (
+    pk_storeitemid  INTEGER PRIMARY KEY,
+    serialnr        TEXT,
+    fk_product      INTEGER,
+    fk_store        INTEGER,
+    outtype         INTEGER
+);
+CREATE TABLE g_order (
+    orderid         INTEGER PRIMARY KEY,
+    linkid          INTEGER,
+    invoiceid       INTEGER,
+    custid          INTEGER,
+    contid          INTEGER,
+    contname        TEXT,
+    curr_sum_n      REAL,
+    currencyid      INTEGER,
+    data2           INTEGER,
+    data7           INTEGER,
+    data67          INTEGER,
+    datedeliv       TEXT,
+    dateinvoice     TEXT,
+    electronicdocumenttype INTEGER,
+    freightvolumesum REAL,
+    ifactoringstatus INTEGER,
+    lorderready     INTEGER,
+    maincontid      INTEGER,
+    maincontname    TEXT,
+    maincontres     INTEGER,
+    refyour         TEXT,
+    reference       TEXT,
+    reportidinvoice INTEGER
+);
+CREATE TABLE g_orderl (
+    uniqueid        INTEGER PRIMARY KEY,
+    linkid          INTEGER,
+    prodid          TEXT,
+    qtyorder        REAL,
+    repstrucorder   INTEGER
+);
+
+CREATE INDEX ix_g_contac_custid ON g_contac (custid);
+CREATE INDEX ix_g_deli_sourceid ON g_deli (sourceid);
+CREATE INDEX ix_g_prod_prodid ON g_prod (prodid);
+CREATE INDEX ix_g_storeitem_serialnr ON g_storeitem (serialnr);
+CREATE INDEX ix_g_storeitem_product ON g_storeitem (fk_product, fk_store);
+CREATE INDEX ix_g_order_linkid ON g_order (linkid);
+CREATE INDEX ix_g_order_invoiceid ON g_order (invoiceid);
+CREATE INDEX ix_g_orderl_linkid ON g_orderl (linkid);
+"""
+
+_FIRST_NAMES = ('Kari', 'Ola', 'Anna', 'Per', 'Ingrid', 'Lars', 'Sofie')
+_LAST_NAMES = ('Hansen', 'Johansen', 'Olsen', 'Larsen', 'Andersen')
+
+# Radene settes inn i bolker av denne størrelsen
+_INSERT_BATCH_SIZE = 10_000
+
+
+def _insert_rows(conn, table: str, rows) -> None:
+    """Sett inn rader (iterator av tupler) i bolker."""
+    rows = iter(rows)
+    first_row = next(rows, None)
+    if first_row is None:
+        return None
+    placeholders = ', '.join('?' * len(first_row))
+    sql_statement = f'INSERT INTO {table} VALUES ({placeholders})'
+    rows = itertools.chain([first_row], rows)
+    while True:
+        batch = list(itertools.islice(rows, _INSERT_BATCH_SIZE))
+        if not batch:
+            return None
+        conn.executemany(sql_statement, batch)
+
+
+def create_fixture_db(path: str, *,
+                      order_line_count: int = 1_000,
+                      lines_per_order: int = 5,
+                      serials_per_prod: int | None = None,
+                      seed: int = 0,
+                      ) -> str:
+    """Lag SQLite-database med syntetiske Mamut-data.
+
+    Antall ordrer, kunder, produkter og serienumre skaleres ut fra
+    order_line_count. Produktnumre fra okn_constants (munnstykker,
+    apparater med serienummer, lisensfornyelser) og FP00 er alltid
+    med, slik at alle kategorier i get_ordered_prods forekommer.
+    Eksisterende fil overskrives.
+
+    :param path: Sti til databasefil som opprettes
+    :param order_line_count: Antall ordrelinjer, se FIXTURE_SCALES
+    :param lines_per_order: Gjennomsnittlig antall linjer per ordre
+    :param serials_per_prod: Antall serienumre per apparat, standard
+        er order_line_count / 10 (minst 100)
+    :param seed: Frø for tilfeldige verdier, gir like data hver gang
+
+    Returnerer path.
+    """
+    rnd = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+
+    order_count = max(1, order_line_count // lines_per_order)
+    cust_count = max(20, order_count // 10)
+    other_prod_count = max(50, order_line_count // 1_000)
+    if serials_per_prod is None:
+        serials_per_prod = max(100, order_line_count // 10)
+
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA_SQL)
+
+    _insert_rows(conn, 'g_clisys', [(7, 1, 'Fritt levert'),
+                                    (7, 2, 'Ab fabrikk'),
+                                    (7, 3, 'CIF'),
+                                    (8, 1, 'Annen innstilling')])
+    _insert_rows(conn, 'g_currency', [(1, 'NOK'), (2, 'SEK'), (3, 'EUR')])
+    _insert_rows(conn, 'w_delitypes', [(1, 'Postpakke'),
+                                       (2, 'Bedriftspakke'),
+                                       (3, 'Hentes')])
+    _insert_rows(conn, 'g_store', [(1, STORAGE_NAME),
+                                   (2, 'B1: Demo- og utlånsvarer'),
+                                   (3, 'R1: Reparasjon')])
+
+    # Produkter: (prodid, usestore)
+    prods = ([(prod_num, 1) for prod_num in MOUTHPIECES_PROD_NUMS]
+             + [(prod_num, 1) for prod_num in SN_PROD_NUMS]
+             + [(prod_num, 0) for prod_num in LIC_RENEWAL_PROD_NUMS]
+             + [('FP00', 0)]
+             + [(f'P{idx:05d}', int(idx % 2 == 0))
+                for idx in range(other_prod_count)])
+    prods = list(dict(prods).items())
+    _insert_rows(conn, 'g_prod', ((pk_prodid, prod_num, usestore)
+                                  for pk_prodid, (prod_num, usestore)
+                                  in enumerate(prods, start=1)))
+    pk_by_prod_num = {prod_num: pk_prodid for pk_prodid, (prod_num, __)
+                      in enumerate(prods, start=1)}
+
+    # Kunder, kontaktpersoner og leveringsadresser
+    _insert_rows(conn, 'g_contac', (
+        (contid, 10_000 + contid, f'Kunde {contid} AS',
+         1 if rnd.random() < 0.8 else rnd.choice((46, 45, 358)),
+         f'post@kunde{contid}.no', f'{900_000_000 + contid}',
+         int(rnd.random() < 0.1), int(rnd.random() < 0.1))
+        for contid in range(1, cust_count + 1)))
+    person_names = [f'{first} {last}' for first in _FIRST_NAMES
+                    for last in _LAST_NAMES]
+    _insert_rows(conn, 'g_cpers', (
+        (idx, rnd.randint(1, cust_count), *name.split(),
+         f'{name.replace(" ", ".").lower()}@kunde.no')
+        for idx, name in enumerate(person_names, start=1)))
+    _insert_rows(conn, 'g_deli', (
+        (None, contid, 1,
+         f'{rnd.randint(0, 9999):04d}' if rnd.random() < 0.8
+         else f'{rnd.randint(100, 999)} {rnd.randint(10, 99)}')
+        for contid in range(1, cust_count + 1)
+        for __ in range(rnd.choice((1, 1, 2)))))
+
+    # Ordrer, linkid = orderid - 100000
+    def _orders():
+        for linkid in range(1, order_count + 1):
+            contid = rnd.randint(1, cust_count)
+            maincontid = (rnd.randint(1, cust_count)
+                          if rnd.random() < 0.2 else 0)
+            is_invoiced = rnd.random() < 0.5
+            date = (f'2023-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d} '
+                    f'{rnd.randint(7, 16):02d}:{rnd.randint(0, 59):02d}:00')
+            yield (100_000 + linkid, linkid,
+                   200_000 + linkid if is_invoiced else None,
+                   10_000 + contid, contid, f'Kunde {contid} AS',
+                   round(rnd.uniform(-500, 50_000), 2),
+                   rnd.choice((1, 1, 1, 2, 3)), rnd.randint(1, 3),
+                   rnd.randint(1, 3), rnd.choice((1, 1, 2)),
+                   date, date if is_invoiced else None,
+                   int(rnd.random() < 0.3), round(rnd.uniform(-2, 20), 3),
+                   int(rnd.random() < 0.1), int(rnd.random() < 0.7),
+                   maincontid,
+                   f'Kunde {maincontid} AS' if maincontid else '',
+                   int(bool(maincontid) and rnd.random() < 0.5),
+                   rnd.choice(person_names) if rnd.random() < 0.6 else '',
+                   f'PO: {rnd.randint(1000, 9999)}',
+                   rnd.choice((4410, 4410, 4401)))
+    _insert_rows(conn, 'g_order', _orders())
+
+    # Ordrelinjer, fordelt tilfeldig på ordrene
+    prod_nums = [prod_num for prod_num, __ in prods]
+    sn_prod_nums = set(SN_PROD_NUMS)
+
+    def _order_lines():
+        for __ in range(order_line_count):
+            prod_num = rnd.choice(prod_nums)
+            qty = float(rnd.randint(1, 10))
+            if prod_num in sn_prod_nums and rnd.random() < 0.2:
+                qty = -qty          # Retur av apparat
+            yield (None, rnd.randint(1, order_count), prod_num, qty,
+                   int(rnd.random() < 0.05))
+    _insert_rows(conn, 'g_orderl', _order_lines())
+
+    # Serienumre for apparater, ca. 70 % ledige på salgslager
+    def _store_items():
+        for prod_idx, prod_num in enumerate(SN_PROD_NUMS):
+            prefix = f'{rnd.randint(0, 99):02d}{prod_idx % 10}'
+            for idx in range(serials_per_prod):
+                is_free = rnd.random() < 0.7
+                yield (None, f'{prefix}{idx:07d}', pk_by_prod_num[prod_num],
+                       1 if rnd.random() < 0.9 else rnd.choice((2, 3)),
+                       None if is_free else rnd.choice((1, 2)))
+    _insert_rows(conn, 'g_storeitem', _store_items())
+
+    conn.commit()
+    conn.close()
+    return path
+
+
+if __name__ == '__main__':
+    scale = sys.argv[1] if len(sys.argv) > 1 else '1k'
+    path = sys.argv[2] if len(sys.argv) > 2 else f'mamut_fixture_{scale}.db'
+    print(f"Lager testdatabase {path} med {FIXTURE_SCALES[scale]} "
+          "ordrelinjer... ", end="")
+    create_fixture_db(path, order_line_count=FIXTURE_SCALES[scale])
+    print("OK")
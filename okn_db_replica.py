@@ -0,0 +1,536 @@
+# -*- encoding: utf-8 -*-#
+# !/usr/bin/python
+
+# Standardbibliotek import
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+__author__ = 'Øyvind Nystad'
+
+"""
+Lokal kopi (SQLite) av referansetabeller i Mamut, som kunder,
+produkter og lagre, slik at oppslag kan gjøres uten å gå mot
+SQL Server hver gang:
+- ReplicaTable          Definisjon av tabell som kopieres
+- REPLICA_TABLES        Tabellene som kopieres som standard
+- ReferenceReplica      Lokal kopi med inkrementell synkronisering
+- get_replica           Velg lokal kopi ut fra konfigurasjon
+
+Kopien er én SQLite-fil i WAL-modus, som kan leses av flere
+prosesser samtidig mens én prosess synkroniserer.
+"""
+
+
+# Deklarerte kolonnetyper i kopien, for verdier SQLite ikke lagrer
+# direkte. Gjør at verdiene leses tilbake med samme type som fra
+# SQL Server, og dermed typecastes likt (okn_db.autoconvert).
+_BOOL_DECL_TYPE = 'OKN_BOOL'
+_DATETIME_DECL_TYPE = 'OKN_DATETIME'
+
+sqlite3.register_converter(_BOOL_DECL_TYPE, lambda val: bool(int(val)))
+sqlite3.register_converter(
+    _DATETIME_DECL_TYPE,
+    lambda val: datetime.datetime.fromisoformat(val.decode()))
+
+# Største heltall SQLite lagrer som INTEGER
+_MAX_SQLITE_INT = 2 ** 63 - 1
+
+# Antall primærnøkler per spørring etter endrede rader. SQL Server
+# tillater maks 2100 parametere per setning
+DELTA_CHUNK_SIZE = 500
+
+
+class ReplicaTable:
+    """Definisjon av tabell i lokal kopi.
+
+    :param name: Tabellnavn, likt i Mamut og kopien
+    :param key_column: Primærnøkkel
+    :param columns: Kolonner som kopieres, inkl. key_column
+    :param stamp_sql: SQL-uttrykk med heltall som øker ved hver
+        endring av raden, f.eks. 'CAST(rowver AS BIGINT)' for
+        rowversion-kolonne. Uten stamp_sql finnes endrede rader ved å
+        sammenligne sjekksum per rad (se _row_hash_sql).
+    :param index_columns: Kolonner det slås opp på i kopien
+    """
+
+    def __init__(self, name: str, *, key_column: str, columns: tuple,
+                 stamp_sql: str | None = None,
+                 index_columns: tuple = ()) -> None:
+        assert key_column in columns, \
+            f"key_column {key_column} mangler i columns for {name}"
+        self.name = name
+        self.key_column = key_column
+        self.columns = tuple(columns)
+        self.stamp_sql = stamp_sql
+        self.index_columns = tuple(index_columns)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.name!r})'
+
+
+# Tabellene i Mamut har ingen rowversion- eller endringstidskolonne,
+# endringer finnes derfor med sjekksum per rad
+REPLICA_TABLES = (
+    ReplicaTable('g_contac', key_column='contid',
+                 columns=('contid', 'custid', 'name', 'countrycodecustomer',
+                          'email', 'enterno', 'vend', 'cooporate'),
+                 index_columns=('custid',)),
+    ReplicaTable('g_prod', key_column='pk_prodid',
+                 columns=('pk_prodid', 'prodid', 'usestore'),
+                 index_columns=('prodid',)),
+    ReplicaTable('g_store', key_column='pk_storeid',
+                 columns=('pk_storeid', 'description'),
+                 index_columns=('description',)),
+)
+
+
+def _row_hash_sql(columns) -> str:
+    """SQL-uttrykk med sjekksum (SHA-256) av radens verdier.
+
+    Verdiene gjøres om til tekst, med skilletegn (CHAR(31)) mellom
+    kolonnene og egen markør (CHAR(0)) for NULL, slik at f.eks. NULL
+    og '' gir ulik sjekksum. Tekstformen for flyttall i SQL Server er
+    avrundet, så tabeller med flyttall bør ha stamp_sql.
+    """
+    values_sql = ', CHAR(31), '.join(
+        f'COALESCE(CAST({column} AS NVARCHAR(4000)), CHAR(0))'
+        for column in columns)
+    if len(columns) == 1:           # CONCAT krever minst to argumenter
+        values_sql += ", ''"
+    return f"HASHBYTES('SHA2_256', CONCAT({values_sql}))"
+
+
+def _to_replica_value(val):
+    """Verdi fra SQL Server i form som kan lagres i SQLite.
+
+    Typer SQLite ikke har (Decimal, date m.fl.) lagres som str(val),
+    som gir samme resultat i okn_db.autoconvert.
+    """
+    val_type = type(val)
+    if val is None or val_type is str or val_type is float \
+            or val_type is bytes:
+        return val
+    if val_type is bool:
+        return int(val)
+    if val_type is int and -_MAX_SQLITE_INT <= val <= _MAX_SQLITE_INT:
+        return val
+    return str(val)
+
+
+def _decl_type(sample_values) -> str:
+    """Deklarert kolonnetype ut fra første verdi som ikke er None."""
+    val_type = next((type(val) for val in sample_values if val is not None),
+                    None)
+    if val_type is bool:
+        return _BOOL_DECL_TYPE
+    if val_type is datetime.datetime:
+        return _DATETIME_DECL_TYPE
+    return ''
+
+
+class ReferenceReplica:
+    """Lokal kopi av referansetabeller, synkronisert fra Mamut.
+
+    Første synkronisering laster hele tabellen. Deretter hentes bare
+    rader med stamp_sql høyere enn forrige gang, og rader som er
+    slettet i Mamut fjernes ut fra primærnøklene. For tabeller uten
+    stamp_sql hentes primærnøkkel og sjekksum per rad, og bare nye og
+    endrede rader hentes i sin helhet. Sjekksummene lagres i egen
+    tabell i kopien (replica_hash_<tabellnavn>).
+
+    Alderen på kopien (staleness) regnes fra starten av siste
+    vellykkede synkronisering. ensure_fresh synkroniserer tabeller
+    eldre enn max_staleness, slik at oppslag aldri gir data eldre
+    enn dette. Synkronisering skjer i én skrivetransaksjon per
+    tabell, og lesere i andre prosesser ser enten gammel eller ny
+    versjon av tabellen.
+
+    :param path: Sti til SQLite-fil for kopien
+    :param tables: Tabeller som kopieres, se REPLICA_TABLES
+    :param max_staleness: Maks alder (sekunder) for data ved oppslag
+    :param batch_size: Antall rader per fetchmany fra Mamut
+    :param clock: Funksjon som gir tidspunkt (sekunder), kan
+        byttes ut i tester
+
+    Eksempel:
+        replica = ReferenceReplica('mamut_replica.db')
+        replica.ensure_fresh(mamut.db_pool, ['g_contac'])
+        description, rows = replica.execute(
+            'SELECT name FROM g_contac WHERE custid = ?', [10001])
+    """
+
+    def __init__(self, path: str, *,
+                 tables=REPLICA_TABLES,
+                 max_staleness: float = 900.,
+                 batch_size: int = 5000,
+                 clock=time.time) -> None:
+        self.path = path
+        self.tables = {table.name: table for table in tables}
+        self.max_staleness = max_staleness
+        self.batch_size = batch_size
+        self._clock = clock
+        self._local = threading.local()
+        self._conns_lock = threading.Lock()
+        self._conns: list = []          # Alle åpne lesetilkoblinger
+
+        conn = self._connect_writer()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS replica_meta (
+                    table_name  TEXT PRIMARY KEY,
+                    synced_at   REAL,
+                    stamp       INTEGER,
+                    row_count   INTEGER,
+                    columns     TEXT
+                )""")
+        finally:
+            conn.close()
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.path!r})'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _connect_writer(self):
+        """Ny tilkobling for synkronisering."""
+        conn = sqlite3.connect(self.path, timeout=30.,
+                               isolation_level=None)
+        conn.execute('PRAGMA busy_timeout=30000')
+        return conn
+
+    def _reader(self):
+        """Lesetilkobling for gjeldende tråd."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                f'file:{self.path}?mode=ro', uri=True, timeout=30.,
+                detect_types=sqlite3.PARSE_DECLTYPES,
+                check_same_thread=False)
+            conn.create_function(
+                'CONCAT', -1,
+                lambda *args: ''.join('' if e is None else str(e)
+                                      for e in args),
+                deterministic=True)
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def close(self) -> None:
+        """Lukk alle lesetilkoblinger."""
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._local = threading.local()
+        return None
+
+    def execute(self, sql_statement, params=None) -> tuple:
+        """Eksekver spørring mot kopien.
+
+        Returnerer (cursor.description, rader) som fra Mamut, slik
+        at resultatet kan typecastes på samme måte som i
+        MamutManager.lookup_db.
+        """
+        cursor = self._reader().execute(sql_statement, list(params or ()))
+        try:
+            return cursor.description, cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def _read_meta(self, conn) -> dict:
+        """{tabellnavn: (synced_at, stamp, columns)} fra replica_meta."""
+        return {
+            table_name: (synced_at, stamp, columns)
+            for table_name, synced_at, stamp, columns in conn.execute(
+                'SELECT table_name, synced_at, stamp, columns '
+                'FROM replica_meta')}
+
+    def staleness(self) -> dict:
+        """Alder (sekunder) per tabell, inf for tabell som aldri er
+        synkronisert."""
+        meta = self._read_meta(self._reader())
+        now = self._clock()
+        return {table_name: (now - meta[table_name][0]
+                             if table_name in meta else float('inf'))
+                for table_name in self.tables}
+
+    def ensure_fresh(self, source_pool, table_names=None) -> dict:
+        """Synkroniser tabeller som er eldre enn max_staleness.
+
+        Returnerer dict med statistikk per synkronisert tabell, se
+        sync.
+        """
+        table_names = list(table_names or self.tables)
+        staleness = self.staleness()
+        stale_names = [table_name for table_name in table_names
+                       if staleness[table_name] > self.max_staleness]
+        if not stale_names:
+            return {}
+        return self.sync(source_pool, stale_names,
+                         max_staleness=self.max_staleness)
+
+    def sync(self, source_pool, table_names=None, *,
+             is_full: bool = False,
+             max_staleness: float | None = None) -> dict:
+        """Synkroniser tabeller fra Mamut.
+
+        :param source_pool: okn_db.ConnectionPool mot Mamut
+        :param table_names: Tabeller, standard er alle
+        :param is_full: Last hele tabellene på nytt
+        :param max_staleness: Hopp over tabeller som en annen prosess
+            har synkronisert innenfor dette (sekunder)
+
+        Returnerer {tabellnavn: dict(mode, rows, deleted, seconds)},
+        mode er 'full', 'incremental' eller 'skipped'.
+        """
+        stats = {}
+        conn = self._connect_writer()
+        try:
+            for table_name in (table_names or self.tables):
+                stats[table_name] = self._sync_table(
+                    conn, source_pool, self.tables[table_name],
+                    is_full=is_full, max_staleness=max_staleness)
+        finally:
+            conn.close()
+        return stats
+
+    def _fetch_source(self, source_pool, sql_statement, params=()):
+        """Hent rader fra Mamut i bolker. Gir (description, rader)."""
+        with source_pool.connection() as conn:
+            statements = source_pool.statements(conn)
+            cursor = statements.execute(sql_statement, params)
+            rows = []
+            while True:
+                batch = cursor.fetchmany(self.batch_size)
+                if not batch:
+                    break
+                rows.extend(batch)
+            description = cursor.description
+            statements.release(sql_statement, cursor)
+        return description, rows
+
+    def _sync_table(self, conn, source_pool, table, *,
+                    is_full, max_staleness) -> dict:
+        """Synkroniser én tabell i én skrivetransaksjon."""
+        t_start = time.perf_counter()
+        # Skrivelås før alderen sjekkes, slik at flere prosesser ikke
+        # synkroniserer samme tabell samtidig
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            synced_at = self._clock()
+            meta = self._read_meta(conn).get(table.name)
+            columns_text = self._meta_columns(table)
+            if (max_staleness is not None and meta is not None
+                    and synced_at - meta[0] <= max_staleness):
+                conn.execute('ROLLBACK')
+                return dict(mode='skipped', rows=0, deleted=0,
+                            seconds=time.perf_counter() - t_start)
+
+            is_incremental = (not is_full and meta is not None
+                              and meta[2] == columns_text)
+            if is_incremental and table.stamp_sql is not None:
+                row_count, deleted, stamp = self._load_incremental(
+                    conn, source_pool, table, last_stamp=meta[1])
+                mode = 'incremental'
+            elif is_incremental:
+                row_count, deleted = self._load_delta(conn, source_pool,
+                                                      table)
+                stamp = None
+                mode = 'incremental'
+            else:
+                row_count, stamp = self._load_full(conn, source_pool, table)
+                deleted = 0
+                mode = 'full'
+
+            conn.execute(
+                'INSERT OR REPLACE INTO replica_meta '
+                '(table_name, synced_at, stamp, row_count, columns) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [table.name, synced_at, stamp,
+                 conn.execute(f'SELECT COUNT(*) FROM {table.name}'
+                              ).fetchone()[0],
+                 columns_text])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return dict(mode=mode, rows=row_count, deleted=deleted,
+                    seconds=time.perf_counter() - t_start)
+
+    @staticmethod
+    def _meta_columns(table) -> str:
+        """Kolonner og synkroniseringsmåte, lagret i replica_meta.
+        Endring gir full synkronisering."""
+        columns_text = ', '.join(table.columns)
+        if table.stamp_sql is None:
+            columns_text += ' | replica_hash'
+        return columns_text
+
+    def _select_sql(self, table) -> str:
+        """SELECT for kopierte kolonner, med endringsstempel eller
+        sjekksum per rad som siste kolonne."""
+        columns_sql = ', '.join(table.columns)
+        if table.stamp_sql is not None:
+            columns_sql += f', {table.stamp_sql} AS replica_stamp'
+        else:
+            columns_sql += (f', {_row_hash_sql(table.columns)} '
+                            'AS replica_hash')
+        return f'SELECT {columns_sql} FROM {table.name}'
+
+    def _split_stamp(self, table, rows) -> tuple:
+        """Skill ut endringsstempel eller sjekksum (siste kolonne) fra
+        radene. Gir (rader, stempel, sjekksummer)."""
+        extras = [row[-1] for row in rows]
+        rows = [row[:-1] for row in rows]
+        if table.stamp_sql is None:
+            return rows, None, extras
+        stamp = max((val for val in extras if val is not None),
+                    default=None)
+        return rows, stamp, None
+
+    def _store_hashes(self, conn, table, rows, hashes, *,
+                      is_full: bool) -> None:
+        """Lagre sjekksum per primærnøkkel, for _load_delta."""
+        hash_table = f'replica_hash_{table.name}'
+        if is_full:
+            conn.execute(f'DROP TABLE IF EXISTS {hash_table}')
+            conn.execute(f'CREATE TABLE {hash_table} '
+                         '(key PRIMARY KEY, hash BLOB)')
+        key_idx = table.columns.index(table.key_column)
+        conn.executemany(
+            f'INSERT OR REPLACE INTO {hash_table} (key, hash) '
+            'VALUES (?, ?)',
+            ([_to_replica_value(row[key_idx]),
+              None if row_hash is None else bytes(row_hash)]
+             for row, row_hash in zip(rows, hashes)))
+        return None
+
+    def _insert_rows(self, conn, table, rows, *, is_replace) -> None:
+        """Sett inn rader, verdiene tilpasses SQLite."""
+        placeholders = ', '.join('?' * len(table.columns))
+        verb = 'INSERT OR REPLACE' if is_replace else 'INSERT'
+        conn.executemany(
+            f'{verb} INTO {table.name} ({", ".join(table.columns)}) '
+            f'VALUES ({placeholders})',
+            ([_to_replica_value(val) for val in row] for row in rows))
+        return None
+
+    def _load_full(self, conn, source_pool, table) -> tuple:
+        """Last hele tabellen på nytt. Gir (antall rader, stempel)."""
+        __, rows = self._fetch_source(source_pool, self._select_sql(table))
+        rows, stamp, hashes = self._split_stamp(table, rows)
+
+        columns_ddl = ', '.join(
+            f'{column} {_decl_type(row[idx] for row in rows)}'.strip()
+            + (' PRIMARY KEY' if column == table.key_column else '')
+            for idx, column in enumerate(table.columns))
+        conn.execute(f'DROP TABLE IF EXISTS {table.name}')
+        conn.execute(f'CREATE TABLE {table.name} ({columns_ddl})')
+        # Samme primærnøkkel flere ganger: siste rad gjelder
+        self._insert_rows(conn, table, rows, is_replace=True)
+        for column in table.index_columns:
+            conn.execute(f'CREATE INDEX ix_{table.name}_{column} '
+                         f'ON {table.name} ({column})')
+        if hashes is not None:
+            self._store_hashes(conn, table, rows, hashes, is_full=True)
+        return len(rows), stamp
+
+    def _load_incremental(self, conn, source_pool, table, *,
+                          last_stamp) -> tuple:
+        """Hent endrede rader, og fjern slettede.
+
+        Gir (antall endrede rader, antall slettede, stempel).
+        """
+        if last_stamp is None:
+            __, rows = self._fetch_source(source_pool,
+                                          self._select_sql(table))
+        else:
+            __, rows = self._fetch_source(
+                source_pool,
+                f'{self._select_sql(table)} WHERE {table.stamp_sql} > ?',
+                [last_stamp])
+        rows, stamp, __ = self._split_stamp(table, rows)
+        self._insert_rows(conn, table, rows, is_replace=True)
+
+        # Slettinger gir ikke nytt stempel, sammenlign primærnøkler
+        __, key_rows = self._fetch_source(
+            source_pool, f'SELECT {table.key_column} FROM {table.name}')
+        source_keys = {_to_replica_value(row[0]) for row in key_rows}
+        deleted_keys = [
+            [key] for (key,) in conn.execute(
+                f'SELECT {table.key_column} FROM {table.name}')
+            if key not in source_keys]
+        conn.executemany(
+            f'DELETE FROM {table.name} WHERE {table.key_column} = ?',
+            deleted_keys)
+
+        if stamp is None:
+            stamp = last_stamp
+        return len(rows), len(deleted_keys), stamp
+
+    def _load_delta(self, conn, source_pool, table) -> tuple:
+        """Hent nye og endrede rader ut fra sjekksum per rad, og fjern
+        slettede. For tabeller uten stamp_sql.
+
+        Gir (antall nye og endrede rader, antall slettede).
+        """
+        hash_table = f'replica_hash_{table.name}'
+        __, hash_rows = self._fetch_source(
+            source_pool,
+            f'SELECT {table.key_column}, {_row_hash_sql(table.columns)} '
+            f'FROM {table.name}')
+        source_hashes = {
+            _to_replica_value(key): None if row_hash is None
+            else bytes(row_hash)
+            for key, row_hash in hash_rows}
+        local_hashes = dict(conn.execute(
+            f'SELECT key, hash FROM {hash_table}'))
+        changed_keys = [key for key, row_hash in source_hashes.items()
+                        if key not in local_hashes
+                        or local_hashes[key] != row_hash]
+        deleted_keys = [[key] for key in local_hashes
+                        if key not in source_hashes]
+
+        rows = []
+        for idx in range(0, len(changed_keys), DELTA_CHUNK_SIZE):
+            keys = changed_keys[idx:idx + DELTA_CHUNK_SIZE]
+            __, chunk_rows = self._fetch_source(
+                source_pool,
+                f'{self._select_sql(table)} WHERE {table.key_column} '
+                f'IN ({", ".join("?" * len(keys))})', keys)
+            rows.extend(chunk_rows)
+        rows, __, hashes = self._split_stamp(table, rows)
+        self._insert_rows(conn, table, rows, is_replace=True)
+        self._store_hashes(conn, table, rows, hashes, is_full=False)
+
+        conn.executemany(
+            f'DELETE FROM {table.name} WHERE {table.key_column} = ?',
+            deleted_keys)
+        conn.executemany(f'DELETE FROM {hash_table} WHERE key = ?',
+                         deleted_keys)
+        return len(rows), len(deleted_keys)
+
+
+def get_replica(path: str | None = None, **kwargs):
+    """Velg lokal kopi ut fra konfigurasjon.
+
+    :param path: SQLite-fil for kopien. Standard er miljøvariabelen
+        OKN_DB_REPLICA_PATH. Uten path gis None (ingen lokal kopi).
+    :param kwargs: Øvrige argumenter til ReferenceReplica
+    """
+    path = path or os.environ.get('OKN_DB_REPLICA_PATH')
+    if not path:
+        return None
+    return ReferenceReplica(path, **kwargs)
@@ -2,15 +2,20 @@
 # !/usr/bin/python
 
 # Standardbibliotek import
+import collections
+import concurrent.futures
+import copy
+import itertools
+import operator
 import subprocess
+import threading
 import time
+import weakref
 
 # Tredjeparts bibliotek import
 import keyboard
 import os
-import pendulum
 import pyperclip
-import pypyodbc
 from pywinauto.application import Application as PWA_App
 import selenium.webdriver
 from selenium.webdriver.common.by import By
@@ -20,9 +25,19 @@ import win32print
 
 # Lokal applikasjon import
 from okn_basic_classes import BasicWndHandler, MenuMaker, NamedList     # noqa
+from okn_basic_classes import CONSOLE_PINNED, LAYOUT_PROFILES, \
+    WndPlacement
+from okn_basic_classes import make_lazy_record_class, make_record_class
 from okn_constants import MAMUT_RE, MOUTHPIECES_PROD_NUMS, PROGRAM_PATH, \
-    SN_PROD_NUMS
+    PROGRAM_RE, SN_PROD_NUMS
 from okn_constants import LIC_RENEWAL_PROD_NUMS
+from okn_db import CONVERTER_SAMPLE_SIZE, ConnectionPool, QueryStats, \
+    ResultCache, SingleFlight, autoconvert, build_converters, \
+    convert_columns, convert_rows, get_backend, make_column_arrays, \
+    normalize_sql
+from okn_db_replica import get_replica
+from okn_field_io import FieldIO
+from okn_wait import Backoff, wait_until
 import okn_functions as okn
 
 
@@ -32,6 +47,8 @@ __author__ = 'Øyvind Nystad'
 Egenlagde klasser for ofte brukt funksjonalitet i Windows:
 - MenuMaker
 - WinGUIManager
+- ProdClassIndex
+- PROD_CLASS_INDEX
 - MamutManager
 """
 
@@ -39,6 +56,17 @@ Egenlagde klasser for ofte brukt funksjonalitet i Windows:
 class WinGUIManager(BasicWndHandler):
     """Klasse for å håndtere vinduer i Windows."""
 
+    layout_profiles = {
+        **LAYOUT_PROFILES,
+        # Mamut maksimert i fokus, med konsollvindu festet over
+        'mamut': (WndPlacement(PROGRAM_RE, is_focused=False,
+                               **CONSOLE_PINNED),
+                  WndPlacement(MAMUT_RE, is_maximized=True)),
+    }
+
+    # Lesing og skriving av fokusert felt i await_text
+    field_io = FieldIO()
+
     def archive_pdf_document(self,
                              folder_path,
                              file_name = None,
@@ -68,14 +96,13 @@ class WinGUIManager(BasicWndHandler):
         document_wnd.type_keys('^+s'
                                '{ENTER}',   # Velg annen mappe... OK
                                pause=0.4)
-        self.await_text()
-
-        # Gi opp dersom await_text() ikke oppdaterte utklippstavle
-        if not pyperclip.paste():
+        # Gi opp dersom await_text() ikke kunne lese feltet
+        doc_name = self.await_text()
+        if not doc_name:
             return None
 
         if not file_name:
-            file_name = pyperclip.paste()
+            file_name = doc_name
 
         pyperclip.copy(f'{folder_path}\\{file_name}')
 
@@ -94,76 +121,32 @@ class WinGUIManager(BasicWndHandler):
         """Vent på fokus for aktivert tekst, returner så denne.
 
         Etter aktivering kan fokus på tekst (i tekstboks, e-postfelt
-        etc.) ta noe tid. Forsøker kopiering av innhold til
-        utklippstavle inntil dette lykkes, returnerer så tekstinnholdet.
+        etc.) ta noe tid. Leser feltet via self.field_io, med UI
+        Automation når feltet støtter det, ellers via utklippstavle,
+        inntil dette lykkes, og returnerer så tekstinnholdet.
 
         Argumenter:
             timeout: Antall sekunder før programmet gir opp å
                 vente på fokus i tekstboks.
             filltext: Tekst forsøkt fylt inn i fokusert element.
         Retur:
-            Innhold fra fokusert boks (str) dersom identifisert før
-            timeout, ellers None.
+            filltext dersom utfylt, ellers innhold fra fokusert boks
+            (str), '' dersom innholdet ikke kunne leses før timeout.
+            Innhold lest etter utfylling er i
+            self.field_io.last_read_back.
         """
-
-        T_PAUSE = 0.3   # For lav verdi gir ustabil oppdatering i Mamut
-
-        def pyperclip_decorator(pyperclip_copy_func):
-            """
-            Dekoratør for pyperclip.copy.
-
-            Sikrer at oppdatering av utklippstavle gjøres korrekt
-            ved bruk av pyperclip.copy, da oppdatering ellers
-            kan bruke noe tid, og ikke være fullført innen neste
-            Python-kommando utføres.
-            """
-            def wrapper_func(text: str):
-                """wrapper-funksjon."""
-                text = str(text)
-                pyperclip_copy_func(text)
-                while pyperclip.paste() != text:
-                    time.sleep(T_PAUSE)
-                assert text == pyperclip.paste(), \
-                    ("Utklippstavle ikke oppdatert, øk verdi for T_PAUSE, "
-                     "evt. restart Mamut som kan ha stått på for lenge "
-                     "og da begynt å bli lite responsivt.",
-                     f"{pyperclip.paste()} {text}")
-            return wrapper_func
-
-        pyperclip_copy_new = pyperclip_decorator(pyperclip.copy)
-
-        t_start = time.time()
         if filltext:
-            pyperclip_copy_new('')
-            while not pyperclip.paste():
-                # Kanskje nødvendig, reduser evt. senere
-                # time.sleep(0.25)
-                keyboard.press_and_release('0')
-                # Kanskje nødvendig, reduser evt. senere
-                # time.sleep(1.25)
-                time.sleep(T_PAUSE)
-                keyboard.press_and_release('ctrl+a+c')
-                time.sleep(T_PAUSE)
-                assert time.time() - t_start < timeout, \
-                    f"Operasjonen tok over {timeout} sek - avslutter."
-            time.sleep(T_PAUSE)
-
-            keyboard.write(str(filltext))
-
-            time.sleep(T_PAUSE)
+            assert self.field_io.write(str(filltext), timeout) is not None, \
+                f"Operasjonen tok over {timeout} sek - avslutter."
             return filltext
-        else:
-            pyperclip_copy_new('')
-            while not pyperclip.paste():
-                keyboard.press_and_release('ctrl+a+c')
-                time.sleep(T_PAUSE)        # Nødvendig pause
-                if time.time() - t_start > timeout:
-                    input(f"Operasjonen tok mer enn {timeout} sek - gir opp\n"
-                          "Gi gjerne beskjed til utvikler om problemet,\n"
-                          "Trykk ENTER for å forsøke å fullføre.")
-                    return ''
-
-            return pyperclip.paste().strip()
+
+        text = self.field_io.read(timeout)
+        if text is None:
+            input(f"Operasjonen tok mer enn {timeout} sek - gir opp\n"
+                  "Gi gjerne beskjed til utvikler om problemet,\n"
+                  "Trykk ENTER for å forsøke å fullføre.")
+            return ''
+        return text
 
     def compose_outlook_email(self, *,
                               email: str ='',
@@ -222,13 +205,22 @@ class WinGUIManager(BasicWndHandler):
         browser_wait = WebDriverWait(browser, MAX_WAIT_TIME)
 
         try:
-            browser_wait.until(
+            web_control = browser_wait.until(
                 expected_conditions.element_to_be_clickable(
                     (By.XPATH, x_path)
                     )
                 )
-            time.sleep(0.2)                 # Kanskje nødvendig pause
-            return browser.find_element_by_xpath(x_path)
+            # Vent til elementet har sluttet å flytte seg (f.eks.
+            # animasjon), i stedet for fast pause
+            rects = []
+
+            def _is_settled():
+                rects.append(web_control.rect)
+                return len(rects) >= 2 and rects[-1] == rects[-2]
+
+            wait_until(_is_settled, 0.5, backoff=Backoff(0.05),
+                       name='WinGUIManager.get_web_control')
+            return web_control
         except Exception:
             return None
 
@@ -286,98 +278,636 @@ class WinGUIManager(BasicWndHandler):
         return webdriver
 
 
-class MamutManager:
-    """Klasse for å benytte funksjonalitet i Mamut."""
+# Pause mellom sjekk av om Mamut-vinduet har begynt å lagre, se
+# MamutManager._save_order
+SAVE_BUSY_BACKOFF = Backoff(0.01, max_interval=0.05)
+
+
+# Levetid (sekunder) for cachede spørreresultater per spørringsfamilie,
+# se MamutManager.lookup_db
+RESULT_CACHE_TTLS = {
+    'customer': 3600.,          # Kundenavn
+    'prod_by_sn': 3600.,        # Produktnummer for serienummer
+    'main_office': 600.,        # Hovedkontor-info for ordre
+    'stock': 60.,               # Serienumre på lager
+}
+
+
+# Antall ordrer med lagrede varer i MamutManager, se
+# MamutManager.refresh_ordered_prods
+ORDER_SNAPSHOT_COUNT = 32
+
+
+# Kolonner fra g_order m.fl. i MamutManager.get_order_properties
+ORDER_PROPERTIES_COLUMNS = """
+            g_clisys.descr                 AS lev_betingelser,
+            g_contac.countrycodecustomer   AS country_id,   /* Norge = 1*/
+            g_contac.email                 AS cust_email,
+            g_contac.enterno               AS org_num,
+            g_currency.isocode             AS currency,
+            g_order.custid                 AS cust_num,
+            g_order.contname               AS cust_name,
+            g_order.curr_sum_n             AS brutto_sum,
+            g_order.data67                 AS avrunding_id,
+            g_order.datedeliv              AS lev_dato,
+            g_order.dateinvoice            AS fakturadato,
+            g_order.electronicdocumenttype AS is_ehf_invoice,
+            g_order.freightvolumesum       AS volume,
+            g_order.ifactoringstatus       AS is_factoring,
+            g_order.invoiceid              AS invoice_num,
+            g_order.lorderready            AS klar_til_fakturering,
+            g_order.maincontid             AS main_office_contact_num,
+            g_order.maincontname           AS main_office_name,
+            g_order.maincontres            AS is_main_office_invoiced,
+            g_order.refyour                AS deres_ref,
+            g_order.reference              AS referanse,
+            g_order.reportidinvoice        AS formular_id,
+            g_deli.zipcode                 AS zip_code,
+            w_delitypes.[freetext]         AS lev_form"""
+
+
+# Metoder som videresender spørringer til lookup_db, og derfor ikke
+# regnes som kallsted i MamutManager.query_stats
+_QUERY_FORWARDERS = ('lookup_reference', 'iter_reference')
+
+
+def make_records(col_headers, rows) -> list:
+    """Lag Record per rad, evt. NamedList ved uvanlige kolonnenavn."""
+    record_cls = make_record_class(tuple(col_headers))
+    if record_cls is None:
+        return [NamedList(**dict(zip(col_headers, row))) for row in rows]
+    return [record_cls(*row) for row in rows]
+
+
+def make_lazy_records(col_headers, raw_rows, converters) -> list:
+    """Lag LazyRecord per rad, som typecaster felt først ved lesing.
+
+    Ved uvanlige kolonnenavn typecastes alt med en gang, og det lages
+    NamedList som i make_records.
+    """
+    record_cls = make_lazy_record_class(tuple(col_headers))
+    if record_cls is None:
+        return make_records(col_headers, convert_rows(raw_rows, converters))
+    return [record_cls(row, converters) for row in raw_rows]
+
+
+def padded_chunks(values, chunk_size: int):
+    """Del liste i biter på maks chunk_size, for IN-lister.
+
+    Hver bit fylles opp med siste verdi til 8, 16, 32 osv. (maks
+    chunk_size) elementer, slik at få ulike SQL-setninger må
+    forberedes. Duplikater endrer ikke resultatet av IN (...).
+    """
+    for idx in range(0, len(values), chunk_size):
+        chunk = values[idx:idx + chunk_size]
+        param_count = min(chunk_size, 8)
+        while param_count < len(chunk):
+            param_count = min(chunk_size, param_count * 2)
+        yield chunk + chunk[-1:] * (param_count - len(chunk))
+
+
+def make_serial_number_mask(serial_numbers) -> str:
+    """Lag maske av serienumre, med 'x' der tegnene er ulike.
+
+    serial_numbers kan være en iterator, og gås gjennom én gang uten
+    å lagres. Bare posisjoner som fortsatt er like sjekkes for hvert
+    serienummer. Ved ulik lengde blir masken like lang som det
+    korteste serienummeret (som med zip). Ingen serienumre gir 'xxx'.
+
+    Eksempel: make_serial_number_mask(['0611', '0612']) -> '061x'
+    """
+    serial_numbers = iter(serial_numbers)
+    first_serial = next(serial_numbers, None)
+    if first_serial is None:
+        return 'xxx'
+    if not first_serial:
+        return ''
+
+    mask = list(first_serial)
+    mask_len = len(mask)
+    fixed_positions = range(mask_len)
+    # itemgetter med minst to posisjoner gir alltid tuple
+    get_fixed = operator.itemgetter(*fixed_positions, 0, 0)
+    fixed_chars = get_fixed(first_serial)
+
+    for serial_num in serial_numbers:
+        if len(serial_num) < mask_len:
+            mask_len = len(serial_num)
+            fixed_positions = [pos for pos in fixed_positions
+                               if pos < mask_len]
+        elif get_fixed(serial_num) == fixed_chars:
+            continue
+        if not mask_len:
+            break
+        fixed_positions = [pos for pos in fixed_positions
+                           if serial_num[pos] == mask[pos]]
+        for pos in range(mask_len):
+            if pos not in fixed_positions:
+                mask[pos] = 'x'
+        get_fixed = operator.itemgetter(*fixed_positions, 0, 0)
+        fixed_chars = get_fixed(mask)
+
+    return ''.join(mask[:mask_len])
+
+
+class ProdClassIndex:
+    """Produktkategori og flagg per Mamut-produktnummer.
+
+    Bygges ved første oppslag fra produktnumrene i okn_constants og
+    g_prod.usestore (én spørring), og gir deretter kategori med ett
+    dict-oppslag. refresh() leser g_prod på nytt, f.eks. etter at nye
+    produkter er lagt inn; classify() gjør dette selv ved ukjent
+    produktnummer. Én indeks per prosess, PROD_CLASS_INDEX, deles av
+    alle MamutManager.
+
+    Metodene som kan lese g_prod tar iter_db, funksjon som
+    MamutManager.iter_db, slik at indeksen ikke er bundet til én
+    databasetilkobling.
+
+    Eksempel:
+        PROD_CLASS_INDEX.classify('FP00', mamut.iter_db)
+        -> (ProdClassIndex.NON_STOR, ProdClassIndex.IS_FP00)
+    """
+
+    # Kategorier, i samme rekkefølge som CATEGORY_NAMES
+    MOUTHPIECE, SN_DEVICE, OTHER_STOR, NON_STOR = range(4)
+    # Feltnavn i get_ordered_prods per kategori
+    CATEGORY_NAMES = ('mouthpcs', 'sn_devices', 'other_stor', 'non_stor')
+
+    # Flagg, kan kombineres
+    IS_FP00 = 1
+    IS_LIC_RENEWAL = 2
 
     def __init__(self):
+        self._lock = threading.Lock()
+        self._classes = None
+
+    @classmethod
+    def _flags(cls, prod_num) -> int:
+        """Flagg for produktnummer ut fra konstantene."""
+        flags = 0
+        if prod_num == 'FP00':
+            flags |= cls.IS_FP00
+        if prod_num in LIC_RENEWAL_PROD_NUMS:
+            flags |= cls.IS_LIC_RENEWAL
+        return flags
+
+    def _load(self, iter_db) -> None:
+        """Bygg indeksen fra g_prod og konstantene."""
+        classes = {}
+        for prod in iter_db(
+                "SELECT prodid AS prod_num, usestore FROM g_prod"):
+            if classes.get(prod.prod_num, (None,))[0] == self.OTHER_STOR:
+                continue        # Samme produktnummer flere ganger
+            category = self.OTHER_STOR if prod.usestore else self.NON_STOR
+            classes[prod.prod_num] = (category, self._flags(prod.prod_num))
+        # Munnstykker går foran apparater, som før
+        for prod_num in SN_PROD_NUMS:
+            classes[prod_num] = (self.SN_DEVICE, self._flags(prod_num))
+        for prod_num in MOUTHPIECES_PROD_NUMS:
+            classes[prod_num] = (self.MOUTHPIECE, self._flags(prod_num))
+        self._classes = classes
+        return None
+
+    def refresh(self, iter_db) -> None:
+        """Les g_prod.usestore for alle produkter på nytt."""
+        with self._lock:
+            self._load(iter_db)
+        return None
+
+    def _get_classes(self, iter_db) -> dict:
+        """Indeksen, bygges ved første kall."""
+        if self._classes is None:
+            with self._lock:
+                if self._classes is None:
+                    self._load(iter_db)
+        return self._classes
+
+    def get(self, prod_num, iter_db):
+        """(kategori, flagg) for produktnummer, None hvis ukjent."""
+        return self._get_classes(iter_db).get(prod_num)
+
+    def classify(self, prod_num, iter_db) -> tuple:
+        """(kategori, flagg) for produktnummer.
+
+        Ukjent produktnummer gir én ny innlesning av g_prod. Er det
+        fortsatt ukjent, regnes det som ikke-lagervare.
+        """
+        prod_class = self.get(prod_num, iter_db)
+        if prod_class is None:
+            self.refresh(iter_db)
+            prod_class = self._classes.get(prod_num)
+        if prod_class is None:
+            prod_class = (self.NON_STOR, self._flags(prod_num))
+        return prod_class
+
+
+# Produktkategorier for alle MamutManager i prosessen, leses fra g_prod
+# ved første bruk
+PROD_CLASS_INDEX = ProdClassIndex()
+
+
+class MamutManager:
+    """Klasse for å benytte funksjonalitet i Mamut.
+
+    :param connect: Funksjon som returnerer ny DB-API-tilkobling,
+        standard er backend.connect
+    :param backend: Database, f.eks. okn_db.SqliteBackend med
+        testdata. Standard velges med okn_db.get_backend.
+    :param replica: Lokal kopi av referansetabeller, se
+        okn_db_replica.ReferenceReplica og lookup_reference. Standard
+        velges med okn_db_replica.get_replica.
+    :param query_stats: okn_db.QueryStats for tidsmåling av
+        lookup_db. Standard har grense for trege spørringer og
+        loggfil fra miljøvariablene OKN_DB_SLOW_QUERY_SECONDS
+        (standard 0.5) og OKN_DB_SLOW_QUERY_LOG.
+    :param prod_class_index: ProdClassIndex, standard er
+        PROD_CLASS_INDEX. Egen indeks trengs bare mot annen database
+        enn øvrige MamutManager i prosessen, f.eks. testdata.
+
+    Databasetilkoblinger gjenbrukes via self.db_pool, og lukkes med
+    close() eller ved bruk av with-blokk:
+        with MamutManager() as mamut:
+            mamut.lookup_db('SELECT name FROM g_contac')
+    """
+
+    def __init__(self, connect=None, *, backend=None, replica=None,
+                 query_stats=None, prod_class_index=None):
         self.wingui = WinGUIManager()
         self.app_gui = None
+        self.mamut_wnd_handle = None
         self.curr_order_num = None
         self.curr_order_is_invoiced: bool = False
         self.is_alive: bool = False
+        self.db_backend = backend or get_backend()
+        self.db_pool = ConnectionPool(connect or self.db_backend.connect)
+        self.result_cache = ResultCache(ttls=RESULT_CACHE_TTLS)
+        # Like spørringer som kjører samtidig deler resultat
+        self.single_flight = SingleFlight(copy_result=self._copy_result)
+        # For uavhengige spørringer som kjøres samtidig
+        self.db_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.db_pool.max_size,
+            thread_name_prefix='mamut_db')
+        self.replica = replica if replica is not None else get_replica()
+        if query_stats is None:
+            query_stats = QueryStats(
+                slow_threshold=float(
+                    os.environ.get('OKN_DB_SLOW_QUERY_SECONDS', 0.5)),
+                slow_log_path=os.environ.get('OKN_DB_SLOW_QUERY_LOG'))
+        self.query_stats = query_stats
+        # Sist innleste varer per ordre, se refresh_ordered_prods.
+        # Én lås per ordre, som finnes så lenge den er i bruk eller
+        # ordren er lagret. _order_snapshot_lock holdes bare under
+        # oppslag og endring i _order_snapshots og _order_locks.
+        self._order_snapshots = collections.OrderedDict()
+        self._order_locks = weakref.WeakValueDictionary()
+        self._order_snapshot_lock = threading.Lock()
+        # Produktkategorier, felles for prosessen
+        self.prod_class_index = (prod_class_index
+                                 if prod_class_index is not None
+                                 else PROD_CLASS_INDEX)
+
+    def __enter__(self):
+        return self
+
+    def _iter_prods(self, sql_statement):
+        """Records fra g_prod, for self.prod_class_index."""
+        return self.iter_reference(sql_statement, tables=['g_prod'])
+
+    def classify_prod(self, prod_num) -> tuple:
+        """(kategori, flagg) for produktnummer, se ProdClassIndex."""
+        return self.prod_class_index.classify(prod_num, self._iter_prods)
+
+    def refresh_prod_classes(self) -> None:
+        """Les produktkategorier fra g_prod på nytt, f.eks. etter at
+        nye produkter er lagt inn i Mamut."""
+        self.prod_class_index.refresh(self._iter_prods)
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
 
-    def lookup_db(self, sql_statement):
+    def close(self) -> None:
+        """Lukk databasetilkoblinger."""
+        self.db_executor.shutdown()
+        if self.replica is not None:
+            self.replica.close()
+        self.db_pool.close()
+        return None
+
+    def lookup_db(self, sql_statement, params=None, *,
+                  cache_family=None,
+                  cache_tags=(),
+                  use_cache: bool = True,
+                  as_columns: bool = False,
+                  is_lazy: bool = False):
         """Eksekver SQL-spørring mot Mamut-database.
 
-        Returnerer liste av NamedList (en record per element, nøkkel
-        er attributtnavn. Dersom ingen record, returneres None.
+        Verdier i spørringen angis som bind-parametere (?) med
+        verdier i params, slik at SQL-setningen kan gjenbrukes fra
+        cache av forberedte setninger, se statement_cache_stats.
+
+        Med cache_family (se RESULT_CACHE_TTLS) hentes resultatet fra
+        self.result_cache dersom det finnes og ikke er utløpt, ellers
+        lagres det der, evt. med cache_tags for målrettet fjerning.
+        use_cache=False gir ferske data fra databasen, og oppdaterer
+        cachen.
+
+        Kjører samme spørring (SQL-tekst uten forskjeller i mellomrom,
+        og samme params) allerede fra en annen tråd, ventes det på
+        denne, og kalleren får kopi av resultatet i stedet for å sende
+        spørringen på nytt, se self.single_flight og
+        single_flight_stats.
+
+        Tid per fase, antall rader og kallsted registreres i
+        self.query_stats, se okn_db.QueryStats.
+
+        Returnerer liste av Record, som oppfører seg som NamedList (en
+        record per element, nøkkel er attributtnavn. Dersom ingen
+        record, returneres [None].
+
+        Med as_columns=True returneres i stedet dict med én typet
+        array per kolonne (NumPy dersom installert), for analyser over
+        mange rader, se okn_db.make_column_arrays. Typecasting er som
+        for records, og ingen rader gir tomme arrays. Kan ikke
+        kombineres med cache_family.
+
+        Med is_lazy=True typecastes hvert felt først når det leses (se
+        okn_basic_classes.LazyRecord), noe som lønner seg for brede
+        spørringer der bare noen få kolonner brukes. Kan ikke
+        kombineres med as_columns.
+
+        Eksempel:
+            mamut.lookup_db('SELECT name FROM g_contac WHERE custid = ?',
+                            [cust_num])
         """
-        def autoconvert(val):
-            """Typecaster verdi til mest passende type.
-
-            Verdier hentet via SQL-spørring har allerede variabeltypen
-            slik den er definert i Mamut-databasen, men det kan være
-            hensiktsmessig å overstyre typen og bearbeide/parse
-            verdiene ytterligere. Returnerer verdi av type
-            bool, int, float, pendulum.datetime eller str.
-
-            Eksempel:
-                1234 -> int
-                '1234' -> int
-                '1234.0' -> int
-                '1234.5' -> float
-                '01234' -> str
-                '0' -> int
-            """
-            if isinstance(val, bool):
-                assert type(val).__name__ == 'bool', "Feil type"
-            elif val is None:
-                assert type(val).__name__ == 'NoneType', "Feil type"
-            else:
-                # Uvisst om replace er nødvendig
-                val = str(val).strip().replace('\r', '\n')
+        assert not (as_columns and cache_family), \
+            "as_columns kan ikke kombineres med cache_family"
+        assert not (as_columns and is_lazy), \
+            "as_columns kan ikke kombineres med is_lazy"
+
+        t_start = time.perf_counter()
+        cache_key = None
+        if cache_family is not None:
+            cache_key = (sql_statement, tuple(params or ()))
+            if use_cache:
+                is_found, query_refined = self.result_cache.get(cache_key)
+                if is_found:
+                    if self.query_stats.is_enabled:
+                        rows, cols = self._result_shape(query_refined)
+                        self._record_query(
+                            sql_statement, params,
+                            elapsed=time.perf_counter() - t_start,
+                            rows=rows, cols=cols)
+                    return query_refined
+
+        timing = {}
+
+        def _execute():
+            with self.db_pool.connection() as conn:
+                timing['connected'] = time.perf_counter()
+                statements = self.db_pool.statements(conn)
+                cursor = statements.execute(sql_statement, params)
+                timing['executed'] = time.perf_counter()
+                query_raw = list(cursor.fetchall())
+
+                description = cursor.description
+                statements.release(sql_statement, cursor)
+            timing['fetched'] = time.perf_counter()
+            timing['shape'] = (len(query_raw), len(description))
+
+            if as_columns:
+                return self._refine_query_columns(description, query_raw)
+            return self._refine_query(description, query_raw,
+                                      is_lazy=is_lazy)
+
+        # Lister som params kan ikke hashes, og gjøres om til tuple
+        flight_params = (tuple(params) if isinstance(params, (list, tuple))
+                         else params)
+        query_refined, is_shared = self.single_flight.run(
+            (normalize_sql(sql_statement), flight_params, as_columns,
+             is_lazy),
+            _execute)
+
+        if is_shared:
+            # Spørringen ble registrert og evt. cachet av den som kjørte
+            # den, her registreres bare ventetiden
+            if self.query_stats.is_enabled:
+                rows, cols = self._result_shape(query_refined)
+                self._record_query(sql_statement, params,
+                                   elapsed=time.perf_counter() - t_start,
+                                   rows=rows, cols=cols)
+            return query_refined
 
-                if all([val != '0', val.startswith('0'),
-                        not val.startswith('0.')]):
-                    assert type(val).__name__ == 'str', "Feil type"
-                else:
-                    try:
-                        val = float(val)
-                    except ValueError:      # Dersom str (ikke int/float)
-                        try:
-                            val = pendulum.from_format(
-                                val, 'YYYY-MM-DD HH:mm:SS')
-                            assert type(val).__name__ == 'DateTime', \
-                                "Feil type"
-                        except ValueError:
-                            assert type(val).__name__ == 'str', "Feil type"
-                    else:                   # Dersom tall (int/float)
-                        if val.is_integer():
-                            val = int(val)
-                            assert type(val).__name__ == 'int', "Feil type"
-                        else:
-                            assert type(val).__name__ == 'float', "Feil type"
-            return val
-
-        conn = pypyodbc.connect(r'Driver={SQL Server};'
-                                r'Server=[SERVER NAME]t;'
-                                r'Database=[DB NAME];'
-                                r'uid=[UID];'
-                                r'pwd=[PWD]')
-        cursor = conn.cursor()
-        cursor.execute(sql_statement)
-        query_raw = list(cursor.fetchall())
+        if self.query_stats.is_enabled:
+            t_end = time.perf_counter()
+            self._record_query(
+                sql_statement, params,
+                elapsed=t_end - t_start,
+                rows=timing['shape'][0],
+                cols=timing['shape'][1],
+                phases=dict(connect=timing['connected'] - t_start,
+                            execute=timing['executed'] - timing['connected'],
+                            fetch=timing['fetched'] - timing['executed'],
+                            convert=t_end - timing['fetched']))
+        if cache_key is not None:
+            self.result_cache.put(cache_key, query_refined,
+                                  family=cache_family, tags=cache_tags)
+        return query_refined
+
+    @staticmethod
+    def _result_shape(query_refined) -> tuple:
+        """(rader, kolonner) for resultat fra lookup_db."""
+        if isinstance(query_refined, dict):             # as_columns
+            return (len(next(iter(query_refined.values()), ())),
+                    len(query_refined))
+        first_row = query_refined[0]
+        if first_row is None:
+            return 0, 0
+        # _fields for Record, uten å typecaste LazyRecord
+        return (len(query_refined),
+                len(getattr(first_row, '_fields', None) or first_row))
+
+    @staticmethod
+    def _copy_result(query_refined):
+        """Kopi av resultat fra lookup_db, per rad eller kolonne."""
+        if isinstance(query_refined, dict):             # as_columns
+            return {name: copy.copy(column)
+                    for name, column in query_refined.items()}
+        return [copy.copy(row) if row is not None else None
+                for row in query_refined]
+
+    def _record_query(self, sql_statement, params, *,
+                      elapsed, rows, cols, phases=None) -> None:
+        """Registrer spørring fra lookup_db i self.query_stats."""
+        self.query_stats.record(
+            self.query_stats.call_site(_QUERY_FORWARDERS, depth=3),
+            sql_statement=sql_statement, params=params, elapsed=elapsed,
+            rows=rows, cols=cols, phases=phases, is_cached=phases is None)
+        return None
 
+    @staticmethod
+    def _refine_query(description, query_raw, *,
+                      is_lazy: bool = False) -> list:
+        """Typecast rader fra spørring, og lag liste av Record.
+
+        Med is_lazy=True lages LazyRecord, som typecaster ved lesing.
+        Returnerer [None] dersom ingen rader.
+        """
         # Liste over kolonnenavn
-        col_headers = [var_tuple[0] for var_tuple in cursor.description]
-
-        cursor.close()
-        del cursor
-        conn.close()
-
-        # Lag liste av NamedList. Ett listeelement = 1 db-record.
-        # Attributt aksesseres med syntaks
-        # [namedlist_navn].[attributt_navn]
-        query_refined = []
-        for record in (query_raw):
-            attribs = NamedList()
-            for idx, elem in enumerate(record):
-                setattr(attribs, col_headers[idx], autoconvert(elem))
-            query_refined.append(attribs)
-        if len(query_refined) == 0:
-            return [None]
+        col_headers = [var_tuple[0] for var_tuple in description]
+
+        # Typecasting velges per kolonne, se okn_db.autoconvert
+        converters = build_converters(description,
+                                      query_raw[:CONVERTER_SAMPLE_SIZE])
+
+        # Lag liste av Record (NamedList-kompatibel). Ett listeelement
+        # = 1 db-record. Attributt aksesseres med syntaks
+        # [record_navn].[attributt_navn]
+        if is_lazy:
+            query_refined = make_lazy_records(col_headers, query_raw,
+                                              converters)
         else:
-            return query_refined
+            query_refined = make_records(col_headers,
+                                         convert_rows(query_raw, converters))
+        if len(query_refined) == 0:
+            query_refined = [None]
+        return query_refined
+
+    @staticmethod
+    def _refine_query_columns(description, query_raw) -> dict:
+        """Typecast rader fra spørring, og lag typet array per kolonne."""
+        col_headers = [var_tuple[0] for var_tuple in description]
+        converters = build_converters(description,
+                                      query_raw[:CONVERTER_SAMPLE_SIZE])
+        return make_column_arrays(col_headers,
+                                  convert_columns(query_raw, converters))
+
+    def lookup_reference(self, sql_statement, params=None, *,
+                         tables,
+                         cache_family=None,
+                         cache_tags=(),
+                         use_cache: bool = True):
+        """Eksekver spørring mot referansetabeller, som lookup_db.
+
+        Med lokal kopi (self.replica) besvares spørringen der, etter
+        at tabellene i tables er synkronisert dersom de er eldre enn
+        replica.max_staleness. Ellers brukes lookup_db med cache_family,
+        cache_tags og use_cache.
+
+        :param tables: Tabeller spørringen bruker, f.eks. ['g_contac']
+        """
+        if self.replica is None:
+            return self.lookup_db(sql_statement, params,
+                                  cache_family=cache_family,
+                                  cache_tags=cache_tags,
+                                  use_cache=use_cache)
+        self.replica.ensure_fresh(self.db_pool, tables)
+        return self._refine_query(
+            *self.replica.execute(sql_statement, params))
+
+    def iter_reference(self, sql_statement, params=None, *, tables):
+        """Som lookup_reference, men som iter_db: gir records
+        fortløpende, og ingen elementer ved tomt resultat."""
+        if self.replica is None:
+            yield from self.iter_db(sql_statement, params)
+            return
+        query_refined = self.lookup_reference(sql_statement, params,
+                                              tables=tables)
+        if query_refined != [None]:
+            yield from query_refined
+
+    def iter_db(self, sql_statement, params=None, *,
+                batch_size: int = 500):
+        """Eksekver SQL-spørring, og returner records fortløpende.
+
+        Som lookup_db, men radene hentes med fetchmany i bolker på
+        batch_size, og gis som Record én og én, slik at hele
+        resultatet aldri ligger i minnet samtidig. Ved ingen record
+        gis ingen elementer (ikke [None]).
+
+        Databasetilkoblingen er lånt ut til gjennomløpet er ferdig,
+        eller generatoren lukkes/forkastes.
+
+        Eksempel:
+            for storeitem in mamut.iter_db('SELECT serialnr '
+                                           'FROM g_storeitem'):
+                print(storeitem.serialnr)
+        """
+        assert batch_size >= 1, \
+            f"batch_size må være minst 1, mottok {batch_size}"
+
+        conn = self.db_pool.acquire()
+        is_conn_broken = True
+        try:
+            statements = self.db_pool.statements(conn)
+            cursor = statements.execute(sql_statement, params)
+            is_cursor_done = False
+            try:
+                description = cursor.description
+                col_headers = [var_tuple[0] for var_tuple in description]
+                converters = None
+                while True:
+                    query_raw = cursor.fetchmany(batch_size)
+                    if not query_raw:
+                        break
+                    if converters is None:
+                        converters = build_converters(
+                            description, query_raw[:CONVERTER_SAMPLE_SIZE])
+                    yield from make_records(
+                        col_headers, convert_rows(query_raw, converters))
+                is_cursor_done = True
+            finally:
+                # Cursor med uleste rader kan ikke gjenbrukes
+                if is_cursor_done:
+                    statements.release(sql_statement, cursor)
+                else:
+                    cursor.close()
+            is_conn_broken = False
+        except GeneratorExit:
+            # Gjennomløp avbrutt av kaller, tilkoblingen er i orden
+            is_conn_broken = False
+            raise
+        finally:
+            self.db_pool.release(conn, discard=is_conn_broken)
+
+    def invalidate_cache(self, *, order_num=None, family=None) -> None:
+        """Fjern cachede spørreresultater.
+
+        order_num: Fjern resultater knyttet til ordre
+        family: Fjern alle resultater i familie, se RESULT_CACHE_TTLS
+        Uten argumenter tømmes hele cachen.
+        """
+        if order_num is None and family is None:
+            self.result_cache.invalidate()
+        if order_num is not None:
+            self.result_cache.invalidate(tag=('order', order_num))
+        if family is not None:
+            self.result_cache.invalidate(family=family)
+        return None
+
+    def statement_cache_stats(self) -> dict:
+        """Returner treff, bom og treffrate for forberedte SQL-setninger."""
+        return self.db_pool.statement_stats()
+
+    def single_flight_stats(self) -> dict:
+        """Returner kjøringer og sparte spørringer ved delte resultater."""
+        return self.single_flight.stats()
+
+    def _order_title(self) -> str:
+        """
+        Innhold i txtShortName i åpen Mamut-ordre, f.eks. 'Ordre
+        100001'. '' dersom feltet ikke finnes (ingen åpen ordre).
+        Venter ikke på feltet, og kan brukes med wait_until.
+        """
+        try:
+            txt_short_name = self.gui_app.child_window(title='txtShortName',
+                                                       control_type='Edit')
+            if not txt_short_name.exists(timeout=0.):
+                return ''
+            return txt_short_name.iface_value.CurrentValue or ''
+        except Exception:               # COMError, vindu forsvant
+            return ''
 
     def scan_order_num(self):
         """
@@ -415,10 +945,10 @@ class MamutManager:
         elif "Faktura" in order_or_invoice_str:
             invoice_number = order_or_invoice_str.split()[1]
             self.curr_order_is_invoiced = True
-            self.curr_order_num: int = self.lookup_db(f"""
+            self.curr_order_num: int = self.lookup_db("""
                  SELECT orderid FROM g_order
-                 WHERE invoiceid = {invoice_number}
-            """)[0].orderid
+                 WHERE invoiceid = ?
+            """, [int(invoice_number)])[0].orderid
             print(self.curr_order_num)
             print(f"Detektert fakturanummer: {invoice_number}")
         else:
@@ -436,22 +966,37 @@ class MamutManager:
         - self.gui_app: pywinauto-objekt for å kontrollere dialoger i Mamut
         """
         print("Kobler til Mamut-applikasjon... ", end="")
-        if 'Mamut.exe' not in subprocess.getoutput('tasklist'):
+        # Synlig Mamut-vindu betyr at Mamut kjører, da trengs ikke
+        # tasklist, som er tregt
+        mamut_wnd = self.wingui.match_wnds({'mamut': MAMUT_RE},
+                                           timeout=0.)['mamut']
+        if (mamut_wnd is None
+                and 'Mamut.exe' not in subprocess.getoutput('tasklist')):
             print("feilet.\n"
                   "Mamut.exe må være aktiv.")
             okn.mention_return_to_main_menu()
             self.is_alive = False
             self.gui_app = None
+            self.mamut_wnd_handle = None
         else:
             print("OK")
-            self.wingui.wnd_focus(title_re=MAMUT_RE,
-                                  is_maximized=True)['wnd_handle']
+            if mamut_wnd is not None:
+                self.mamut_wnd_handle = mamut_wnd[0]
+                self.wingui.focus_wnd(self.mamut_wnd_handle,
+                                      is_maximized=True)
+            else:
+                self.mamut_wnd_handle = self.wingui.wnd_focus(
+                    title_re=MAMUT_RE, is_maximized=True)['wnd_handle']
             self.is_alive = True
-            self.gui_app = (PWA_App(backend="uia").connect(title_re=MAMUT_RE,
-                                                           found_index=0)
-                                                  .window(title_re=MAMUT_RE,
-                                                          found_index=0)
-                            )
+            if self.mamut_wnd_handle:
+                # Samme vindu, uten nytt søk etter tittel
+                self.gui_app = (PWA_App(backend="uia")
+                                .connect(handle=self.mamut_wnd_handle)
+                                .window(handle=self.mamut_wnd_handle))
+            else:
+                self.gui_app = (PWA_App(backend="uia")
+                                .connect(title_re=MAMUT_RE, found_index=0)
+                                .window(title_re=MAMUT_RE, found_index=0))
         return None
 
     def open_customer(self, *,
@@ -475,12 +1020,13 @@ class MamutManager:
             self.update_sys_info()
             assert self.is_alive, "Mamut er ikke aktiv"
 
-        self.wingui.wnd_focus(title_re=MAMUT_RE, is_maximized=True)
+        self.wingui.apply_layout('mamut')
 
-        customer_name = self.lookup_db(f"""
+        customer_name = self.lookup_reference("""
              SELECT name FROM g_contac
-             WHERE custid = {cust_num}
-        """)[0].name
+             WHERE custid = ?
+        """, [cust_num], tables=['g_contac'], cache_family='customer',
+             cache_tags=[('cust', cust_num)])[0].name
         pyperclip.copy(customer_name)
 
         print(f"Henter kunde {customer_name}... ", end="")
@@ -507,6 +1053,7 @@ class MamutManager:
 
         if action == 'create_new':
             print("Oppretter ny Mamut-ordre... ", end="")
+            previous_order_title = self._order_title()
             (self.gui_app
                  .child_window(title='New',
                                control_type='Group',
@@ -514,9 +1061,14 @@ class MamutManager:
                                )
                  .click_input()
              )
-            # Muligens nødvendig pause for å hindre at annen åpen ordre
+            # Vent til ny ordre vises, for å hindre at annen åpen ordre
             # hentes opp
-            time.sleep(0.2)
+            is_new_order = wait_until(
+                lambda: self._order_title() not in ('', previous_order_title),
+                5., name='MamutManager.open_customer.new_order')
+            assert is_new_order, \
+                ("Ny Mamut-ordre ble ikke vist innen 5 sek, "
+                 f"ordrefelt viser '{self._order_title()}'.")
             print("OK")                 # Ferdig opprettet Mamut-ordre
         elif action == 'open_existing':
             # Feltnavn kan variere, derfor (?i) = case-insensitive
@@ -535,21 +1087,63 @@ class MamutManager:
             print("OK")                 # Ferdig åpnet eksisterende Mamut-ordre
 
         pyperclip.copy(clipboard)       # Tilbakefør oppr. utklippstavle
-        time.sleep(0.2)                 # For sikkerhets skyld
+        if not wait_until(lambda: pyperclip.paste().strip() == clipboard, 1.,
+                          name='MamutManager.open_customer.clipboard'):
+            print("Advarsel: Opprinnelig utklippstavle ble ikke "
+                  "tilbakeført.")
         return None
 
-    def get_ordered_prods(self):
+    def _load_ordered_prods(self, order_nums, *,
+                            chunk_size: int = 500) -> dict:
         """
-        Leser ordrelinjer fra åpen Mamut-ordre etter SQL-spørring
-        mot database, og deler resultatet inn i grupper:
-        - Munnstykker
-        - Andre lagervarer
-        - Ikke-lagervarer
-        Mulig innparameter: Mamut-ordrenummer
+        Hent ordrelinjer for flere ordrer, med én spørring per
+        chunk_size ordrenumre. Returnerer dict med liste av rader
+        (prod_num, qtyorder, abs_qtyorder) per ordrenummer, tom liste
+        for ordre uten varer.
         """
+        assert 1 <= chunk_size <= 2000, \
+            f"chunk_size må være mellom 1 og 2000, mottok {chunk_size}"
+
+        order_nums = list(dict.fromkeys(order_nums))
+        prod_rows_by_order = {order_num: [] for order_num in order_nums}
+        # Ordrenumre fra databasen typecastes, og må sammenlignes i
+        # samme form
+        order_num_by_key = {autoconvert(e): e for e in order_nums}
+
+        for chunk in padded_chunks(order_nums, chunk_size):
+            placeholders = ', '.join('?' * len(chunk))
+            # Summering per produkt gjøres i databasen, både med og
+            # uten abs() - se _make_ordered_prods. Produktene kommer i
+            # rekkefølge etter første ordrelinje, som i ordren
+            prod_qry = self.lookup_db(f"""
+                SELECT g_order.orderid AS order_num,
+                g_orderl.prodid AS prod_num,
+                SUM(g_orderl.qtyorder) AS qtyorder,
+                SUM(ABS(g_orderl.qtyorder)) AS abs_qtyorder
+                FROM g_orderl
+                JOIN g_order ON g_orderl.linkid=g_order.linkid
+                JOIN g_prod ON g_prod.prodid=g_orderl.prodid
+                WHERE g_order.orderid IN ({placeholders})
+                /* Neglisjér strukturvare-produkt*/
+                AND g_orderl.repstrucorder = 0
+                GROUP BY g_order.orderid, g_orderl.prodid
+                ORDER BY g_order.orderid, MIN(g_orderl.uniqueid)
+            """, chunk)
 
-        assert self.curr_order_num, "Ikke gyldig ordrenummer"
-
+            for elem in prod_qry:
+                if elem is None:
+                    continue
+                order_num = order_num_by_key.get(elem.order_num)
+                if order_num is not None:
+                    prod_rows_by_order[order_num].append(elem)
+        return prod_rows_by_order
+
+    def _make_ordered_prods(self, order_num, prod_rows):
+        """
+        Del ordrelinjer (fra _load_ordered_prods) inn i grupper etter
+        self.prod_class_index, og sett has_*-flagg. Returnerer
+        NamedList.
+        """
         mamut_order_prods = NamedList(
             mouthpcs=dict(),
             sn_devices=dict(),
@@ -559,53 +1153,25 @@ class MamutManager:
             has_only_non_stor_prods=False,
             has_only_mouthpiece_prods=False,
             has_lic_renewal_prods=False,
-            num=self.curr_order_num
+            num=order_num
         )
 
-        prod_qry = self.lookup_db(f"""
-            SELECT g_orderl.qtyorder,
-            g_orderl.prodid AS prod_num,
-            g_prod.usestore
-            FROM g_orderl
-            JOIN g_order ON g_orderl.linkid=g_order.linkid
-            JOIN g_prod ON g_prod.prodid=g_orderl.prodid
-            WHERE g_order.orderid = {mamut_order_prods.num}
-            AND g_orderl.repstrucorder = 0  /* Neglisjér strukturvare-produkt*/
-        """)
-
-        if prod_qry != [None]:
-
-            for elem in prod_qry:
-                # Munnstykker
-                if elem.prod_num in MOUTHPIECES_PROD_NUMS:
-                    if elem.prod_num not in mamut_order_prods.mouthpcs.keys():
-                        mamut_order_prods.mouthpcs[elem.prod_num] = 0.
-                    mamut_order_prods.mouthpcs[elem.prod_num] += elem.qtyorder
-                # Apparat med serienummer
-                elif elem.prod_num in SN_PROD_NUMS:
-                    if (elem.prod_num not in
-                       mamut_order_prods.sn_devices.keys()):
-                        mamut_order_prods.sn_devices[elem.prod_num] = 0.
-                    # Bruk av abs() for ordrer der noteres f.eks. -1 apparater,
-                    # for returer, slik at dette telles som 1
-                    mamut_order_prods.sn_devices[elem.prod_num] += abs(
-                        elem.qtyorder)
-                # Øvrige lagervarer
-                elif elem.usestore:  # Lagervare
-                    if (elem.prod_num not in
-                       mamut_order_prods.other_stor.keys()):
-                        mamut_order_prods.other_stor[elem.prod_num] = 0.
-                    mamut_order_prods.other_stor[elem.prod_num] += \
-                        elem.qtyorder
-                # Ikke-lagervarer
-                else:
-                    if elem.prod_num not in mamut_order_prods.non_stor.keys():
-                        mamut_order_prods.non_stor[elem.prod_num] = 0.
-                    if elem.prod_num == 'FP00':
-                        mamut_order_prods.has_FP00_prod = True
-                    if elem.prod_num in LIC_RENEWAL_PROD_NUMS:
-                        mamut_order_prods.has_lic_renewal_prods = True
-                    mamut_order_prods.non_stor[elem.prod_num] += elem.qtyorder
+        classify = self.classify_prod
+        category_dicts = [getattr(mamut_order_prods, category_name) for
+                          category_name in ProdClassIndex.CATEGORY_NAMES]
+        for elem in prod_rows:
+            category, flags = classify(elem.prod_num)
+            # Bruk av abs() for apparater, for ordrer der noteres f.eks.
+            # -1 apparater for returer, slik at dette telles som 1.
+            # float som ved summering per ordrelinje tidligere.
+            category_dicts[category][elem.prod_num] = float(
+                elem.abs_qtyorder if category == ProdClassIndex.SN_DEVICE
+                else elem.qtyorder)
+            if category == ProdClassIndex.NON_STOR:
+                if flags & ProdClassIndex.IS_FP00:
+                    mamut_order_prods.has_FP00_prod = True
+                if flags & ProdClassIndex.IS_LIC_RENEWAL:
+                    mamut_order_prods.has_lic_renewal_prods = True
 
         mamut_order_prods.has_stor_prods = True if any(
             (mamut_order_prods.mouthpcs,
@@ -627,6 +1193,11 @@ class MamutManager:
              )
         ) else False
 
+        return mamut_order_prods
+
+    @staticmethod
+    def print_ordered_prods(mamut_order_prods) -> None:
+        """Skriv ut varer fra get_ordered_prods per kategori."""
         print("\nVARER I MAMUT-ORDRE PER KATEGORI")
 
         print("Munnstykker:", end="")
@@ -660,12 +1231,227 @@ class MamutManager:
                       f'{mamut_order_prods.non_stor[prod_num]} x {prod_num}')
         else:
             print('\r\t\t\t---')
+        return None
 
+    def get_ordered_prods(self, order_num=None, *, is_full: bool = False):
+        """
+        Leser ordrelinjer fra åpen Mamut-ordre etter SQL-spørring
+        mot database, og deler resultatet inn i grupper:
+        - Munnstykker
+        - Andre lagervarer
+        - Ikke-lagervarer
+        Summeres per produkt, i rekkefølge etter første ordrelinje for
+        produktet. Kategori slås opp i self.prod_class_index.
+        Mulig innparameter: Mamut-ordrenummer, standard er
+        self.curr_order_num
+        Ved gjentatt kall for samme ordre hentes varene bare på nytt
+        dersom ordrelinjene er endret, se refresh_ordered_prods.
+        is_full=True henter alle varer på nytt.
+        """
+        mamut_order_prods = self.refresh_ordered_prods(order_num,
+                                                       is_full=is_full)
+        self.print_ordered_prods(mamut_order_prods)
         return mamut_order_prods
 
-    def get_order_properties(self, order_num=None):
+    def _order_lock(self, order_num) -> threading.Lock:
+        """Lås for oppdatering av lagrede varer for én ordre."""
+        with self._order_snapshot_lock:
+            lock = self._order_locks.get(order_num)
+            if lock is None:
+                lock = self._order_locks[order_num] = threading.Lock()
+        return lock
+
+    def _probe_order_lines(self, order_num) -> tuple:
+        """
+        Billig kontroll av om ordrelinjene i én ordre er endret: antall
+        linjer, summer og sjekksum over linje-id, produkt og antall for
+        linjene i _load_ordered_prods. Gir én rad, uten overføring av
+        linjene.
+        """
+        probe = self.lookup_db("""
+            SELECT COUNT(*) AS line_count,
+            SUM(g_orderl.qtyorder) AS qtyorder,
+            SUM(ABS(g_orderl.qtyorder)) AS abs_qtyorder,
+            CHECKSUM_AGG(CHECKSUM(g_orderl.uniqueid, g_orderl.prodid,
+                                  g_orderl.qtyorder)) AS line_checksum
+            FROM g_orderl
+            JOIN g_order ON g_orderl.linkid=g_order.linkid
+            JOIN g_prod ON g_prod.prodid=g_orderl.prodid
+            WHERE g_order.orderid = ?
+            /* Neglisjér strukturvare-produkt*/
+            AND g_orderl.repstrucorder = 0
+        """, [order_num])[0]
+        return (probe.line_count, probe.qtyorder, probe.abs_qtyorder,
+                probe.line_checksum)
+
+    def refresh_ordered_prods(self, order_num=None, *,
+                              is_full: bool = False):
+        """
+        Som get_ordered_prods, uten utskrift. Varene lagres per ordre
+        (maks ORDER_SNAPSHOT_COUNT ordrer) med kontrollverdier fra
+        _probe_order_lines. Neste gang for samme ordre hentes først
+        bare kontrollverdiene, og varene hentes og deles inn på nytt
+        (som i get_ordered_prods_batch) bare dersom disse er endret.
+        is_full=True henter alle varer på nytt.
+
+        Mamut har ikke endringsstempel (rowversion) på ordrelinjer, og
+        kontrollverdiene er derfor antall, summer og sjekksum. Lik
+        sjekksum etter endring krever i tillegg samme antall linjer og
+        samme summer; bruk evt. is_full=True.
+
+        Returnerer kopi per kaller, slik at endringer i returnert
+        NamedList ikke påvirker lagrede varer.
+        """
+        order_num = order_num or self.curr_order_num
         assert order_num, "Ikke gyldig ordrenummer"
 
+        # Låst per ordre under spørringene, så samme ordre ikke
+        # oppdateres av to tråder samtidig. Andre ordrer venter ikke.
+        order_lock = self._order_lock(order_num)
+        with order_lock:
+            with self._order_snapshot_lock:
+                snapshot = self._order_snapshots.get(order_num)
+            # Kontrollverdier hentes før varene: endringer mellom de to
+            # spørringene gir da nye varer neste gang
+            probe = self._probe_order_lines(order_num)
+            if is_full or snapshot is None or snapshot.probe != probe:
+                mamut_order_prods = self._make_ordered_prods(
+                    order_num,
+                    self._load_ordered_prods([order_num])[order_num])
+            else:
+                mamut_order_prods = snapshot.ordered_prods
+
+            with self._order_snapshot_lock:
+                self._order_snapshots.pop(order_num, None)
+                self._order_snapshots[order_num] = NamedList(
+                    probe=probe, ordered_prods=mamut_order_prods,
+                    lock=order_lock)
+                while len(self._order_snapshots) > ORDER_SNAPSHOT_COUNT:
+                    self._order_snapshots.popitem(last=False)
+        return copy.deepcopy(mamut_order_prods)
+
+    def get_ordered_prods_batch(self, order_nums, *,
+                                chunk_size: int = 500) -> dict:
+        """
+        Som get_ordered_prods for flere ordrer, med én spørring per
+        chunk_size ordrenumre. Skriver ikke ut varene, bruk
+        print_ordered_prods ved behov.
+        Returnerer dict med NamedList per ordrenummer.
+        Eksempel:
+            get_ordered_prods_batch([100001, 100002])
+            -> {100001: NamedList(...), 100002: NamedList(...)}
+        """
+        prod_rows_by_order = self._load_ordered_prods(
+            order_nums, chunk_size=chunk_size)
+        return {order_num: self._make_ordered_prods(order_num, prod_rows)
+                for order_num, prod_rows in prod_rows_by_order.items()}
+
+    @staticmethod
+    def _first_row_by_key(rows, key_attr, key_by_db_key) -> dict:
+        """
+        Første rad per nøkkel fra spørring med IN-liste, tilsvarende
+        lookup_db(...)[0] for hver nøkkel. Nøkkelkolonnen key_attr
+        fjernes fra radene.
+        """
+        row_by_key = {}
+        for row in rows:
+            if row is None:
+                continue
+            key = key_by_db_key.get(getattr(row, key_attr))
+            if key is not None and key not in row_by_key:
+                delattr(row, key_attr)
+                row_by_key[key] = row
+        return row_by_key
+
+    def _load_order_properties_batch(self, order_nums, *,
+                                     chunk_size: int = 500) -> dict:
+        """
+        Hent ordreegenskaper, inkl. hovedkontor- og kontaktperson-info,
+        med én SQL-setning per chunk_size ordrenumre.
+
+        Gir samme felter som _load_order_properties_multi. Returnerer
+        dict per ordrenummer, uten ordrer som ikke ble funnet.
+        """
+        order_nums = list(dict.fromkeys(order_nums))
+        order_num_by_key = {autoconvert(e): e for e in order_nums}
+        properties_by_order = {}
+
+        for chunk in padded_chunks(order_nums, chunk_size):
+            placeholders = ', '.join('?' * len(chunk))
+            # Én leveringsadresse (TOP 1) per ordre, flere adresser har
+            # uansett samme sonenummer (1-5) for fraktberegning
+            properties_by_order.update(self._first_row_by_key(
+                self.lookup_db(f"""
+                    SELECT
+                    g_order.orderid        AS order_key,
+                    {ORDER_PROPERTIES_COLUMNS},
+                    main_office.contid     AS main_office_contid,
+                    main_office.custid     AS main_office_cust_num,
+                    main_office.vend       AS has_vendor_main_office,
+                    main_office.cooporate  AS has_dealer_main_office,
+                    main_office.enterno    AS main_office_org_num,
+                    cpers.email            AS deres_ref_email
+                    FROM g_order
+                    JOIN g_clisys    ON g_order.data7 = g_clisys.nr
+                    JOIN g_contac    ON g_contac.custid = g_order.custid
+                    JOIN g_currency  ON g_order.currencyid =
+                                        g_currency.currencyid
+                    JOIN w_delitypes ON w_delitypes.uniqueid = g_order.data2
+                    CROSS APPLY (
+                        SELECT TOP 1 g_deli.zipcode FROM g_deli
+                        WHERE g_deli.sourceid = g_order.contid
+                        AND g_deli.adrtype = 1
+                        ) AS g_deli
+                    LEFT JOIN g_contac AS main_office
+                        ON main_office.contid = g_order.maincontid
+                    OUTER APPLY (
+                        SELECT TOP 1 g_cpers.email FROM g_cpers
+                        WHERE CONCAT(TRIM(g_cpers.firstname), ' ',
+                                     TRIM(g_cpers.lastname)) =
+                              TRIM(g_order.refyour)
+                        ) AS cpers
+                    WHERE g_clisys.id = 7
+                    AND g_order.orderid IN ({placeholders})
+                """, chunk, is_lazy=True),
+                'order_key', order_num_by_key))
+
+        for order_properties in properties_by_order.values():
+            if not order_properties.main_office_contact_num:
+                order_properties.has_vendor_main_office = False
+                order_properties.has_dealer_main_office = False
+                order_properties.main_office_org_num = None
+                order_properties.main_office_name = None
+                del order_properties.main_office_cust_num
+            elif order_properties.main_office_contid is None:
+                # Hovedkontor ikke funnet, som tomt spørreresultat
+                del order_properties.main_office_cust_num
+                del order_properties.has_vendor_main_office
+                del order_properties.has_dealer_main_office
+                del order_properties.main_office_org_num
+            del order_properties.main_office_contid
+
+            if not order_properties.deres_ref:
+                order_properties.deres_ref_email = None
+        return properties_by_order
+
+    def _load_order_properties(self, order_num):
+        """
+        Hent ordreegenskaper, inkl. hovedkontor- og kontaktperson-info,
+        med én SQL-setning.
+
+        Gir samme felter som _load_order_properties_multi.
+        """
+        return self._load_order_properties_batch([order_num]).get(order_num)
+
+    def _load_order_properties_multi(self, order_num, *,
+                                     use_cache=True,
+                                     is_concurrent=True):
+        """
+        Hent ordreegenskaper med tre spørringer: ordre, hovedkontor-
+        og kontaktperson-info. De to siste er uavhengige, og kjøres
+        samtidig dersom is_concurrent=True.
+        """
+
         # SQL-setningen kan gi flere treff, en for hvert postnummer hvis
         # kunden har registrert flere leveringsadresser. I praksis har
         # det ikke betydning for fraktberegning, da sonenummer (1-5)
@@ -673,30 +1459,7 @@ class MamutManager:
 
         order_properties = self.lookup_db(f"""
             SELECT
-            g_clisys.descr                 AS lev_betingelser,
-            g_contac.countrycodecustomer   AS country_id,   /* Norge = 1*/
-            g_contac.email                 AS cust_email,
-            g_contac.enterno               AS org_num,
-            g_currency.isocode             AS currency,
-            g_order.custid                 AS cust_num,
-            g_order.contname               AS cust_name,
-            g_order.curr_sum_n             AS brutto_sum,
-            g_order.data67                 AS avrunding_id,
-            g_order.datedeliv              AS lev_dato,
-            g_order.dateinvoice            AS fakturadato,
-            g_order.electronicdocumenttype AS is_ehf_invoice,
-            g_order.freightvolumesum       AS volume,
-            g_order.ifactoringstatus       AS is_factoring,
-            g_order.invoiceid              AS invoice_num,
-            g_order.lorderready            AS klar_til_fakturering,
-            g_order.maincontid             AS main_office_contact_num,
-            g_order.maincontname           AS main_office_name,
-            g_order.maincontres            AS is_main_office_invoiced,
-            g_order.refyour                AS deres_ref,
-            g_order.reference              AS referanse,
-            g_order.reportidinvoice        AS formular_id,
-            g_deli.zipcode                 AS zip_code,
-            w_delitypes.[freetext]         AS lev_form
+            {ORDER_PROPERTIES_COLUMNS}
             FROM g_order
             JOIN g_clisys    ON g_order.data7 = g_clisys.nr
             JOIN g_deli      ON g_deli.sourceid = g_order.contid
@@ -705,67 +1468,179 @@ class MamutManager:
             JOIN w_delitypes ON w_delitypes.uniqueid = g_order.data2
             WHERE g_clisys.id = 7
             AND g_deli.adrtype = 1
-            AND g_order.orderid = {order_num}
-        """)[0]
-
-        def _trim_postal_numbers(order_properties=order_properties):
-            """
-            Fjern eventuelle mellomrom i postnummer. Dette kan f.eks.
-            forekomme på svenske postnumre.
-            """
-            order_properties.zip_code = str(
-                order_properties.zip_code).replace(' ', '')
-            return order_properties
+            AND g_order.orderid = ?
+        """, [order_num], is_lazy=True)[0]
 
+        if order_properties is None:
+            return None
 
-        def _add_main_office_info(order_properties=order_properties):
+        def _get_main_office_info():
             """
-            Legg hovedkontor-info til ordreegenskaper
+            Hent hovedkontor-info for ordreegenskaper
             """
             if order_properties.main_office_contact_num:
-                order_properties = order_properties.update(self.lookup_db(
-                    f"""
+                return self.lookup_db(
+                    """
                     SELECT
                     g_contac.custid    AS main_office_cust_num,
                     g_contac.vend      AS has_vendor_main_office,
                     g_contac.cooporate AS has_dealer_main_office,
                     g_contac.enterno   AS main_office_org_num
                     FROM g_contac
-                    WHERE g_contac.contid =
-                        {order_properties.main_office_contact_num}
-                """)[0]
-                )
+                    WHERE g_contac.contid = ?
+                """, [order_properties.main_office_contact_num],
+                    cache_family='main_office',
+                    cache_tags=[('order', order_num)],
+                    use_cache=use_cache)[0]
             else:
-                order_properties = order_properties.update(
+                return dict(
                     has_vendor_main_office = False,
                     has_dealer_main_office = False,
                     main_office_org_num = None,
                     main_office_name = None,
                 )
 
-            return order_properties
-
-        def _add_contact_pers_info(order_properties=order_properties):
+        def _get_contact_pers_info():
             """
-            Legg kontaktperson-e-post til ordreegenskaper
+            Hent kontaktperson-e-post for ordreegenskaper
             """
-            order_properties.deres_ref_email = None
             if order_properties.deres_ref:
-                order_properties = order_properties.update(self.lookup_db(
-                    f"""
+                return self.lookup_db(
+                    """
                     SELECT email AS deres_ref_email
                     FROM g_cpers WHERE
+                    CONCAT(TRIM(FIRSTNAME), ' ', TRIM(LASTNAME)) = ?
+                    """, [str(order_properties.deres_ref)])[0]
+            return None
+
+        if is_concurrent:
+            main_office_future = self.db_executor.submit(
+                _get_main_office_info)
+            contact_pers_future = self.db_executor.submit(
+                _get_contact_pers_info)
+            main_office_info = main_office_future.result()
+            contact_pers_info = contact_pers_future.result()
+        else:
+            main_office_info = _get_main_office_info()
+            contact_pers_info = _get_contact_pers_info()
+
+        order_properties = order_properties.update(main_office_info)
+        order_properties.deres_ref_email = None
+        order_properties = order_properties.update(contact_pers_info)
+        return order_properties
+
+    def _load_order_properties_multi_batch(self, order_nums, *,
+                                           chunk_size: int = 500) -> dict:
+        """
+        Som _load_order_properties_multi for flere ordrer, med tre
+        spørringer per chunk_size ordrenumre: ordre, hovedkontor- og
+        kontaktperson-info. Hovedkontor-info caches ikke.
+        Returnerer dict per ordrenummer, uten ordrer som ikke ble
+        funnet.
+        """
+        order_nums = list(dict.fromkeys(order_nums))
+        order_num_by_key = {autoconvert(e): e for e in order_nums}
+        properties_by_order = {}
+
+        for chunk in padded_chunks(order_nums, chunk_size):
+            placeholders = ', '.join('?' * len(chunk))
+            properties_by_order.update(self._first_row_by_key(
+                self.lookup_db(f"""
+                    SELECT
+                    g_order.orderid AS order_key,
+                    {ORDER_PROPERTIES_COLUMNS}
+                    FROM g_order
+                    JOIN g_clisys    ON g_order.data7 = g_clisys.nr
+                    JOIN g_deli      ON g_deli.sourceid = g_order.contid
+                    JOIN g_contac    ON g_contac.custid = g_order.custid
+                    JOIN g_currency  ON g_order.currencyid =
+                                        g_currency.currencyid
+                    JOIN w_delitypes ON w_delitypes.uniqueid = g_order.data2
+                    WHERE g_clisys.id = 7
+                    AND g_deli.adrtype = 1
+                    AND g_order.orderid IN ({placeholders})
+                """, chunk, is_lazy=True),
+                'order_key', order_num_by_key))
+
+        # Hovedkontor-info per contid
+        main_office_nums = list(dict.fromkeys(
+            e.main_office_contact_num for e in properties_by_order.values()
+            if e.main_office_contact_num))
+        main_office_by_num = {}
+        for chunk in padded_chunks(main_office_nums, chunk_size):
+            placeholders = ', '.join('?' * len(chunk))
+            main_office_by_num.update(self._first_row_by_key(
+                self.lookup_db(f"""
+                    SELECT
+                    g_contac.contid    AS main_office_key,
+                    g_contac.custid    AS main_office_cust_num,
+                    g_contac.vend      AS has_vendor_main_office,
+                    g_contac.cooporate AS has_dealer_main_office,
+                    g_contac.enterno   AS main_office_org_num
+                    FROM g_contac
+                    WHERE g_contac.contid IN ({placeholders})
+                """, chunk),
+                'main_office_key', {e: e for e in main_office_nums}))
+
+        # Kontaktperson-e-post per Deres ref. Navnene sendes som avledet
+        # tabell, slik at databasen sammenligner som i enkeltspørringen
+        # (f.eks. uten skille mellom store og små bokstaver)
+        deres_refs = list(dict.fromkeys(
+            str(e.deres_ref) for e in properties_by_order.values()
+            if e.deres_ref))
+        contact_pers_by_ref = {}
+        for chunk in padded_chunks(deres_refs, chunk_size):
+            deres_refs_sql = ' UNION ALL '.join(
+                ['SELECT ? AS deres_ref'] + ['SELECT ?'] * (len(chunk) - 1))
+            contact_pers_by_ref.update(self._first_row_by_key(
+                self.lookup_db(f"""
+                    SELECT refs.deres_ref AS deres_ref_key,
+                    g_cpers.email AS deres_ref_email
+                    FROM ({deres_refs_sql}) AS refs
+                    JOIN g_cpers ON
                     CONCAT(TRIM(FIRSTNAME), ' ', TRIM(LASTNAME)) =
-                    '{order_properties.deres_ref}'
-                    """)[0]
+                    refs.deres_ref
+                """, chunk),
+                'deres_ref_key', {autoconvert(e): e for e in deres_refs}))
+
+        for order_num, order_properties in properties_by_order.items():
+            if order_properties.main_office_contact_num:
+                main_office_info = main_office_by_num.get(
+                    order_properties.main_office_contact_num)
+            else:
+                main_office_info = dict(
+                    has_vendor_main_office = False,
+                    has_dealer_main_office = False,
+                    main_office_org_num = None,
+                    main_office_name = None,
                 )
-            return order_properties
+            order_properties = order_properties.update(main_office_info)
+            order_properties.deres_ref_email = None
+            if order_properties.deres_ref:
+                order_properties = order_properties.update(
+                    contact_pers_by_ref.get(str(order_properties.deres_ref)))
+            properties_by_order[order_num] = order_properties
+        return properties_by_order
 
+    def get_order_properties(self, order_num=None, *,
+                             use_cache=True,
+                             is_single_statement=True):
+        """
+        Hent egenskaper for Mamut-ordre.
 
-        order_properties = _trim_postal_numbers(order_properties)
-        order_properties = _add_main_office_info(order_properties)
-        order_properties = _add_contact_pers_info(order_properties)
+        Som standard hentes alt med én SQL-setning. Med
+        is_single_statement=False, eller dersom databasen ikke støtter
+        APPLY (SQLite), brukes separate spørringer for hovedkontor- og
+        kontaktperson-info, som da kjøres samtidig.
+        use_cache=False gir ferske data også for hovedkontor-info.
+        """
+        assert order_num, "Ikke gyldig ordrenummer"
 
+        if is_single_statement and self.db_backend.is_apply_supported:
+            order_properties = self._load_order_properties(order_num)
+        else:
+            order_properties = self._load_order_properties_multi(
+                order_num, use_cache=use_cache)
 
         assert order_properties is not None, (
             "order_properties=None.\n"
@@ -773,6 +1648,49 @@ class MamutManager:
             "Endre denne hvis dette var tilfelle."
         )
 
+        # TODO: Omgå at order_properties = None hvis Leveringsform = (Ingen)
+
+        return self._finish_order_properties(order_properties)
+
+    def get_order_properties_batch(self, order_nums, *,
+                                   is_single_statement=True,
+                                   chunk_size: int = 500) -> dict:
+        """
+        Som get_order_properties for flere ordrer, med én spørring per
+        tabellgruppe og chunk_size ordrenumre i stedet for spørringer
+        per ordre. Hovedkontor-info hentes alltid fra databasen.
+        Returnerer dict per ordrenummer. Ordrer som get_order_properties
+        ikke finner (f.eks. Leveringsform=(Ingen)) gir None.
+        Eksempel:
+            get_order_properties_batch([100001, 100002])
+            -> {100001: Record(...), 100002: None}
+        """
+        assert all(order_nums), "Ikke gyldig ordrenummer"
+
+        if is_single_statement and self.db_backend.is_apply_supported:
+            properties_by_order = self._load_order_properties_batch(
+                order_nums, chunk_size=chunk_size)
+        else:
+            properties_by_order = self._load_order_properties_multi_batch(
+                order_nums, chunk_size=chunk_size)
+
+        order_properties_batch = {}
+        for order_num in dict.fromkeys(order_nums):
+            order_properties = properties_by_order.get(order_num)
+            if order_properties is not None:
+                order_properties = self._finish_order_properties(
+                    order_properties)
+            order_properties_batch[order_num] = order_properties
+        return order_properties_batch
+
+    @staticmethod
+    def _finish_order_properties(order_properties):
+        """Avledede felter og opprydding for get_order_properties."""
+        # Fjern eventuelle mellomrom i postnummer. Dette kan f.eks.
+        # forekomme på svenske postnumre.
+        order_properties.zip_code = str(
+            order_properties.zip_code).replace(' ', '')
+
         # For benevning i cm3, absoluttverdi fordi volum kan bli
         # negativt hvis antall produkter er negativt (aktuelt for
         # retur av apparater
@@ -799,37 +1717,139 @@ class MamutManager:
 
         del order_properties.formular_id
 
-        # TODO: Omgå at order_properties = None hvis Leveringsform = (Ingen)
-
         return order_properties
 
 
-    def get_prod_num_by_sn(self, serial_num):
+    def get_prod_num_by_sn(self, serial_num, *, use_cache=True):
         """
         Finn Mamut produktnummer ut fra serienummer.
+        use_cache=False gir ferske data fra databasen.
         """
 
-        prod_num = self.lookup_db(f"""
+        # MAX i stedet for TOP 1 ... ORDER BY DESC, gir samme resultat
+        # og virker også i SQLite
+        prod_num = self.lookup_db("""
             SELECT g_prod.prodid FROM g_prod
             WHERE g_prod.pk_prodid = (
-                SELECT TOP 1 g_storeitem.fk_product FROM g_storeitem
-                WHERE g_storeitem.serialnr = '{serial_num}'
-                ORDER BY g_storeitem.fk_product DESC
+                SELECT MAX(g_storeitem.fk_product) FROM g_storeitem
+                WHERE g_storeitem.serialnr = ?
                 )
-            """)[0].prodid
+            """, [str(serial_num)], cache_family='prod_by_sn',
+            use_cache=use_cache)[0].prodid
         return prod_num
 
+    def get_prod_nums_by_sns(self, serial_nums, *,
+                             storage_name=None,
+                             chunk_size: int = 1000,
+                             ) -> dict:
+        """
+        Finn Mamut produktnummer for mange serienumre samtidig.
 
+        Som get_prod_num_by_sn, men med én spørring per chunk_size
+        serienumre (SQL Server tillater maks 2100 parametere).
+        Dersom storage_name er gitt, sjekkes det samtidig om
+        serienummeret er ledig på lageret, som i
+        get_serial_number_mask.
 
-    def _save_order(self):
-        # Lagre Mamut-ordre
+        Returnerer dict med NamedList per serienummer (str):
+            prod_num: Produktnummer, None hvis ukjent serienummer
+            is_known: True hvis serienummeret finnes i Mamut
+            is_in_stock: True hvis ledig på lager, None uten
+                storage_name
+
+        Eksempel:
+            get_prod_nums_by_sns(['0611234567', 'X999'])
+            -> {'0611234567': NamedList(is_in_stock=None,
+                                        is_known=True, prod_num=SPE200),
+                'X999': NamedList(is_in_stock=None, is_known=False,
+                                  prod_num=None)}
+        """
+        assert 1 <= chunk_size <= 2000, \
+            f"chunk_size må være mellom 1 og 2000, mottok {chunk_size}"
+
+        serial_nums = list(dict.fromkeys(str(e) for e in serial_nums))
+        prod_by_sn = {
+            serial_num: NamedList(
+                prod_num=None,
+                is_known=False,
+                is_in_stock=False if storage_name is not None else None)
+            for serial_num in serial_nums}
+
+        # Serienumre fra databasen typecastes (f.eks. '123' -> 123),
+        # og må sammenlignes i samme form
+        serial_num_by_key = {autoconvert(e): e for e in serial_nums}
+
+        for chunk in padded_chunks(serial_nums, chunk_size):
+            placeholders = ', '.join('?' * len(chunk))
+
+            sn_qry = self.lookup_db(f"""
+                SELECT sn.serial_num,
+                g_prod.prodid AS prod_num,
+                sn.in_stock_count
+                FROM (
+                    SELECT g_storeitem.serialnr AS serial_num,
+                    MAX(g_storeitem.fk_product) AS fk_product,
+                    SUM(CASE WHEN g_storeitem.outtype IS NULL
+                             AND g_store.description = ?
+                             THEN 1 ELSE 0 END) AS in_stock_count
+                    FROM g_storeitem
+                    LEFT JOIN g_store
+                        ON g_store.pk_storeid = g_storeitem.fk_store
+                    WHERE g_storeitem.serialnr IN ({placeholders})
+                    GROUP BY g_storeitem.serialnr
+                    ) AS sn
+                LEFT JOIN g_prod ON g_prod.pk_prodid = sn.fk_product
+            """, [storage_name] + chunk)
+
+            for elem in sn_qry:
+                if elem is None:
+                    continue
+                serial_num = serial_num_by_key.get(elem.serial_num)
+                if serial_num is None or elem.prod_num is None:
+                    continue
+                prod_by_sn[serial_num].prod_num = elem.prod_num
+                prod_by_sn[serial_num].is_known = True
+                if storage_name is not None:
+                    prod_by_sn[serial_num].is_in_stock = bool(
+                        elem.in_stock_count)
+        return prod_by_sn
+
+
+
+    def _save_order(self) -> bool:
+        """
+        Lagre Mamut-ordre med ctrl+s. Mamut lagrer i GUI-tråden, og
+        svarer ikke på meldinger under lagring. Lagring regnes som
+        bekreftet når Mamut-vinduet først har sluttet å svare, og
+        deretter svarer igjen.
+        Returnerer om lagring ble bekreftet.
+        """
         print("Lagrer ordre... ", end="")
+        # Uten kjent vindu brukes Mamut-vinduet sist i fokus
+        mamut_wnd_handle = self.mamut_wnd_handle
+        if not mamut_wnd_handle:
+            mamut_wnd = self.wingui.match_wnds({'mamut': MAMUT_RE})['mamut']
+            assert mamut_wnd is not None, "Fant ikke Mamut-vindu"
+            mamut_wnd_handle = mamut_wnd[0]
         self.wingui.schedule_input_events(
             (0.5, 'ctrl+s'),
-            (1.0, None),
         )
-        print("OK")                     # Ferdig lagret ordre
-        return None
+        # Kort timeout per sjekk, slik at også korte lagringer fanges
+        is_busy = wait_until(
+            lambda: not self.wingui.is_wnd_responsive(mamut_wnd_handle,
+                                                      timeout=0.05),
+            2., backoff=SAVE_BUSY_BACKOFF,
+            name='MamutManager._save_order.busy')
+        is_saved = bool(is_busy) and wait_until(
+            lambda: self.wingui.is_wnd_responsive(mamut_wnd_handle),
+            30., name='MamutManager._save_order')
+        # Lagret ordre kan ha endret ordredata og lagerstatus
+        self.invalidate_cache(order_num=self.curr_order_num, family='stock')
+        if is_saved:
+            print("OK")                 # Ferdig lagret ordre
+        else:
+            print("ikke bekreftet, kontroller at ordren er lagret.")
+        return is_saved
 
     def set_order_properties(self, *,
                              deres_ref=None,
@@ -1116,22 +2136,23 @@ class MamutManager:
         else:
             print("Fyller inn tekstlinje... ", end="")
         self.gui_app.type_keys('{VK_ADD}')       # '+': ny ordrelinje
-        time.sleep(0.35)                    # For sikkerhets skyld
+        # Med produktnummer venter await_text til nytt felt har fokus.
+        # Ellers trykkes tab først, og pause er nødvendig
+        if not prod_num:
+            time.sleep(0.35)                # For sikkerhets skyld
 
         # NB! Ikke bruk pywinauto for ordrelinjer - bug gjør at Mamut i
         # kombinasjon med pywinauto gjør at radhøyden for ordrelinjen
         # spontant endres og blir enten veldig lav eller veldig høy.
 
         if prod_num:
-            self.wingui.await_text(filltext=prod_num)
-            # Gi opp dersom await_text() ikke oppdaterte utklippstavle
-            if not pyperclip.paste():
+            # Gi opp dersom await_text() ikke kunne lese feltet
+            if not self.wingui.await_text(filltext=prod_num):
                 return None
             # time.sleep(0.2)         # Kanskje nødvendig for å omgå bug
             keyboard.press_and_release('tab')
-            self.wingui.await_text()
-            # Gi opp dersom await_text() ikke oppdaterte utklippstavle
-            if not pyperclip.paste():
+            # Gi opp dersom await_text() ikke kunne lese feltet
+            if not self.wingui.await_text():
                 return None
 
 
@@ -1142,17 +2163,15 @@ class MamutManager:
             keyboard.press_and_release('tab')
 
         if name is not None:
-            self.wingui.await_text(filltext=name)
-            # Gi opp dersom await_text() ikke oppdaterte utklippstavle
-            if not pyperclip.paste():
+            # Gi opp dersom await_text() ikke kunne lese feltet
+            if not self.wingui.await_text(filltext=name):
                 return None
 
             # time.sleep(0.2)         # Kanskje nødvendig for å omgå bug
 
         elif name is None and prod_num is None:
-            self.wingui.await_text(filltext='.')
-            # Gi opp dersom await_text() ikke oppdaterte utklippstavle
-            if not pyperclip.paste():
+            # Gi opp dersom await_text() ikke kunne lese feltet
+            if not self.wingui.await_text(filltext='.'):
                 return None
         if not prod_num:
             # Nødvendig for å omgå bug og sikre oppdatering av felt
@@ -1162,54 +2181,46 @@ class MamutManager:
 
         if tracking:
             keyboard.press_and_release('shift+tab')
-            self.wingui.await_text()
-            # Gi opp dersom await_text() ikke oppdaterte utklippstavle
-            if not pyperclip.paste():
+            # Gi opp dersom await_text() ikke kunne lese feltet
+            if not self.wingui.await_text():
                 return None
             keyboard.press_and_release('shift+tab')
-            # Gi opp dersom await_text() ikke oppdaterte utklippstavle
-            self.wingui.await_text(filltext=tracking)
-            if not pyperclip.paste():
+            # Gi opp dersom await_text() ikke kunne lese feltet
+            if not self.wingui.await_text(filltext=tracking):
                 return None
             for __ in range(2):
                 keyboard.press_and_release('tab')
-                self.wingui.await_text()
-                # Gi opp dersom await_text() ikke oppdaterte utklippstavle
-                if not pyperclip.paste():
+                # Gi opp dersom await_text() ikke kunne lese feltet
+                if not self.wingui.await_text():
                     return None
 
         if any([quantity not in [None, 1], price is not None,
                 discount is not None]):
             keyboard.press_and_release('tab')
-            self.wingui.await_text()
-            # Gi opp dersom await_text() ikke oppdaterte utklippstavle
-            if not pyperclip.paste():
+            # Gi opp dersom await_text() ikke kunne lese feltet
+            if not self.wingui.await_text():
                 return None
             if quantity not in [None, 1]:
                 quantity = str(quantity).replace('.', ',')
-                self.wingui.await_text(filltext=quantity)
-                # Gi opp dersom await_text() ikke oppdaterte utklippstavle
-                if not pyperclip.paste():
+                # Gi opp dersom await_text() ikke kunne lese feltet
+                if not self.wingui.await_text(filltext=quantity):
                     return None
             if any([price is not None, discount is not None]):
                 for __ in range(2):
                     keyboard.press_and_release('tab')
-                    self.wingui.await_text()
-                    # Gi opp dersom await_text() ikke oppdaterte utklippstavle
-                    if not pyperclip.paste():
+                    # Gi opp dersom await_text() ikke kunne lese feltet
+                    if not self.wingui.await_text():
                         return None
                 if price is not None:
                     price = str(price).replace('.', ',')
-                    self.wingui.await_text(filltext=price)
-                    # Gi opp dersom await_text() ikke oppdaterte utklippstavle
-                    if not pyperclip.paste():
+                    # Gi opp dersom await_text() ikke kunne lese feltet
+                    if not self.wingui.await_text(filltext=price):
                         return None
                 if discount is not None:
                     discount = str(discount).replace('.', ',')
                     keyboard.press_and_release('tab')
-                    self.wingui.await_text(filltext=discount)
-                    # Gi opp dersom await_text() ikke oppdaterte utklippstavle
-                    if not pyperclip.paste():
+                    # Gi opp dersom await_text() ikke kunne lese feltet
+                    if not self.wingui.await_text(filltext=discount):
                         return None
             # Iblant nødvendig for å sikre oppdatering av linje
             keyboard.press_and_release('tab')
@@ -1234,10 +2245,12 @@ class MamutManager:
         self,
         *, prod_num,
         storage_name='A1: Salgsvarer for salg, internt (Diagnostica)',
+        use_cache=True,
     ):
         """
         Lager maske ut fra tilgjengelige serienumre på Mamut-salgslager,
         Obligatorisk innparameter: prod_num (Mamut-produktnummer)
+        use_cache=False gir ferske lagerdata fra databasen.
         Eksempel: get_serial_number_mask('SPE200') -> '061xxxxxxx'
         (Alle serienumrene på lager har her sifrene 061 til felles.)
         """
@@ -1246,22 +2259,83 @@ class MamutManager:
             f"Ugyldig produktnr: {prod_num}. Tillatte produktnumre: " + \
             ', '.join(SN_PROD_NUMS)
 
-        serial_number_objects = self.lookup_db(f"""
+        serial_number_objects = self.lookup_db("""
             SELECT g_storeitem.serialnr
             FROM g_storeitem
             JOIN g_store ON g_store.pk_storeid=g_storeitem.fk_store
             JOIN g_prod ON g_prod.pk_prodid = fk_product
             WHERE g_storeitem.outtype IS NULL AND
-            g_store.description='{storage_name}'
-            AND g_prod.prodid='{prod_num}'
-        """)
+            g_store.description = ?
+            AND g_prod.prodid = ?
+        """, [storage_name, prod_num], cache_family='stock',
+             cache_tags=[('stock', prod_num)], use_cache=use_cache)
 
         if serial_number_objects == [None]:
-            serial_number_mask = 'xxx'
-        else:
-            serial_numbers = [str(e.serialnr) for e in serial_number_objects]
-            zipped_serial_numbers = list(zip(*serial_numbers))
-            serial_number_mask_list = [set(e).pop() if len(list(set(e))) == 1
-                                       else 'x' for e in zipped_serial_numbers]
-            serial_number_mask = ''.join(serial_number_mask_list)
-        return serial_number_mask
+            return 'xxx'
+        return make_serial_number_mask(
+            str(e.serialnr) for e in serial_number_objects)
+
+    def get_serial_number_masks(
+        self,
+        prod_nums=None,
+        *, storage_name='A1: Salgsvarer for salg, internt (Diagnostica)',
+        batch_size=5000,
+    ) -> dict:
+        """
+        Lager masker som get_serial_number_mask for flere produkter
+        med én spørring. Serienumrene strømmes sortert per produkt, og
+        hver maske bygges fortløpende uten å lagre serienumrene.
+        Mulig innparameter: prod_nums, standard er alle SN_PROD_NUMS.
+        Eksempel: get_serial_number_masks(['SPE200'])
+            -> {'SPE200': '061xxxxxxx'}
+        Resultatet caches ikke, det gir alltid ferske lagerdata.
+        """
+
+        prod_nums = list(SN_PROD_NUMS if prod_nums is None else prod_nums)
+        invalid_prod_nums = set(prod_nums).difference(SN_PROD_NUMS)
+        assert not invalid_prod_nums, \
+            f"Ugyldig produktnr: {', '.join(sorted(invalid_prod_nums))}. " \
+            "Tillatte produktnumre: " + ', '.join(SN_PROD_NUMS)
+
+        serial_number_masks = dict.fromkeys(prod_nums, 'xxx')
+        if not prod_nums:
+            return serial_number_masks
+
+        # Produktnummer per pk_prodid. Serienumrene hentes med
+        # fk_product (heltall), som er billigere å typecaste enn tekst.
+        placeholders = ', '.join('?' * len(prod_nums))
+        prods = self.lookup_reference(f"""
+            SELECT g_prod.pk_prodid, g_prod.prodid AS prod_num
+            FROM g_prod
+            WHERE g_prod.prodid IN ({placeholders})
+        """, prod_nums, tables=['g_prod'], use_cache=False)
+        if prods == [None]:
+            return serial_number_masks
+        # str(), i tilfelle produktnummeret er konvertert til tall
+        prod_num_by_pk = {e.pk_prodid: str(e.prod_num) for e in prods}
+        pk_placeholders = ', '.join('?' * len(prod_num_by_pk))
+
+        storeitems = self.iter_db(f"""
+            SELECT g_storeitem.fk_product,
+            g_storeitem.serialnr
+            FROM g_storeitem
+            JOIN g_store ON g_store.pk_storeid=g_storeitem.fk_store
+            WHERE g_storeitem.outtype IS NULL AND
+            g_store.description = ?
+            AND g_storeitem.fk_product IN ({pk_placeholders})
+            ORDER BY g_storeitem.fk_product
+        """, [storage_name, *prod_num_by_pk], batch_size=batch_size)
+
+        found_prod_nums = set()
+        for pk_prodid, prod_storeitems in itertools.groupby(
+                storeitems, key=operator.attrgetter('fk_product')):
+            prod_num = prod_num_by_pk[pk_prodid]
+            serial_number_mask = make_serial_number_mask(
+                str(e.serialnr) for e in prod_storeitems)
+            # Samme produktnummer på flere produkter: slå sammen maskene
+            if prod_num in found_prod_nums:
+                serial_number_mask = make_serial_number_mask(
+                    [serial_number_masks[prod_num], serial_number_mask])
+            serial_number_masks[prod_num] = serial_number_mask
+            found_prod_nums.add(prod_num)
+        return serial_number_masks
@@ -0,0 +1,334 @@
+# -*- encoding: utf-8 -*-#
+# !/usr/bin/python
+
+# Standardbibliotek import
+import time
+
+# Tredjeparts bibliotek import
+import keyboard
+import pyperclip
+
+# Lokal applikasjon import
+from okn_wait import WAIT_STATS, AdaptiveBackoff, Backoff, WaitStats, \
+    wait_until
+
+
+__author__ = 'Øyvind Nystad'
+
+"""
+Lesing og skriving av fokusert felt i brukergrensesnittet:
+- FieldIO               Via UI Automation (ValuePattern) når feltet
+                        støtter det, ellers via utklippstavle
+- focused_value_pattern Runtime-id og ValuePattern for fokusert element
+- FIELD_IO_STATS        Ventetid per operasjon og vei (uia/clipboard)
+
+Utklippstavle og felt for testing er i tests/fakes.py.
+"""
+
+
+# Pause mellom forsøk på lesing av felt, og mellom sjekk av
+# utklippstavle etter hvert forsøk. Adaptiv, slik at felt som
+# typisk bruker en viss tid på å få fokus ikke får unødvendig mange
+# tastetrykk
+FIELD_BACKOFF = AdaptiveBackoff(0.02, max_interval=0.3)
+CLIPBOARD_BACKOFF = Backoff(0.01, max_interval=0.1)
+
+# Ventetid per operasjon og vei, f.eks. 'read.uia' og 'write.clipboard'
+FIELD_IO_STATS = WaitStats()
+
+
+def _import_uia():
+    """pywinauto.uia_defines hvis UI Automation er tilgjengelig,
+    ellers None."""
+    try:
+        from pywinauto import uia_defines
+    except ImportError:
+        return None
+    return uia_defines
+
+
+def focused_value_pattern() -> tuple:
+    """(runtime-id, ValuePattern) for elementet med tastaturfokus.
+
+    ValuePattern er None dersom elementet ikke støtter det, og begge
+    er None dersom UI Automation mangler eller elementet ikke kan
+    leses.
+    """
+    uia_defines = _import_uia()
+    if uia_defines is None:
+        return None, None
+    try:
+        element = uia_defines.IUIA().iuia.GetFocusedElement()
+        element_id = tuple(element.GetRuntimeId())
+    except Exception:           # COMError
+        return None, None
+    try:
+        return element_id, uia_defines.get_elem_interface(element, 'Value')
+    except Exception:           # NoPatternInterfaceError, COMError
+        return element_id, None
+
+
+class FieldIO:
+    """Les og skriv fokusert felt, med ventetid på fokus.
+
+    Hvert forsøk bruker UI Automation (ValuePattern) dersom fokusert
+    felt støtter det, og ellers utklippstavle: ctrl+a+c, og venting
+    på at innholdet dukker opp. Skrevet verdi kontrolleres, og
+    skrives med tastetrykk dersom feltet ikke tok imot verdien.
+    Vei og ventetid registreres i stats under 'read.uia',
+    'read.clipboard', 'write.uia', 'write.clipboard' og
+    'read_back.clipboard'.
+
+    Tastetrykk (f.eks. tab foran lesing) behandles i kø, mens UI
+    Automation leser fokusert element straks. UI Automation brukes
+    derfor bare når fokus er bekreftet flyttet, dvs. fokusert element
+    er et annet enn ved forrige lesing eller skriving. Ellers brukes
+    utklippstavle, der ctrl+a+c havner i køen etter tab.
+
+    :param clipboard: Utklippstavle med paste() og copy(text)
+    :param keys: Tastatur med press_and_release(keys) og write(text)
+    :param value_pattern: Funksjon som gir (runtime-id, ValuePattern)
+        for fokusert element, evt. None for ukjent verdi
+    :param is_uia: Angi om UI Automation skal forsøkes
+    :param paste_timeout: Maks ventetid på utklippstavle etter ctrl+c,
+        før nytt forsøk. For lav verdi gir ustabil oppdatering i Mamut
+    :param stats: WaitStats for vei og ventetid
+    :param wait_stats: WaitStats for hver venting i wait_until
+    :param clock: Tidsfunksjon, kan byttes ut ved testing
+    :param sleep: Pausefunksjon, kan byttes ut ved testing
+
+    Attributter:
+        last_read_back: Feltets innhold lest etter siste write, None
+            dersom det ikke kunne leses
+
+    Eksempel:
+        field_io = FieldIO()
+        field_io.write('SPS340')
+        keyboard.press_and_release('tab')
+        name = field_io.read()
+    """
+
+    def __init__(self, *,
+                 clipboard=pyperclip,
+                 keys=keyboard,
+                 value_pattern=focused_value_pattern,
+                 is_uia: bool = True,
+                 paste_timeout: float = 0.3,
+                 stats: WaitStats | None = FIELD_IO_STATS,
+                 wait_stats: WaitStats | None = WAIT_STATS,
+                 clock=time.monotonic,
+                 sleep=time.sleep,
+                 ) -> None:
+        self.clipboard = clipboard
+        self.keys = keys
+        self.value_pattern = value_pattern
+        self.is_uia = is_uia
+        self.paste_timeout = paste_timeout
+        self.stats = stats
+        self.wait_stats = wait_stats
+        self.clock = clock
+        self.sleep = sleep
+        self.last_read_back: str | None = None
+        # Runtime-id for elementet sist lest eller skrevet, None dersom
+        # ukjent, f.eks. etter timeout med tastetrykk i kø
+        self._last_element_id = None
+
+    def _wait(self, predicate, timeout: float, name: str, **kwargs):
+        """wait_until med klokke, pause og stats fra FieldIO."""
+        return wait_until(predicate, timeout, name=name,
+                          stats=self.wait_stats, clock=self.clock,
+                          sleep=self.sleep, **kwargs)
+
+    def _get_value_pattern(self) -> tuple:
+        """(runtime-id, ValuePattern) for fokusert felt.
+
+        ValuePattern er None ved utklippstavle, og når fokus ikke er
+        bekreftet flyttet fra elementet sist lest eller skrevet, evt.
+        når dette er ukjent.
+        """
+        if not self.is_uia:
+            return None, None
+        element_id, pattern = self.value_pattern()
+        if element_id is None or \
+                self._last_element_id in (None, element_id):
+            return element_id, None
+        return element_id, pattern
+
+    def _remember_element(self, element_id=None) -> None:
+        """Husk elementet som ble lest eller skrevet.
+
+        Uten element_id (utklippstavle) er tastetrykkene behandlet, og
+        fokusert element er dermed feltet som ble lest eller skrevet.
+        """
+        if element_id is None and self.is_uia:
+            element_id = self.value_pattern()[0]
+        self._last_element_id = element_id
+        return None
+
+    def _copy_confirmed(self, text: str) -> None:
+        """Kopier text til utklippstavle, og vent til den er oppdatert.
+
+        Oppdatering kan bruke noe tid, og være ufullført når neste
+        Python-kommando utføres.
+        """
+        text = str(text)
+        self.clipboard.copy(text)
+        assert self._wait(lambda: self.clipboard.paste() == text, 5.,
+                          'WinGUIManager.await_text.copy'), \
+            ("Utklippstavle ikke oppdatert, "
+             "evt. restart Mamut som kan ha stått på for lenge "
+             "og da begynt å bli lite responsivt.",
+             f"{self.clipboard.paste()} {text}")
+        return None
+
+    def _copy_field_text(self, keys: str) -> str:
+        """Trykk keys (med ctrl+a+c), vent på utklippstavle."""
+        self.keys.press_and_release(keys)
+        return self._wait(self.clipboard.paste, self.paste_timeout,
+                          'WinGUIManager.await_text.paste',
+                          backoff=CLIPBOARD_BACKOFF)
+
+    def _record(self, operation: str, path: str, t_start: float,
+                attempts: int, is_timeout: bool) -> None:
+        """Registrer vei og ventetid i stats."""
+        if self.stats is not None:
+            self.stats.record(f'{operation}.{path}', self.clock() - t_start,
+                              attempts=attempts, is_timeout=is_timeout)
+        return None
+
+    def read(self, timeout: float = 20.) -> str | None:
+        """Vent til fokusert felt har innhold, returner innholdet.
+
+        Felt uten innhold kan ikke skilles fra felt som ennå ikke har
+        fokus, og gir dermed timeout.
+
+        :return: Innhold uten mellomrom i endene, None ved timeout
+        """
+        t_start = self.clock()
+        attempts = 0
+        path = 'clipboard'
+        is_clipboard_cleared = False
+
+        def _read_once() -> str:
+            nonlocal attempts, path, is_clipboard_cleared
+            attempts += 1
+            element_id, pattern = self._get_value_pattern()
+            if pattern is not None:
+                try:
+                    path = 'uia'
+                    text = pattern.CurrentValue or ''
+                    if text:
+                        self._remember_element(element_id)
+                    return text
+                except Exception:       # COMError, felt forsvant
+                    pass
+            path = 'clipboard'
+            if not is_clipboard_cleared:
+                self._copy_confirmed('')
+                is_clipboard_cleared = True
+            text = self._copy_field_text('ctrl+a+c')
+            if text:
+                self._remember_element()
+            return text
+
+        text = self._wait(_read_once, timeout,
+                          'WinGUIManager.await_text.focus',
+                          backoff=FIELD_BACKOFF)
+        self._record('read', path, t_start, attempts, not text)
+        if not text:
+            self._last_element_id = None
+        return text.strip() if text else None
+
+    def write(self, text: str, timeout: float = 20.) -> str | None:
+        """Vent til fokusert felt kan skrives i, og skriv text.
+
+        Via UI Automation settes verdien direkte, og kontrolleres.
+        Via utklippstavle gjør '0' feltet ikke-tomt, slik at kopiering
+        viser når feltet har fokus. Tastetrykk behandles i rekkefølge,
+        og innholdet markeres og overskrives av text.
+
+        Skrevet tekst leses tilbake innen gjenværende timeout, og
+        legges i self.last_read_back, None dersom innholdet ikke kunne
+        leses (registreres som timeout i stats).
+
+        :return: text, None ved timeout på fokus
+        """
+        text = str(text)
+        t_start = self.clock()
+        deadline = t_start + timeout
+        attempts = 0
+        path = 'clipboard'
+        is_clipboard_cleared = False
+        self.last_read_back = None
+
+        def _write_once() -> bool:
+            nonlocal attempts, path, is_clipboard_cleared
+            attempts += 1
+            element_id, pattern = self._get_value_pattern()
+            if pattern is not None:
+                try:
+                    if not pattern.CurrentIsReadOnly:
+                        pattern.SetValue(text)
+                        value = pattern.CurrentValue or ''
+                        if value.strip() == text.strip():
+                            path = 'uia'
+                            self.last_read_back = value.strip()
+                            self._remember_element(element_id)
+                            return True
+                        # Feltet tok ikke imot verdien, skriv med taster
+                        self.keys.press_and_release('ctrl+a')
+                        self.keys.write(text)
+                        path = 'clipboard'
+                        self._read_back(deadline)
+                        return True
+                except Exception:       # COMError, felt forsvant
+                    pass
+            path = 'clipboard'
+            if not is_clipboard_cleared:
+                self._copy_confirmed('')
+                is_clipboard_cleared = True
+            if not self._copy_field_text('0, ctrl+a+c'):
+                return False
+            self.keys.write(text)
+            self._read_back(deadline)
+            return True
+
+        is_written = self._wait(_write_once, timeout,
+                                'WinGUIManager.await_text.focus',
+                                backoff=FIELD_BACKOFF)
+        self._record('write', path, t_start, attempts, not is_written)
+        if not is_written:
+            self._last_element_id = None
+        return text if is_written else None
+
+    def _read_back(self, deadline: float) -> None:
+        """Les feltet via utklippstavle etter skriving med taster, til
+        self.last_read_back.
+
+        Vent til Mamut har tatt imot teksten, i stedet for fast
+        pause: ny kopiering lykkes først etter at teksten er skrevet.
+        Nye forsøk inntil deadline, evt. ett forsøk. Registreres som
+        timeout i stats dersom feltet ikke kunne leses.
+        """
+        t_start = self.clock()
+        attempts = 0
+
+        def _copy_once() -> str:
+            nonlocal attempts
+            attempts += 1
+            return self._copy_field_text('ctrl+a+c')
+
+        self._copy_confirmed('')
+        written = self._wait(_copy_once,
+                             max(0., deadline - self.clock()),
+                             'WinGUIManager.await_text.read_back',
+                             backoff=FIELD_BACKOFF)
+        self._record('read_back', 'clipboard', t_start, attempts,
+                     not written)
+        if written:
+            self.last_read_back = written.strip()
+            self._remember_element()
+        else:
+            self._last_element_id = None
+        return None
+
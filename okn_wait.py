@@ -0,0 +1,227 @@
+# -*- encoding: utf-8 -*-#
+# !/usr/bin/python
+
+# Standardbibliotek import
+import collections
+import statistics
+import threading
+import time
+
+
+__author__ = 'Øyvind Nystad'
+
+"""
+Venting på hendelser i brukergrensesnittet, i stedet for faste pauser:
+- Backoff               Eksponentielt økende pause mellom forsøk
+- AdaptiveBackoff       Som Backoff, første forsøk etter typisk ventetid
+- WaitStats             Faktisk ventetid per venting, med rapport
+- wait_until            Vent til betingelse er oppfylt, eller timeout
+"""
+
+
+class Backoff:
+    """Eksponentielt økende pause mellom forsøk i wait_until.
+
+    :param initial: Første pause (sekunder)
+    :param factor: Faktor pausen økes med etter hvert forsøk
+    :param max_interval: Største pause
+
+    Eksempel:
+        Backoff(0.02, factor=2., max_interval=0.3)
+        -> pauser 0.02, 0.04, 0.08, 0.16, 0.3, 0.3, ...
+    """
+
+    def __init__(self, initial: float = 0.02, *,
+                 factor: float = 2.,
+                 max_interval: float = 0.5,
+                 ) -> None:
+        assert initial > 0. and factor >= 1. and max_interval >= initial, \
+            ("Forventet initial > 0, factor >= 1 og max_interval >= "
+             f"initial, mottok {initial}, {factor}, {max_interval}")
+        self.initial = initial
+        self.factor = factor
+        self.max_interval = max_interval
+
+    def __repr__(self) -> str:
+        return (f'{type(self).__name__}({self.initial}, '
+                f'factor={self.factor}, max_interval={self.max_interval})')
+
+    def first_delay(self, typical: float | None) -> float:
+        """Pause før første forsøk, ut fra typisk ventetid (WaitStats)."""
+        return 0.
+
+    def intervals(self):
+        """Generer pauser mellom forsøk."""
+        interval = self.initial
+        while True:
+            yield interval
+            interval = min(self.max_interval, interval * self.factor)
+
+
+class AdaptiveBackoff(Backoff):
+    """Backoff der første forsøk tilpasses typisk ventetid.
+
+    Når samme venting har typisk ventetid (median i WaitStats),
+    ventes share av denne før første forsøk, og deretter som Backoff.
+    Nyttig når hvert forsøk har bivirkninger, f.eks. tastetrykk.
+
+    :param share: Andel av typisk ventetid før første forsøk
+    """
+
+    def __init__(self, initial: float = 0.02, *,
+                 factor: float = 2.,
+                 max_interval: float = 0.5,
+                 share: float = 0.8,
+                 ) -> None:
+        super().__init__(initial, factor=factor, max_interval=max_interval)
+        assert 0. < share <= 1., \
+            f"share må være mellom 0 og 1, mottok {share}"
+        self.share = share
+
+    def first_delay(self, typical: float | None) -> float:
+        """Pause før første forsøk, share av typisk ventetid."""
+        if typical is None:
+            return 0.
+        return min(self.max_interval, typical * self.share)
+
+
+class WaitStats:
+    """Faktisk ventetid per venting i wait_until.
+
+    Per navn samles antall ventinger, antall timeouts, antall forsøk,
+    total og lengste ventetid, og de siste sample_size ventetidene for
+    typisk (median) ventetid.
+
+    :param sample_size: Antall siste ventetider per navn
+
+    Eksempel:
+        stats = WaitStats()
+        wait_until(is_ready, 2., name='mamut.save', stats=stats)
+        print(stats.format_report())
+    """
+
+    def __init__(self, *, sample_size: int = 50) -> None:
+        self.sample_size = sample_size
+        self._lock = threading.Lock()
+        # {navn: dict med tellere og siste ventetider}
+        self._waits: dict = {}
+
+    def record(self, name: str, elapsed: float, *,
+               attempts: int,
+               is_timeout: bool) -> None:
+        """Registrer én venting."""
+        with self._lock:
+            wait = self._waits.get(name)
+            if wait is None:
+                wait = self._waits[name] = dict(
+                    count=0, timeouts=0, attempts=0, total=0., max=0.,
+                    samples=collections.deque(maxlen=self.sample_size))
+            wait['count'] += 1
+            wait['timeouts'] += is_timeout
+            wait['attempts'] += attempts
+            wait['total'] += elapsed
+            wait['max'] = max(wait['max'], elapsed)
+            if not is_timeout:
+                wait['samples'].append(elapsed)
+        return None
+
+    def typical(self, name: str) -> float | None:
+        """Median av siste vellykkede ventetider, None uten data."""
+        with self._lock:
+            wait = self._waits.get(name)
+            samples = list(wait['samples']) if wait is not None else []
+        return statistics.median(samples) if samples else None
+
+    def stats(self) -> dict:
+        """Returner dict med statistikk per navn."""
+        with self._lock:
+            waits = {name: dict(wait, samples=list(wait['samples']))
+                     for name, wait in self._waits.items()}
+        for wait in waits.values():
+            samples = wait.pop('samples')
+            wait['mean'] = wait['total'] / wait['count']
+            wait['median'] = statistics.median(samples) if samples else None
+        return waits
+
+    def reset(self) -> None:
+        """Nullstill statistikken."""
+        with self._lock:
+            self._waits.clear()
+        return None
+
+    def format_report(self) -> str:
+        """Tabell med ventetid per navn, lengst total tid først."""
+        waits = self.stats()
+        lines = [f"{'Venting':<32}{'Antall':>8}{'Timeout':>9}"
+                 f"{'Forsøk':>8}{'Snitt ms':>10}{'Maks ms':>10}"
+                 f"{'Totalt s':>10}"]
+        for name, wait in sorted(waits.items(),
+                                 key=lambda item: -item[1]['total']):
+            lines.append(
+                f"{name[:31]:<32}{wait['count']:>8}{wait['timeouts']:>9}"
+                f"{wait['attempts'] / wait['count']:>8.1f}"
+                f"{wait['mean'] * 1000:>10.1f}{wait['max'] * 1000:>10.1f}"
+                f"{wait['total']:>10.2f}")
+        return '\n'.join(lines)
+
+
+# Standard for wait_until
+DEFAULT_BACKOFF = Backoff()
+WAIT_STATS = WaitStats()
+
+
+def wait_until(predicate, timeout: float = 2., *,
+               backoff: Backoff | None = None,
+               delay: float = 0.,
+               name: str | None = None,
+               stats: WaitStats | None = WAIT_STATS,
+               clock=time.monotonic,
+               sleep=time.sleep):
+    """Vent til predicate() gir sann verdi, maks timeout sekunder.
+
+    predicate kalles straks (evt. etter delay, eller etter typisk
+    ventetid med AdaptiveBackoff), og deretter med pauser fra backoff
+    inntil den gir sann verdi eller fristen (clock() + timeout,
+    monoton klokke) er nådd. Siste forsøk gjøres ved fristen.
+    Ventetid, antall forsøk og evt. timeout registreres i stats under
+    name (standard predicate.__qualname__).
+
+    :param predicate: Funksjon uten argumenter
+    :param timeout: Maks ventetid (sekunder)
+    :param backoff: Pauser mellom forsøk, standard DEFAULT_BACKOFF
+    :param delay: Pause før første forsøk, for hendelser som ellers
+        kan se ferdige ut før de har startet
+    :param name: Navn i stats
+    :param stats: WaitStats, None for ingen registrering
+    :param clock: Tidsfunksjon, kan byttes ut ved testing
+    :param sleep: Pausefunksjon, kan byttes ut ved testing
+
+    :return: Siste verdi fra predicate, usann ved timeout
+
+    Eksempel:
+        text = wait_until(pyperclip.paste, 1., name='clipboard')
+    """
+    backoff = backoff or DEFAULT_BACKOFF
+    if name is None:
+        name = getattr(predicate, '__qualname__', repr(predicate))
+    t_start = clock()
+    deadline = t_start + timeout
+    intervals = backoff.intervals()
+    delay = max(delay, backoff.first_delay(
+        stats.typical(name) if stats is not None else None))
+
+    if delay > 0.:
+        sleep(min(delay, timeout))
+    attempts = 0
+    while True:
+        attempts += 1
+        result = predicate()
+        now = clock()
+        if result or now >= deadline:
+            break
+        sleep(min(next(intervals), deadline - now))
+
+    if stats is not None:
+        stats.record(name, now - t_start, attempts=attempts,
+                     is_timeout=not result)
+    return result
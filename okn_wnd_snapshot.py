@@ -0,0 +1,324 @@
+# -*- encoding: utf-8 -*-#
+# !/usr/bin/python
+
+# Standardbibliotek import
+import abc
+import collections
+import random
+import threading
+import time
+
+
+__author__ = 'Øyvind Nystad'
+
+"""
+Øyeblikksbilde av vinduer, uten avhengighet til Windows:
+- WndInfo               Handle-id, synlighet, tittel og plassering
+- WndSource             Grensesnitt for opplisting av vinduer
+- SyntheticWndSource    Syntetiske vinduer, for ytelsesmålinger
+- WndSnapshot           Alle vinduer fra én opplisting
+- WndDiff               Nye, lukkede og omdøpte vinduer
+- diff_snapshots        Forskjell mellom to øyeblikksbilder
+- WndSnapshots          Gjenbruk av siste opplisting, med forskjell
+                        fra forrige
+- bench_wnd_snapshots   Ytelsesmåling, kjøres med
+                        python okn_wnd_snapshot.py
+
+Opplisting i Windows er Win32WndSource i okn_basic_classes.
+"""
+
+
+# rect er (x_left, y_upper, x_right, y_lower), None for skjulte vinduer
+WndInfo = collections.namedtuple('WndInfo',
+                                 ('handle', 'is_visible', 'title', 'rect'))
+
+
+class WndSource(abc.ABC):
+    """Grensesnitt for opplisting av vinduer.
+
+    Underklasser implementerer list_wnds, som returnerer alle vinduer
+    som WndInfo, i z-rekkefølge (øverste vindu først).
+    """
+
+    @abc.abstractmethod
+    def list_wnds(self) -> list[WndInfo]:
+        """Returner alle vinduer i z-rekkefølge."""
+
+
+class SyntheticWndSource(WndSource):
+    """Syntetiske vinduer som endres mellom hver opplisting.
+
+    For ytelsesmålinger og testing av WndSnapshots uten Windows.
+    Ved hver opplisting åpnes, lukkes og omdøpes en andel (churn) av
+    vinduene, og et vindu løftes øverst.
+
+    :param wnd_count: Antall vinduer ved start
+    :param visible_share: Andel synlige vinduer
+    :param churn: Andel vinduer som endres per opplisting
+    :param seed: Startverdi for tilfeldige endringer
+
+    Eksempel:
+        snapshots = WndSnapshots(SyntheticWndSource(5000))
+    """
+
+    def __init__(self, wnd_count: int = 5000, *,
+                 visible_share: float = 0.3,
+                 churn: float = 0.01,
+                 seed: int = 0,
+                 ) -> None:
+        self.visible_share = visible_share
+        self.churn = churn
+        self._rnd = random.Random(seed)
+        self._next_handle = 0x10000
+        self._wnds: list[WndInfo] = [self._new_wnd()
+                                     for __ in range(wnd_count)]
+
+    def _new_wnd(self) -> WndInfo:
+        """Nytt vindu med neste ledige handle-id."""
+        handle = self._next_handle
+        self._next_handle += 2
+        is_visible = self._rnd.random() < self.visible_share
+        x_left, y_upper = self._rnd.randrange(1600), self._rnd.randrange(900)
+        return WndInfo(handle, is_visible, f'Vindu {handle:x}',
+                       (x_left, y_upper, x_left + 320, y_upper + 240)
+                       if is_visible else None)
+
+    def list_wnds(self) -> list[WndInfo]:
+        """Endre vinduene, og returner dem i z-rekkefølge."""
+        wnds = self._wnds
+        change_count = int(len(wnds) * self.churn)
+        for __ in range(change_count):
+            idx = self._rnd.randrange(len(wnds))
+            action = self._rnd.random()
+            if action < 0.4:
+                del wnds[idx]
+                wnds.insert(0, self._new_wnd())
+            else:
+                wnd = wnds[idx]
+                wnds[idx] = wnd._replace(
+                    title=f'{wnd.title.split(" - ")[0]} - '
+                          f'{self._rnd.randrange(100)}')
+        if wnds:
+            wnds.insert(0, wnds.pop(self._rnd.randrange(len(wnds))))
+        return list(wnds)
+
+
+class WndSnapshot:
+    """Alle vinduer fra én opplisting.
+
+    :param wnds: WndInfo i z-rekkefølge
+    :param taken_at: Tidspunkt for opplistingen (monoton klokke)
+    """
+
+    __slots__ = ('wnds', 'taken_at', '_by_handle')
+
+    def __init__(self, wnds, taken_at: float) -> None:
+        self.wnds: tuple[WndInfo, ...] = tuple(wnds)
+        self.taken_at = taken_at
+        self._by_handle = None
+
+    def __repr__(self) -> str:
+        return (f'{type(self).__name__}({len(self.wnds)} vinduer, '
+                f'taken_at={self.taken_at:.3f})')
+
+    def __len__(self) -> int:
+        return len(self.wnds)
+
+    @property
+    def by_handle(self) -> dict:
+        """dict med WndInfo per handle-id, bygges ved behov."""
+        if self._by_handle is None:
+            self._by_handle = {wnd.handle: wnd for wnd in self.wnds}
+        return self._by_handle
+
+    def iter_titled(self):
+        """Generer (handle-id, tittel) for synlige vinduer med tittel,
+        i z-rekkefølge."""
+        for wnd in self.wnds:
+            if wnd.is_visible and wnd.title:
+                yield wnd.handle, wnd.title
+
+
+class WndDiff(collections.namedtuple('WndDiff',
+                                     ('added', 'removed', 'retitled'))):
+    """Forskjell mellom to øyeblikksbilder.
+
+    added og removed er lister av WndInfo, retitled er liste av
+    (forrige WndInfo, ny WndInfo). Usann når ingenting er endret.
+    """
+
+    __slots__ = ()
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.retitled)
+
+
+def diff_snapshots(previous: WndSnapshot | None,
+                   current: WndSnapshot) -> WndDiff:
+    """Finn nye, lukkede og omdøpte vinduer fra previous til current.
+
+    Uten previous regnes alle vinduer som nye. Nye og omdøpte vinduer
+    er i z-rekkefølge for current, lukkede i z-rekkefølge for previous.
+    """
+    if previous is None:
+        return WndDiff(list(current.wnds), [], [])
+    if previous.wnds == current.wnds:
+        return WndDiff([], [], [])
+
+    previous_by_handle = previous.by_handle
+    current_by_handle = current.by_handle
+    added = []
+    retitled = []
+    for wnd in current.wnds:
+        previous_wnd = previous_by_handle.get(wnd.handle)
+        if previous_wnd is None:
+            added.append(wnd)
+        elif previous_wnd.title != wnd.title:
+            retitled.append((previous_wnd, wnd))
+    removed = [wnd for wnd in previous.wnds
+               if wnd.handle not in current_by_handle]
+    return WndDiff(added, removed, retitled)
+
+
+class WndSnapshots:
+    """Siste opplisting av vinduer, gjenbrukt innen max_age sekunder.
+
+    Flere oppslag like etter hverandre, f.eks. i wnd_focus, deler da
+    én opplisting. Forrige øyeblikksbilde beholdes, slik at diff gir
+    nye, lukkede og omdøpte vinduer siden forrige opplisting.
+
+    :param source: WndSource som lister opp vinduene
+    :param max_age: Maks alder (sekunder) for gjenbruk av opplisting
+    :param clock: Tidsfunksjon, kan byttes ut ved testing
+
+    Eksempel:
+        snapshots = WndSnapshots(Win32WndSource())
+        for wnd_handle, wnd_title in snapshots.take().iter_titled():
+            ...
+        print(snapshots.diff().added)
+    """
+
+    def __init__(self, source: WndSource, *,
+                 max_age: float = 0.05,
+                 clock=time.monotonic,
+                 ) -> None:
+        self.source = source
+        self.max_age = max_age
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._previous: WndSnapshot | None = None
+        self._current: WndSnapshot | None = None
+        self._diff: WndDiff | None = None
+        self._enumerations = 0
+        self._reuses = 0
+
+    def take(self, max_age: float | None = None) -> WndSnapshot:
+        """Returner siste øyeblikksbilde, eller list opp vinduene på
+        nytt dersom det er eldre enn max_age (standard self.max_age,
+        0 gir alltid ny opplisting)."""
+        if max_age is None:
+            max_age = self.max_age
+        with self._lock:
+            current = self._current
+            now = self.clock()
+            if current is not None and now - current.taken_at <= max_age:
+                self._reuses += 1
+                return current
+            self._enumerations += 1
+        # Opplisting utenfor låsen, samtidige opplistinger er ufarlige
+        snapshot = WndSnapshot(self.source.list_wnds(), now)
+        with self._lock:
+            if self._current is None or \
+                    snapshot.taken_at >= self._current.taken_at:
+                self._previous, self._current = self._current, snapshot
+                self._diff = None
+        return snapshot
+
+    def invalidate(self) -> None:
+        """Neste take lister opp vinduene på nytt, f.eks. etter at
+        fokus eller plassering er endret."""
+        with self._lock:
+            if self._current is not None:
+                self._current = WndSnapshot(self._current.wnds,
+                                            float('-inf'))
+        return None
+
+    def diff(self) -> WndDiff:
+        """Nye, lukkede og omdøpte vinduer fra forrige til siste
+        opplisting. Beregnes én gang per opplisting."""
+        with self._lock:
+            previous, current, diff = \
+                self._previous, self._current, self._diff
+        if current is None:
+            return WndDiff([], [], [])
+        if diff is None:
+            diff = diff_snapshots(previous, current)
+            with self._lock:
+                if self._current is current:
+                    self._diff = diff
+        return diff
+
+    def stats(self) -> dict:
+        """Returner dict med antall opplistinger og gjenbruk."""
+        with self._lock:
+            enumerations, reuses = self._enumerations, self._reuses
+        total = enumerations + reuses
+        return dict(enumerations=enumerations,
+                    reuses=reuses,
+                    reuse_rate=reuses / total if total else 0.)
+
+
+def bench_wnd_snapshots(wnd_count: int = 5000, *,
+                        churn: float = 0.01,
+                        lookup_count: int = 200,
+                        repeat: int = 5) -> dict:
+    """Mål opplisting, forskjell og oppslag med syntetiske vinduer.
+
+    Sammenligner oppslag der hvert oppslag lister opp vinduene på
+    nytt (max_age=0) med gjenbruk av siste opplisting, og måler
+    diff_snapshots med og uten endringer.
+
+    Returnerer dict med beste kjøretid (sekunder) per variant.
+    """
+    def _best(func) -> float:
+        best_time = float('inf')
+        for __ in range(repeat):
+            t_start = time.perf_counter()
+            func()
+            best_time = min(best_time, time.perf_counter() - t_start)
+        return best_time
+
+    def _lookups(max_age):
+        def _run():
+            snapshots = WndSnapshots(
+                SyntheticWndSource(wnd_count, churn=churn), max_age=max_age)
+            for __ in range(lookup_count):
+                next(snapshots.take().iter_titled(), None)
+            return snapshots
+        return _run
+
+    source = SyntheticWndSource(wnd_count, churn=churn)
+    previous = WndSnapshot(source.list_wnds(), 0.)
+    current = WndSnapshot(source.list_wnds(), 1.)
+    unchanged = WndSnapshot(current.wnds, 2.)
+    diff = diff_snapshots(previous, current)
+
+    results = {
+        'Opplisting': _best(lambda: WndSnapshot(source.list_wnds(), 0.)),
+        'diff, endret': _best(lambda: diff_snapshots(
+            WndSnapshot(previous.wnds, 0.), WndSnapshot(current.wnds, 1.))),
+        'diff, uendret': _best(lambda: diff_snapshots(current, unchanged)),
+        f'{lookup_count} oppslag, max_age=0': _best(_lookups(0.)),
+        f'{lookup_count} oppslag, gjenbruk': _best(_lookups(60.)),
+    }
+    print(f"\n{wnd_count} vinduer, {churn:.0%} endret per opplisting "
+          f"({len(diff.added)} nye, {len(diff.removed)} lukket, "
+          f"{len(diff.retitled)} omdøpt)")
+    for name, best_time in results.items():
+        print(f"  {name:<28}{best_time * 1000:>10.2f} ms")
+    return results
+
+
+if __name__ == '__main__':
+    for wnd_count in (1000, 5000, 20000):
+        bench_wnd_snapshots(wnd_count)
@@ -0,0 +1,19 @@
+# -*- encoding: utf-8 -*-#
+# !/usr/bin/python
+
+# Standardbibliotek import
+import os
+import sys
+
+__author__ = 'Øyvind Nystad'
+
+"""
+Felles oppsett for testene, kjøres med python -m pytest fra
+prosjektmappen. Modulene ligger i prosjektmappen, som legges til i
+sys.path. Tester som trenger Windows, Mamut-avhengigheter eller
+okn_constants hoppes over der disse mangler (pytest.importorskip).
+"""
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
@@ -0,0 +1,331 @@
+# -*- encoding: utf-8 -*-#
+# !/usr/bin/python
+
+# Standardbibliotek import
+import time
+
+# Lokal applikasjon import
+from okn_wnd_snapshot import WndInfo, WndSource
+
+__author__ = 'Øyvind Nystad'
+
+"""
+Erstatninger for klokke, utklippstavle og tastatur ved testing:
+- FakeClock             Klokke og sleep som kan styres
+- FakeClipboard         Utklippstavle, evt. treg, i stedet for pyperclip
+- FakeField             Tekstfelt som tar imot tastetrykk, i stedet for
+                        keyboard
+- FakeValuePattern      ValuePattern (UI Automation) for FakeField
+- FakeDesktop           Vinduer med plassering, i stedet for win32gui
+- FAKE_WIN32CON         Konstanter fra win32con for FakeDesktop
+"""
+
+
+class FakeClock:
+    """Klokke der sleep flytter tiden frem uten å vente.
+
+    Brukes som clock og sleep i wait_until ved testing, evt. med
+    predicate som leser fake_clock.now.
+
+    Eksempel:
+        fake_clock = FakeClock()
+        wait_until(lambda: fake_clock.now >= 0.5, 1., stats=WaitStats(),
+                   clock=fake_clock, sleep=fake_clock.sleep)
+    """
+
+    def __init__(self, start: float = 0.) -> None:
+        self.now = start
+        self.sleeps: list = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        """Flytt klokken seconds frem, og noter pausen."""
+        self.sleeps.append(seconds)
+        self.now += max(0., seconds)
+        return None
+
+
+class FakeClipboard:
+    """Utklippstavle for testing av FieldIO, uten pyperclip.
+
+    Med clock og delay blir kopiert tekst synlig først delay sekunder
+    etter copy, som en treg utklippstavle.
+
+    Eksempel:
+        fake_clock = FakeClock()
+        clipboard = FakeClipboard(clock=fake_clock, delay=0.05)
+    """
+
+    def __init__(self, text: str = '', *,
+                 clock=None,
+                 delay: float = 0.,
+                 ) -> None:
+        self.clock = clock
+        self.delay = delay
+        self._text = text
+        self._pending: tuple[float, str] | None = None
+        self.copies: list[str] = []
+
+    def copy(self, text: str) -> None:
+        """Kopier text, evt. synlig etter delay."""
+        self.copies.append(text)
+        if self.clock is None or not self.delay:
+            self._text, self._pending = text, None
+        else:
+            self._pending = (self.clock() + self.delay, text)
+        return None
+
+    def paste(self) -> str:
+        """Returner synlig tekst."""
+        if self._pending is not None and self.clock() >= self._pending[0]:
+            self._text, self._pending = self._pending[1], None
+        return self._text
+
+
+class FakeField:
+    """Tekstfelt som tar imot tastetrykk, for testing av FieldIO.
+
+    Brukes som keys i FieldIO. Feltet får fokus ved tidspunkt
+    focus_at (etter clock), og tastetrykk før dette går tapt.
+    Forstår '0', 'ctrl+a', 'ctrl+a+c' og 'tab', evt. kommaseparert,
+    samt write(text), som erstatter markert innhold. Med busy_for
+    ignoreres tastetrykk i busy_for sekunder etter write, som når
+    Mamut slår opp skrevet produktnummer.
+
+    'tab' flytter fokus til neste element (element_id), med innhold
+    fra tab_texts, og innholdet i elementet som forlates legges i
+    left_texts. Med tab_delay behandles tab først etter tab_delay
+    sekunder, eller ved neste tastetrykk, som ligger i kø bak tab.
+
+    Eksempel:
+        fake_clock = FakeClock()
+        clipboard = FakeClipboard()
+        field = FakeField(clipboard, clock=fake_clock, focus_at=0.5)
+        field_io = FieldIO(clipboard=clipboard, keys=field,
+                           is_uia=False, stats=WaitStats(),
+                           wait_stats=WaitStats(), clock=fake_clock,
+                           sleep=fake_clock.sleep)
+    """
+
+    def __init__(self, clipboard, *,
+                 clock=time.monotonic,
+                 text: str = '',
+                 focus_at: float = 0.,
+                 busy_for: float = 0.,
+                 tab_texts: tuple = (),
+                 tab_delay: float = 0.,
+                 ) -> None:
+        self.clipboard = clipboard
+        self.clock = clock
+        self.text = text
+        self.focus_at = focus_at
+        self.busy_for = busy_for
+        self.tab_texts = list(tab_texts)
+        self.tab_delay = tab_delay
+        self.left_texts: list[str] = []
+        self.is_selected = False
+        self.keys: list[str] = []
+        self._element_id = 1
+        self._tab_at: float | None = None
+
+    @property
+    def is_focused(self) -> bool:
+        return self.clock() >= self.focus_at
+
+    @property
+    def element_id(self) -> int:
+        """Runtime-id for fokusert element, etter evt. behandlet tab."""
+        self._apply_tab()
+        return self._element_id
+
+    def _apply_tab(self, is_forced: bool = False) -> None:
+        """Flytt fokus til neste element dersom tab er behandlet."""
+        if self._tab_at is not None and (is_forced
+                                         or self.clock() >= self._tab_at):
+            self._tab_at = None
+            self._element_id += 1
+            self.left_texts.append(self.text)
+            self.text = self.tab_texts.pop(0) if self.tab_texts else ''
+            self.is_selected = False
+        return None
+
+    def press_and_release(self, keys: str) -> None:
+        """Behandle tastetrykk i rekkefølge."""
+        for key in keys.split(', '):
+            self.keys.append(key)
+            self._apply_tab(is_forced=True)
+            if not self.is_focused:
+                continue
+            if key == 'ctrl+a':
+                self.is_selected = True
+            elif key == 'ctrl+a+c':
+                self.is_selected = True
+                self.clipboard.copy(self.text)
+            elif key == 'tab':
+                self._tab_at = self.clock() + self.tab_delay
+                if not self.tab_delay:
+                    self._apply_tab(is_forced=True)
+            else:
+                self._type(key)
+        return None
+
+    def _type(self, text: str) -> None:
+        """Erstatt markert innhold med text, ellers legg til text."""
+        self.text = text if self.is_selected else self.text + text
+        self.is_selected = False
+        return None
+
+    def write(self, text: str) -> None:
+        """Skriv text, som erstatter evt. markert innhold."""
+        self._apply_tab(is_forced=True)
+        if not self.is_focused:
+            return None
+        self._type(text)
+        if self.busy_for:
+            self.focus_at = self.clock() + self.busy_for
+        return None
+
+
+class FakeValuePattern:
+    """ValuePattern for FakeField, som value_pattern i FieldIO.
+
+    :param field: FakeField som leses og skrives
+    :param is_read_only: Angi om feltet er skrivebeskyttet
+    :param is_sticky: Angi om SetValue endrer feltet. Noen felt i
+        Mamut viser verdien, men beholder den ikke
+
+    Eksempel:
+        field_io = FieldIO(
+            clipboard=clipboard, keys=field,
+            value_pattern=lambda: (field.element_id,
+                                   FakeValuePattern(field)), ...)
+    """
+
+    def __init__(self, field, *,
+                 is_read_only: bool = False,
+                 is_sticky: bool = True,
+                 ) -> None:
+        self.field = field
+        self.is_read_only = is_read_only
+        self.is_sticky = is_sticky
+        self.set_values: list[str] = []
+
+    @property
+    def CurrentValue(self) -> str:
+        return self.field.text
+
+    @property
+    def CurrentIsReadOnly(self) -> bool:
+        return self.is_read_only
+
+    def SetValue(self, text: str) -> None:
+        """Sett verdi, evt. uten at feltet beholder den."""
+        self.set_values.append(text)
+        if self.is_sticky and not self.is_read_only:
+            self.field.text = text
+        return None
+
+
+class FakeDesktop(WndSource):
+    """Vinduer med tittel, plassering og tilstand, for testing av
+    BasicWndHandler uten Windows.
+
+    Brukes både som vinduskilde (WndSource) og i stedet for win32gui,
+    og som ctypes.windll.user32 (GetForegroundWindow). Alle kall som
+    endrer vinduer noteres i calls.
+
+    Eksempel:
+        desktop = FakeDesktop()
+        handle = desktop.add_wnd('Konsoll', (0, 0, 300, 200))
+        monkeypatch.setattr(okn_basic_classes, 'win32gui', desktop)
+    """
+
+    def __init__(self) -> None:
+        self.wnds: dict[int, dict] = {}
+        self.foreground: int | None = None
+        self.calls: list[tuple] = []
+
+    def add_wnd(self, title: str, rect: tuple, *,
+                is_zoomed: bool = False,
+                is_topmost: bool = False,
+                ) -> int:
+        """Legg til vindu øverst, returner handle-id."""
+        wnd_handle = 100 + len(self.wnds)
+        self.wnds[wnd_handle] = dict(title=title, rect=tuple(rect),
+                                     is_zoomed=is_zoomed,
+                                     is_topmost=is_topmost)
+        return wnd_handle
+
+    @property
+    def windll(self):
+        return self
+
+    @property
+    def user32(self):
+        return self
+
+    def list_wnds(self) -> list[WndInfo]:
+        """Returner vinduene, sist lagt til øverst."""
+        return [WndInfo(wnd_handle, True, wnd['title'], wnd['rect'])
+                for wnd_handle, wnd in reversed(self.wnds.items())]
+
+    def GetForegroundWindow(self) -> int | None:
+        return self.foreground
+
+    def GetWindowText(self, wnd_handle: int) -> str:
+        return self.wnds[wnd_handle]['title']
+
+    def GetWindowRect(self, wnd_handle: int) -> tuple:
+        return self.wnds[wnd_handle]['rect']
+
+    def IsIconic(self, wnd_handle: int) -> bool:
+        return False
+
+    def IsZoomed(self, wnd_handle: int) -> bool:
+        return self.wnds[wnd_handle]['is_zoomed']
+
+    def GetWindowLong(self, wnd_handle: int, index: int) -> int:
+        return FAKE_WIN32CON.WS_EX_TOPMOST \
+            if self.wnds[wnd_handle]['is_topmost'] else 0
+
+    def ShowWindow(self, wnd_handle: int, cmd_show: int) -> None:
+        self.calls.append(('ShowWindow', wnd_handle, cmd_show))
+        self.wnds[wnd_handle]['is_zoomed'] = \
+            cmd_show == FAKE_WIN32CON.SW_MAXIMIZE
+        return None
+
+    def SetWindowPos(self, wnd_handle: int, insert_after: int,
+                     *args) -> None:
+        self.calls.append(('SetWindowPos', wnd_handle, insert_after))
+        self.wnds[wnd_handle]['is_topmost'] = \
+            insert_after == FAKE_WIN32CON.HWND_TOPMOST
+        return None
+
+    def MoveWindow(self, wnd_handle: int, x: int, y: int, w: int, h: int,
+                   is_repainted: int) -> None:
+        self.calls.append(('MoveWindow', wnd_handle, x, y, w, h))
+        self.wnds[wnd_handle]['rect'] = (x, y, x + w, y + h)
+        return None
+
+    def SetForegroundWindow(self, wnd_handle: int) -> None:
+        self.calls.append(('SetForegroundWindow', wnd_handle))
+        self.foreground = wnd_handle
+        return None
+
+
+class _FakeWin32Con:
+    """Konstanter fra win32con som brukes av BasicWndHandler."""
+    SW_NORMAL = 1
+    SW_MAXIMIZE = 3
+    SW_SHOWNOACTIVATE = 4
+    HWND_TOPMOST = -1
+    SWP_NOSIZE = 0x1
+    SWP_NOMOVE = 0x2
+    SWP_NOACTIVATE = 0x10
+    GWL_EXSTYLE = -20
+    WS_EX_TOPMOST = 0x8
+
+
+FAKE_WIN32CON = _FakeWin32Con()
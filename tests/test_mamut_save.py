@@ -0,0 +1,64 @@
+# -*- encoding: utf-8 -*-#
+# !/usr/bin/python
+
+# Standardbibliotek import
+import time
+
+# Tredjeparts bibliotek import
+import pytest
+
+okn_ext_classes = pytest.importorskip('okn_ext_classes')
+okn_db_fixtures = pytest.importorskip('okn_db_fixtures')
+
+# Lokal applikasjon import
+from okn_db import SqliteBackend                            # noqa: E402
+
+__author__ = 'Øyvind Nystad'
+
+"""
+Tester for MamutManager._save_order med vindu som er opptatt en viss
+tid etter ctrl+s, uten Windows.
+"""
+
+
+class FakeMamutWnd:
+    """Som WinGUIManager for _save_order: vinduet svarer ikke på
+    meldinger i busy_for sekunder etter ctrl+s."""
+
+    def __init__(self, busy_for: float) -> None:
+        self.busy_for = busy_for
+        self.saved_at = None
+        self.keys = []
+
+    def schedule_input_events(self, *args) -> None:
+        self.keys.extend(arg[1] for arg in args)
+        self.saved_at = time.monotonic()
+
+    def is_wnd_responsive(self, wnd_handle, timeout: float = 0.1) -> bool:
+        if self.saved_at is None:
+            return True
+        return time.monotonic() >= self.saved_at + self.busy_for
+
+
+@pytest.fixture()
+def mamut(tmp_path):
+    path = okn_db_fixtures.create_fixture_db(str(tmp_path / 'mamut.db'))
+    with okn_ext_classes.MamutManager(
+            backend=SqliteBackend(path),
+            prod_class_index=okn_ext_classes.ProdClassIndex()) as mamut:
+        mamut.mamut_wnd_handle = 0x1234
+        yield mamut
+
+
+def test_save_confirmed_after_busy_window(mamut, capsys):
+    mamut.wingui = FakeMamutWnd(busy_for=0.3)
+    assert mamut._save_order() is True
+    assert mamut.wingui.keys == ['ctrl+s']
+    assert time.monotonic() >= mamut.wingui.saved_at + 0.3
+    assert capsys.readouterr().out.endswith('OK\n')
+
+
+def test_save_unconfirmed_without_busy_window(mamut, capsys):
+    mamut.wingui = FakeMamutWnd(busy_for=0.)
+    assert mamut._save_order() is False
+    assert 'ikke bekreftet' in capsys.readouterr().out
@@ -0,0 +1,179 @@
+# -*- encoding: utf-8 -*-#
+# !/usr/bin/python
+
+# Standardbibliotek import
+import random
+import sqlite3
+import threading
+
+# Tredjeparts bibliotek import
+import pytest
+
+okn_db = pytest.importorskip('okn_db')
+okn_db_fixtures = pytest.importorskip('okn_db_fixtures')
+
+# Lokal applikasjon import
+from okn_db_replica import REPLICA_TABLES, ReferenceReplica   # noqa: E402
+
+__author__ = 'Øyvind Nystad'
+
+"""
+Tester for okn_db_replica.ReferenceReplica mot testdata fra
+okn_db_fixtures: synkronisering med sjekksum per rad (tabeller uten
+stamp_sql), og lesing samtidig med synkronisering.
+"""
+
+
+TABLE_NAMES = [table.name for table in REPLICA_TABLES]
+
+
+@pytest.fixture()
+def source_path(tmp_path):
+    path = str(tmp_path / 'mamut_fixture.db')
+    okn_db_fixtures.create_fixture_db(path, order_line_count=10_000)
+    return path
+
+
+@pytest.fixture()
+def source_pool(source_path):
+    pool = okn_db.ConnectionPool(okn_db.SqliteBackend(source_path).connect)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture()
+def replica(tmp_path):
+    with ReferenceReplica(str(tmp_path / 'replica.db')) as replica:
+        yield replica
+
+
+def _table_rows(execute, table) -> list:
+    """Alle rader i tabellen, sortert på primærnøkkel."""
+    return execute(f'SELECT {", ".join(table.columns)} FROM {table.name} '
+                   f'ORDER BY {table.key_column}')
+
+
+def _source_rows(source_path, table) -> list:
+    conn = sqlite3.connect(source_path)
+    try:
+        return _table_rows(lambda sql: conn.execute(sql).fetchall(), table)
+    finally:
+        conn.close()
+
+
+def _replica_rows(replica, table) -> list:
+    return _table_rows(lambda sql: replica.execute(sql)[1], table)
+
+
+def _change_source(source_path, rnd, *, change_count=5) -> dict:
+    """Tilfeldige endringer, slettinger og nye rader i g_contac og
+    g_prod. Gir {tabellnavn: (endrede og nye, slettede)}."""
+    conn = sqlite3.connect(source_path)
+    changes = {}
+    try:
+        for table_name, key_column, text_column in (
+                ('g_contac', 'contid', 'name'),
+                ('g_prod', 'pk_prodid', 'prodid')):
+            keys = [key for (key,) in conn.execute(
+                f'SELECT {key_column} FROM {table_name}')]
+            picked = rnd.sample(keys, 2 * change_count)
+            updated, deleted = picked[:change_count], picked[change_count:]
+            for key in updated:
+                conn.execute(f'UPDATE {table_name} SET {text_column} = ? '
+                             f'WHERE {key_column} = ?',
+                             [f'Endret {rnd.random()}', key])
+            conn.executemany(f'DELETE FROM {table_name} '
+                             f'WHERE {key_column} = ?',
+                             [[key] for key in deleted])
+            new_key = max(keys) + 1
+            conn.executemany(
+                f'INSERT INTO {table_name} ({key_column}, {text_column}) '
+                'VALUES (?, ?)',
+                [[new_key + idx, f'Ny {idx}'] for idx in range(3)])
+            changes[table_name] = (change_count + 3, change_count)
+        conn.commit()
+    finally:
+        conn.close()
+    return changes
+
+
+def test_delta_sync_matches_source(source_path, source_pool, replica):
+    stats = replica.sync(source_pool)
+    assert {stat['mode'] for stat in stats.values()} == {'full'}
+
+    changes = _change_source(source_path, random.Random(1))
+    stats = replica.sync(source_pool)
+    for table in REPLICA_TABLES:
+        assert stats[table.name]['mode'] == 'incremental'
+        assert (stats[table.name]['rows'], stats[table.name]['deleted']) \
+            == changes.get(table.name, (0, 0))
+        assert _replica_rows(replica, table) \
+            == _source_rows(source_path, table)
+
+    # Uendret kilde gir ingen rader
+    stats = replica.sync(source_pool)
+    assert all(stat['rows'] == stat['deleted'] == 0
+               for stat in stats.values())
+
+
+def test_delta_sync_detects_null_and_empty_text(source_path, source_pool,
+                                                replica):
+    replica.sync(source_pool, ['g_contac'])
+    conn = sqlite3.connect(source_path)
+    contid = conn.execute('SELECT MIN(contid) FROM g_contac').fetchone()[0]
+    for email in (None, '', None):
+        conn.execute('UPDATE g_contac SET email = ? WHERE contid = ?',
+                     [email, contid])
+        conn.commit()
+        stats = replica.sync(source_pool, ['g_contac'])
+        assert stats['g_contac']['rows'] == 1
+        assert replica.execute('SELECT email FROM g_contac WHERE contid = ?',
+                               [contid])[1] == [(email,)]
+    conn.close()
+
+
+def test_full_sync_equals_delta_sync(source_path, source_pool, replica,
+                                     tmp_path):
+    replica.sync(source_pool)
+    _change_source(source_path, random.Random(2))
+    replica.sync(source_pool)
+    with ReferenceReplica(str(tmp_path / 'full.db')) as full_replica:
+        stats = full_replica.sync(source_pool, is_full=True)
+        assert {stat['mode'] for stat in stats.values()} == {'full'}
+        for table in REPLICA_TABLES:
+            assert _replica_rows(replica, table) \
+                == _replica_rows(full_replica, table)
+
+
+def test_readers_see_whole_syncs(source_path, source_pool, replica):
+    replica.sync(source_pool)
+    state_sql = 'SELECT COUNT(*), GROUP_CONCAT(name) FROM g_contac'
+    valid_states = [replica.execute(state_sql)[1][0]]
+    observed = set()
+    errors = []
+    stop = threading.Event()
+
+    def _read():
+        try:
+            while not stop.is_set():
+                observed.add(replica.execute(state_sql)[1][0])
+        except Exception as err:
+            errors.append(err)
+
+    readers = [threading.Thread(target=_read) for __ in range(3)]
+    for reader in readers:
+        reader.start()
+    rnd = random.Random(3)
+    try:
+        for __ in range(5):
+            _change_source(source_path, rnd)
+            replica.sync(source_pool, ['g_contac'])
+            valid_states.append(replica.execute(state_sql)[1][0])
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+
+    assert not errors
+    assert observed
+    assert observed <= set(valid_states)
@@ -0,0 +1,229 @@
+# -*- encoding: utf-8 -*-#
+# !/usr/bin/python
+
+# Tredjeparts bibliotek import
+import pytest
+
+pytest.importorskip('keyboard')
+pytest.importorskip('pyperclip')
+
+# Lokal applikasjon import
+from fakes import FakeClipboard, FakeClock, FakeField, \
+    FakeValuePattern                                        # noqa: E402
+from okn_field_io import FIELD_IO_STATS, FieldIO            # noqa: E402
+from okn_wait import WAIT_STATS, WaitStats                  # noqa: E402
+
+__author__ = 'Øyvind Nystad'
+
+"""
+Tester for okn_field_io.FieldIO med FakeClock, FakeClipboard,
+FakeField og FakeValuePattern, uten tastatur og utklippstavle. Hver
+test bruker egne WaitStats, slik at FIELD_IO_STATS og WAIT_STATS ikke
+påvirkes.
+"""
+
+
+@pytest.fixture()
+def fake_clock():
+    return FakeClock()
+
+
+@pytest.fixture()
+def stats():
+    return WaitStats()
+
+
+def _make_field_io(fake_clock, stats, *, text='', focus_at=0., busy_for=0.,
+                   clipboard_delay=0., tab_texts=(), tab_delay=0.,
+                   pattern_kwargs=None):
+    """FieldIO med felt, evt. med ValuePattern (pattern_kwargs) per
+    element-id."""
+    clipboard = FakeClipboard(clock=fake_clock, delay=clipboard_delay)
+    field = FakeField(clipboard, clock=fake_clock, text=text,
+                      focus_at=focus_at, busy_for=busy_for,
+                      tab_texts=tab_texts, tab_delay=tab_delay)
+    patterns = {}
+
+    def _value_pattern():
+        if not field.is_focused:
+            return None, None
+        element_id = field.element_id
+        if element_id not in patterns:
+            patterns[element_id] = FakeValuePattern(field, **pattern_kwargs)
+        return element_id, patterns[element_id]
+
+    field_io = FieldIO(clipboard=clipboard, keys=field,
+                       value_pattern=_value_pattern,
+                       is_uia=pattern_kwargs is not None,
+                       stats=stats, wait_stats=WaitStats(),
+                       clock=fake_clock, sleep=fake_clock.sleep)
+    return field_io, field, patterns
+
+
+def _read_and_tab(field_io, field) -> None:
+    """Les første felt og trykk tab, slik at fokus er bekreftet
+    flyttet, og UI Automation kan brukes for neste felt."""
+    assert field_io.read() == field.text.strip()
+    field.press_and_release('tab')
+    return None
+
+
+def _recorded(stats) -> dict:
+    """(antall, timeouts) per operasjon og vei."""
+    return {name: (wait['count'], wait['timeouts'])
+            for name, wait in stats.stats().items()}
+
+
+def test_read_uia(fake_clock, stats):
+    field_io, field, __ = _make_field_io(
+        fake_clock, stats, text='forrige', focus_at=0.5,
+        tab_texts=(' SPS340 ',), pattern_kwargs={})
+    _read_and_tab(field_io, field)
+    assert field_io.read() == 'SPS340'
+    assert fake_clock.now >= 0.5
+    assert field.keys[-1] == 'tab'
+    assert _recorded(stats) == {'read.clipboard': (1, 0),
+                                'read.uia': (1, 0)}
+
+
+def test_read_clipboard(fake_clock, stats):
+    field_io, field, __ = _make_field_io(
+        fake_clock, stats, text='Kunde AS', focus_at=0.5,
+        clipboard_delay=0.05)
+    assert field_io.read() == 'Kunde AS'
+    assert 'ctrl+a+c' in field.keys
+    assert _recorded(stats) == {'read.clipboard': (1, 0)}
+
+
+def test_read_timeout(fake_clock, stats):
+    # Tomt felt kan ikke skilles fra felt uten fokus
+    field_io, __, __ = _make_field_io(fake_clock, stats)
+    assert field_io.read(timeout=2.) is None
+    assert fake_clock.now == pytest.approx(2., abs=field_io.paste_timeout)
+    assert _recorded(stats) == {'read.clipboard': (1, 1)}
+
+
+def test_read_after_queued_tab(fake_clock, stats):
+    # Tab er ikke behandlet ennå, og forrige felt har fortsatt fokus.
+    # UI Automation ville lest forrige felt, ctrl+a+c venter på tab.
+    field_io, field, __ = _make_field_io(
+        fake_clock, stats, tab_texts=('Munnstykke',), tab_delay=0.5,
+        pattern_kwargs={})
+    assert field_io.write('SPS340') == 'SPS340'
+    field.press_and_release('tab')
+    assert field_io.read() == 'Munnstykke'
+    assert fake_clock.now < 0.5
+    assert field.left_texts == ['SPS340']
+    assert _recorded(stats) == {'write.clipboard': (1, 0),
+                                'read_back.clipboard': (1, 0),
+                                'read.clipboard': (1, 0)}
+
+
+def test_write_after_queued_tab(fake_clock, stats):
+    # Skriving via UI Automation ville overskrevet forrige felt
+    field_io, field, patterns = _make_field_io(
+        fake_clock, stats, text='SPS340', tab_texts=('gammel',),
+        tab_delay=0.5, pattern_kwargs={})
+    assert field_io.read() == 'SPS340'
+    field.press_and_release('tab')
+    assert field_io.write('Munnstykke') == 'Munnstykke'
+    assert field.left_texts == ['SPS340']
+    assert field.text == 'Munnstykke'
+    assert all(not pattern.set_values for pattern in patterns.values())
+    assert _recorded(stats) == {'read.clipboard': (1, 0),
+                                'write.clipboard': (1, 0),
+                                'read_back.clipboard': (1, 0)}
+
+
+def test_write_uia(fake_clock, stats):
+    field_io, field, patterns = _make_field_io(
+        fake_clock, stats, text='forrige', focus_at=0.5,
+        tab_texts=('gammel',), pattern_kwargs={})
+    _read_and_tab(field_io, field)
+    assert field_io.write('SPS340') == 'SPS340'
+    assert field_io.last_read_back == 'SPS340'
+    assert field.text == 'SPS340'
+    assert patterns[2].set_values == ['SPS340']
+    assert field.keys[-1] == 'tab'
+    assert _recorded(stats) == {'read.clipboard': (1, 0),
+                                'write.uia': (1, 0)}
+
+
+def test_write_read_only_falls_back_to_clipboard(fake_clock, stats):
+    field_io, field, patterns = _make_field_io(
+        fake_clock, stats, text='forrige', tab_texts=('gammel',),
+        pattern_kwargs=dict(is_read_only=True))
+    _read_and_tab(field_io, field)
+    assert field_io.write('SPS340') == 'SPS340'
+    assert field.text == 'SPS340'
+    assert all(not pattern.set_values for pattern in patterns.values())
+    assert field.keys[2:4] == ['0', 'ctrl+a+c']
+    assert _recorded(stats) == {'read.clipboard': (1, 0),
+                                'write.clipboard': (1, 0),
+                                'read_back.clipboard': (1, 0)}
+
+
+def test_write_non_sticky_value_falls_back_to_keys(fake_clock, stats):
+    field_io, field, patterns = _make_field_io(
+        fake_clock, stats, text='forrige', tab_texts=('gammel',),
+        pattern_kwargs=dict(is_sticky=False))
+    _read_and_tab(field_io, field)
+    assert field_io.write('SPS340') == 'SPS340'
+    assert field.text == 'SPS340'
+    assert patterns[2].set_values == ['SPS340']
+    assert field.keys[2] == 'ctrl+a'
+    assert _recorded(stats) == {'read.clipboard': (1, 0),
+                                'write.clipboard': (1, 0),
+                                'read_back.clipboard': (1, 0)}
+
+
+def test_write_clipboard_waits_for_focus(fake_clock, stats):
+    field_io, field, __ = _make_field_io(
+        fake_clock, stats, text='gammel', focus_at=0.5,
+        clipboard_delay=0.05)
+    assert field_io.write('Kunde AS') == 'Kunde AS'
+    assert field_io.last_read_back == 'Kunde AS'
+    assert field.text == 'Kunde AS'
+    assert fake_clock.now >= 0.5
+    assert _recorded(stats) == {'write.clipboard': (1, 0),
+                                'read_back.clipboard': (1, 0)}
+
+
+def test_write_focus_timeout(fake_clock, stats):
+    field_io, field, __ = _make_field_io(
+        fake_clock, stats, focus_at=10.)
+    assert field_io.write('SPS340', timeout=2.) is None
+    assert field.text == ''
+    assert _recorded(stats) == {'write.clipboard': (1, 1)}
+
+
+def test_write_read_back_retries_within_timeout(fake_clock, stats):
+    # Feltet svarer ikke på tastetrykk det første sekundet etter
+    # skriving, lengre enn paste_timeout
+    field_io, field, __ = _make_field_io(
+        fake_clock, stats, text='gammel', busy_for=1.)
+    assert field_io.write('SPS340') == 'SPS340'
+    assert field_io.last_read_back == 'SPS340'
+    assert fake_clock.now >= 1.
+    assert _recorded(stats) == {'write.clipboard': (1, 0),
+                                'read_back.clipboard': (1, 0)}
+
+
+def test_write_unconfirmed_returns_text(fake_clock, stats, capsys):
+    field_io, field, __ = _make_field_io(
+        fake_clock, stats, text='gammel', busy_for=60.)
+    assert field_io.write('SPS340', timeout=2.) == 'SPS340'
+    assert field_io.last_read_back is None
+    assert field.text == 'SPS340'
+    assert not capsys.readouterr().out
+    assert _recorded(stats) == {'write.clipboard': (1, 0),
+                                'read_back.clipboard': (1, 1)}
+
+
+def test_global_stats_untouched(fake_clock, stats):
+    before = FIELD_IO_STATS.stats(), WAIT_STATS.stats()
+    field_io, __, __ = _make_field_io(fake_clock, stats, text='x',
+                                      pattern_kwargs={})
+    field_io.read()
+    field_io.write('y')
+    assert (FIELD_IO_STATS.stats(), WAIT_STATS.stats()) == before
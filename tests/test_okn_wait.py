@@ -0,0 +1,174 @@
+# -*- encoding: utf-8 -*-#
+# !/usr/bin/python
+
+# Standardbibliotek import
+import itertools
+
+# Tredjeparts bibliotek import
+import pytest
+
+# Lokal applikasjon import
+from fakes import FakeClock
+from okn_wait import WAIT_STATS, AdaptiveBackoff, Backoff, WaitStats, \
+    wait_until
+
+__author__ = 'Øyvind Nystad'
+
+"""
+Tester for okn_wait med FakeClock, uten faktisk venting. Hver test
+bruker egen WaitStats, slik at WAIT_STATS ikke påvirkes.
+"""
+
+
+@pytest.fixture()
+def fake_clock():
+    return FakeClock()
+
+
+@pytest.fixture()
+def stats():
+    return WaitStats()
+
+
+def _wait(fake_clock, stats, predicate, timeout, **kwargs):
+    return wait_until(predicate, timeout, name='test', stats=stats,
+                      clock=fake_clock, sleep=fake_clock.sleep, **kwargs)
+
+
+def test_backoff_intervals():
+    intervals = Backoff(0.02, factor=2., max_interval=0.3).intervals()
+    assert [round(interval, 6) for interval in itertools.islice(
+        intervals, 7)] == [0.02, 0.04, 0.08, 0.16, 0.3, 0.3, 0.3]
+    assert Backoff().first_delay(1.) == 0.
+
+
+def test_backoff_rejects_invalid_arguments():
+    with pytest.raises(AssertionError):
+        Backoff(0.)
+    with pytest.raises(AssertionError):
+        Backoff(0.1, factor=0.5)
+    with pytest.raises(AssertionError):
+        Backoff(0.5, max_interval=0.1)
+    with pytest.raises(AssertionError):
+        AdaptiveBackoff(share=0.)
+
+
+def test_adaptive_backoff_first_delay():
+    backoff = AdaptiveBackoff(0.02, max_interval=0.3, share=0.5)
+    assert backoff.first_delay(None) == 0.
+    assert backoff.first_delay(0.2) == pytest.approx(0.1)
+    assert backoff.first_delay(10.) == 0.3
+
+
+def test_immediate_success(fake_clock, stats):
+    assert _wait(fake_clock, stats, lambda: 'klar', 2.) == 'klar'
+    assert fake_clock.sleeps == []
+    wait = stats.stats()['test']
+    assert (wait['count'], wait['timeouts'], wait['attempts']) == (1, 0, 1)
+
+
+def test_timeout_ends_with_attempt_at_deadline(fake_clock, stats):
+    attempt_times = []
+
+    def _never():
+        attempt_times.append(fake_clock.now)
+        return ''
+
+    result = _wait(fake_clock, stats, _never, 1.,
+                   backoff=Backoff(0.1, max_interval=0.3))
+    assert result == ''
+    assert fake_clock.sleeps == pytest.approx([0.1, 0.2, 0.3, 0.3, 0.1])
+    assert attempt_times[-1] == pytest.approx(1.)
+    wait = stats.stats()['test']
+    assert (wait['count'], wait['timeouts'], wait['attempts']) == (1, 1, 6)
+    assert wait['max'] == pytest.approx(1.)
+    # Timeout gir ikke typisk ventetid
+    assert stats.typical('test') is None
+
+
+def test_success_on_final_attempt(fake_clock, stats):
+    result = _wait(fake_clock, stats, lambda: fake_clock.now >= 1., 1.,
+                   backoff=Backoff(0.4, max_interval=0.4))
+    assert result is True
+    assert fake_clock.now == pytest.approx(1.)
+    wait = stats.stats()['test']
+    assert (wait['timeouts'], wait['attempts']) == (0, 4)
+
+
+def test_success_before_deadline(fake_clock, stats):
+    result = _wait(fake_clock, stats, lambda: fake_clock.now >= 0.25, 2.,
+                   backoff=Backoff(0.1, factor=1., max_interval=0.1))
+    assert result is True
+    assert fake_clock.now == pytest.approx(0.3)
+    assert stats.typical('test') == pytest.approx(0.3)
+
+
+def test_delay_before_first_attempt(fake_clock, stats):
+    attempt_times = []
+    _wait(fake_clock, stats, lambda: attempt_times.append(fake_clock.now)
+          or True, 2., delay=0.5)
+    assert attempt_times == [0.5]
+    # delay begrenses av timeout
+    fake_clock.sleeps.clear()
+    _wait(fake_clock, stats, lambda: True, 0.2, delay=0.5)
+    assert fake_clock.sleeps == [0.2]
+
+
+def test_adaptive_backoff_uses_typical_wait(fake_clock, stats):
+    backoff = AdaptiveBackoff(0.05, max_interval=1., share=0.8)
+    for ready_after in (0.5, 0.5, 0.5):
+        t_ready = fake_clock.now + ready_after
+        _wait(fake_clock, stats, lambda: fake_clock.now >= t_ready, 5.,
+              backoff=backoff)
+    # Første venting: forsøk ved 0, 0.05, 0.15, 0.35 og 0.75 s. Deretter
+    # første forsøk etter 0.8 av typisk ventetid: 0.6 og 0.54 s
+    typical = stats.typical('test')
+    assert typical == pytest.approx(0.6)
+    assert stats.stats()['test']['attempts'] == 7
+
+    fake_clock.sleeps.clear()
+    _wait(fake_clock, stats, lambda: True, 5., backoff=backoff)
+    assert fake_clock.sleeps == [pytest.approx(typical * 0.8)]
+
+
+def test_default_name_and_no_stats(fake_clock, stats):
+    def is_ready():
+        return True
+
+    wait_until(is_ready, 1., stats=stats, clock=fake_clock,
+               sleep=fake_clock.sleep)
+    assert list(stats.stats()) == [is_ready.__qualname__]
+    assert wait_until(is_ready, 1., stats=None, clock=fake_clock,
+                      sleep=fake_clock.sleep) is True
+
+
+def test_global_stats_untouched(fake_clock, stats):
+    before = WAIT_STATS.stats()
+    _wait(fake_clock, stats, lambda: False, 0.5)
+    assert WAIT_STATS.stats() == before
+
+
+def test_wait_stats_records_and_report():
+    stats = WaitStats(sample_size=3)
+    for elapsed in (0.1, 0.2, 0.3, 0.4):
+        stats.record('felt', elapsed, attempts=2, is_timeout=False)
+    stats.record('felt', 2., attempts=5, is_timeout=True)
+    stats.record('lagring', 1., attempts=1, is_timeout=False)
+
+    wait = stats.stats()['felt']
+    assert (wait['count'], wait['timeouts'], wait['attempts']) == (5, 1, 13)
+    assert wait['total'] == pytest.approx(3.)
+    assert wait['mean'] == pytest.approx(0.6)
+    assert wait['max'] == 2.
+    # Median av de siste sample_size vellykkede
+    assert wait['median'] == pytest.approx(0.3)
+    assert stats.typical('felt') == pytest.approx(0.3)
+    assert stats.typical('ukjent') is None
+
+    report = stats.format_report().splitlines()
+    assert len(report) == 3
+    assert report[1].startswith('felt')
+    assert report[2].startswith('lagring')
+
+    stats.reset()
+    assert stats.stats() == {}
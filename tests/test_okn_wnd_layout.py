@@ -0,0 +1,153 @@
+# -*- encoding: utf-8 -*-#
+# !/usr/bin/python
+
+# Standardbibliotek import
+import types
+
+# Tredjeparts bibliotek import
+import pytest
+
+# Lokal applikasjon import
+from fakes import FAKE_WIN32CON, FakeClock, FakeDesktop
+from okn_wait import WaitStats
+from okn_wnd_snapshot import WndSnapshots
+
+okn_basic_classes = pytest.importorskip('okn_basic_classes')
+
+__author__ = 'Øyvind Nystad'
+
+"""
+Tester for plassering av vinduer i BasicWndHandler (place_wnd,
+apply_layout), med FakeDesktop i stedet for win32gui.
+"""
+
+X_PIXEL_RES, Y_PIXEL_RES = 1920, 1080
+
+
+@pytest.fixture
+def desktop(monkeypatch):
+    desktop = FakeDesktop()
+    monkeypatch.setattr(okn_basic_classes, 'win32gui', desktop)
+    monkeypatch.setattr(okn_basic_classes, 'ctypes', desktop)
+    monkeypatch.setattr(okn_basic_classes, 'win32con', FAKE_WIN32CON)
+    monkeypatch.setattr(okn_basic_classes, 'win32api', types.SimpleNamespace(
+        GetSystemMetrics=lambda idx: (X_PIXEL_RES, Y_PIXEL_RES)[idx]))
+    return desktop
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    """Klokke for wait_until i okn_basic_classes, waits får navn per
+    venting."""
+    fake_clock = FakeClock()
+    fake_clock.waits = []
+    wait_until = okn_basic_classes.wait_until
+
+    def _wait_until(predicate, timeout=2., **kwargs):
+        fake_clock.waits.append(kwargs.get('name'))
+        return wait_until(predicate, timeout, stats=WaitStats(),
+                          clock=fake_clock, sleep=fake_clock.sleep,
+                          **kwargs)
+
+    monkeypatch.setattr(okn_basic_classes, 'wait_until', _wait_until)
+    return fake_clock
+
+
+def _make_handler(desktop):
+    return okn_basic_classes.BasicWndHandler(WndSnapshots(desktop))
+
+
+def test_calc_wnd_vals(desktop):
+    handler = _make_handler(desktop)
+    rect = (100, 50, 500, 350)
+
+    # Negativ x og y regnes fra høyre og nedre skjermkant
+    assert handler._calc_wnd_vals(rect, **_console_vals()) == (
+        X_PIXEL_RES - 410 - 25, Y_PIXEL_RES - 440 - 90, 410, 440)
+    # Flyttall er prosent av skjermoppløsningen
+    assert handler._calc_wnd_vals(rect, 25., 10., 50., 50.) == (
+        480, 108, 960, 540)
+    # Uten verdi beholdes vinduets plassering og størrelse
+    assert handler._calc_wnd_vals(rect, None, None, None, None) == (
+        100, 50, 400, 300)
+    assert handler._calc_wnd_vals(rect, -10, None, None, 200) == (
+        X_PIXEL_RES - 400 - 10, 50, 400, 200)
+    with pytest.raises(ValueError):
+        handler._calc_wnd_vals(rect, X_PIXEL_RES + 1, None, None, None)
+
+    wnd_handle = desktop.add_wnd('Konsoll', rect)
+    assert handler._get_updated_wnd_vals(wnd_handle, None, 0, None, None) \
+        == (100, 0, 400, 300)
+
+
+def _console_vals() -> dict:
+    """x, y, w og h fra CONSOLE_PINNED."""
+    return {name: okn_basic_classes.CONSOLE_PINNED[name]
+            for name in ('x', 'y', 'w', 'h')}
+
+
+def test_console_pinned_placed_once(desktop, fake_clock):
+    handler = _make_handler(desktop)
+    console = desktop.add_wnd('Konsoll', (0, 0, 300, 200))
+    profile = (okn_basic_classes.WndPlacement(
+        'Konsoll', **okn_basic_classes.CONSOLE_PINNED),)
+
+    assert handler.apply_layout(profile) == [(console, 'Konsoll')]
+    x, y = X_PIXEL_RES - 410 - 25, Y_PIXEL_RES - 440 - 90
+    assert desktop.calls == [
+        ('ShowWindow', console, FAKE_WIN32CON.SW_NORMAL),
+        ('SetWindowPos', console, FAKE_WIN32CON.HWND_TOPMOST),
+        ('MoveWindow', console, x, y, 410, 440),
+        ('SetForegroundWindow', console)]
+    assert desktop.GetWindowRect(console) == (x, y, x + 410, y + 440)
+    assert 'BasicWndHandler.wnd_focus' in fake_clock.waits
+
+    # Allerede på plass: ingen kall som endrer vinduet, og ingen
+    # venting på fokus
+    desktop.calls.clear()
+    fake_clock.waits.clear()
+    assert handler.apply_layout(profile) == [(console, 'Konsoll')]
+    assert desktop.calls == []
+    assert 'BasicWndHandler.wnd_focus' not in fake_clock.waits
+    assert fake_clock.sleeps == []
+
+
+def test_maximized_placed_once(desktop, fake_clock):
+    handler = _make_handler(desktop)
+    mamut = desktop.add_wnd('Mamut', (10, 10, 810, 610))
+    console = desktop.add_wnd('Konsoll', (0, 0, 300, 200))
+    profile = (okn_basic_classes.WndPlacement('Mamut', is_maximized=True),
+               okn_basic_classes.WndPlacement('Konsoll', is_focused=False,
+                                              w=400))
+
+    assert handler.apply_layout(profile) == [(mamut, 'Mamut'),
+                                             (console, 'Konsoll')]
+    # Vindu uten fokus plasseres først
+    assert desktop.calls == [
+        ('ShowWindow', console, FAKE_WIN32CON.SW_SHOWNOACTIVATE),
+        ('MoveWindow', console, 0, 0, 400, 200),
+        ('ShowWindow', mamut, FAKE_WIN32CON.SW_MAXIMIZE),
+        ('SetForegroundWindow', mamut)]
+
+    desktop.calls.clear()
+    fake_clock.waits.clear()
+    handler.apply_layout(profile)
+    assert desktop.calls == []
+    assert 'BasicWndHandler.wnd_focus' not in fake_clock.waits
+    assert fake_clock.sleeps == []
+
+
+def test_maximized_with_size_always_placed(desktop, fake_clock):
+    # Plassering av maksimert vindu kan ikke kontrolleres, men
+    # størrelsen settes for når vinduet gjenopprettes
+    handler = _make_handler(desktop)
+    wnd_handle = desktop.add_wnd('Notisblokk', (0, 0, 300, 200))
+    kwargs = dict(is_maximized=True, x=100, y=100, w=50., h=50.)
+
+    assert handler.place_wnd(wnd_handle, **kwargs)
+    assert ('MoveWindow', wnd_handle, 100, 100, 960, 540) in desktop.calls
+    assert not handler._is_wnd_placed(wnd_handle, is_topmost=False,
+                                      is_focused=True, **kwargs)
+    assert handler._is_wnd_placed(wnd_handle, is_maximized=True,
+                                  is_topmost=False, is_focused=True,
+                                  x=None, y=None, w=None, h=None)
@@ -0,0 +1,61 @@
+# -*- encoding: utf-8 -*-#
+# !/usr/bin/python
+
+# Tredjeparts bibliotek import
+import pytest
+
+# Lokal applikasjon import
+from fakes import FakeClock
+from okn_wnd_snapshot import SyntheticWndSource, WndInfo, WndSnapshot, \
+    WndSnapshots, WndSource, diff_snapshots
+
+__author__ = 'Øyvind Nystad'
+
+"""
+Tester for okn_wnd_snapshot med syntetiske vinduer.
+"""
+
+
+def test_wnd_source_requires_list_wnds():
+    with pytest.raises(TypeError):
+        WndSource()
+
+    class IncompleteSource(WndSource):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteSource()
+
+
+def test_diff_snapshots():
+    wnd_a = WndInfo(1, True, 'A', (0, 0, 10, 10))
+    wnd_b = WndInfo(2, True, 'B', (0, 0, 10, 10))
+    wnd_c = WndInfo(3, False, '', None)
+    previous = WndSnapshot([wnd_a, wnd_b], 0.)
+    current = WndSnapshot([wnd_c, wnd_b._replace(title='B - 1')], 1.)
+
+    diff = diff_snapshots(previous, current)
+    assert diff.added == [wnd_c]
+    assert diff.removed == [wnd_a]
+    assert diff.retitled == [(wnd_b, current.wnds[1])]
+    assert not diff_snapshots(current, WndSnapshot(current.wnds, 2.))
+    assert diff_snapshots(None, current).added == list(current.wnds)
+
+
+def test_snapshots_reuse_within_max_age():
+    fake_clock = FakeClock()
+    snapshots = WndSnapshots(SyntheticWndSource(100, churn=0.1),
+                             max_age=0.05, clock=fake_clock)
+    first = snapshots.take()
+    fake_clock.sleep(0.01)
+    assert snapshots.take() is first
+
+    fake_clock.sleep(0.1)
+    second = snapshots.take()
+    assert second is not first
+    assert snapshots.diff() == diff_snapshots(first, second)
+
+    snapshots.invalidate()
+    assert snapshots.take() is not second
+    assert snapshots.stats() == dict(enumerations=3, reuses=1,
+                                     reuse_rate=0.25)
@@ -0,0 +1,225 @@
+# -*- encoding: utf-8 -*-#
+# !/usr/bin/python
+
+# Standardbibliotek import
+import concurrent.futures
+import contextlib
+import copy
+import io
+import random
+import sqlite3
+
+# Tredjeparts bibliotek import
+import pytest
+
+okn_ext_classes = pytest.importorskip('okn_ext_classes')
+okn_db_fixtures = pytest.importorskip('okn_db_fixtures')
+
+# Lokal applikasjon import
+from okn_constants import LIC_RENEWAL_PROD_NUMS, \
+    MOUTHPIECES_PROD_NUMS, SN_PROD_NUMS                     # noqa: E402
+from okn_db import SqliteBackend                            # noqa: E402
+
+__author__ = 'Øyvind Nystad'
+
+"""
+Tester for MamutManager.refresh_ordered_prods mot testdata fra
+okn_db_fixtures: gjentatt innlesing etter tilfeldige endringer i
+ordrelinjer skal gi samme resultat som is_full=True, ny MamutManager
+og get_ordered_prods_batch. Inndelingen sammenlignes med
+opprinnelig inndeling per ordrelinje.
+"""
+
+
+ORDER_NUMS = list(range(100001, 100031))
+
+
+@pytest.fixture()
+def source_path(tmp_path):
+    path = str(tmp_path / 'mamut_fixture.db')
+    okn_db_fixtures.create_fixture_db(path, order_line_count=3000,
+                                      lines_per_order=6)
+    return path
+
+
+@pytest.fixture()
+def backend(source_path):
+    return SqliteBackend(source_path)
+
+
+@pytest.fixture()
+def mamut(backend):
+    with okn_ext_classes.MamutManager(
+            backend=backend,
+            prod_class_index=okn_ext_classes.ProdClassIndex()) as mamut:
+        yield mamut
+
+
+def _change_order_lines(conn, rnd) -> set:
+    """Tilfeldige endringer, slettinger og nye linjer i ORDER_NUMS.
+    Gir ordrenumrene som kan være endret."""
+    changed = set()
+    prod_nums = [prod_num for (prod_num,) in conn.execute(
+        'SELECT prodid FROM g_prod')]
+    for order_num in ORDER_NUMS:
+        (link_id,) = conn.execute('SELECT linkid FROM g_order '
+                                  'WHERE orderid = ?', [order_num]).fetchone()
+        line_ids = [line_id for (line_id,) in conn.execute(
+            'SELECT uniqueid FROM g_orderl WHERE linkid = ?', [link_id])]
+        action = rnd.randrange(6)
+        if action < 4:
+            changed.add(order_num)
+        if action == 0 and line_ids:
+            conn.execute('UPDATE g_orderl SET qtyorder = qtyorder + ? '
+                         'WHERE uniqueid = ?',
+                         [rnd.choice([-2, 1, 3.5]), rnd.choice(line_ids)])
+        elif action == 1 and line_ids:
+            conn.execute('DELETE FROM g_orderl WHERE uniqueid = ?',
+                         [rnd.choice(line_ids)])
+        elif action == 2:
+            conn.execute('INSERT INTO g_orderl '
+                         '(linkid, prodid, qtyorder, repstrucorder) '
+                         'VALUES (?, ?, ?, 0)',
+                         [link_id, rnd.choice(prod_nums),
+                          rnd.choice([1, -1, 2])])
+        elif action == 3 and line_ids:
+            conn.execute('UPDATE g_orderl SET prodid = ? WHERE uniqueid = ?',
+                         [rnd.choice(prod_nums), rnd.choice(line_ids)])
+        # Øvrige: ordren er uendret
+    conn.commit()
+    return changed
+
+
+def _count_loads(mamut, monkeypatch) -> list:
+    """Ordrenumre for hver innlesning av varer i mamut."""
+    loaded = []
+    load_ordered_prods = mamut._load_ordered_prods
+
+    def _load(order_nums, **kwargs):
+        loaded.extend(order_nums)
+        return load_ordered_prods(order_nums, **kwargs)
+
+    monkeypatch.setattr(mamut, '_load_ordered_prods', _load)
+    return loaded
+
+
+def test_refresh_matches_full_fresh_and_batch(source_path, backend, mamut,
+                                              monkeypatch):
+    for order_num in ORDER_NUMS:
+        mamut.refresh_ordered_prods(order_num)
+    loaded = _count_loads(mamut, monkeypatch)
+    conn = sqlite3.connect(source_path)
+    rnd = random.Random(1)
+    try:
+        for __ in range(5):
+            changed = _change_order_lines(conn, rnd)
+            with okn_ext_classes.MamutManager(
+                    backend=backend,
+                    prod_class_index=okn_ext_classes.ProdClassIndex()
+                    ) as fresh_mamut:
+                batch = fresh_mamut.get_ordered_prods_batch(ORDER_NUMS)
+                for order_num in ORDER_NUMS:
+                    loaded.clear()
+                    refreshed = mamut.refresh_ordered_prods(order_num)
+                    # Uendret ordre gir bare kontrollspørring
+                    assert set(loaded) <= changed
+                    full = mamut.refresh_ordered_prods(order_num,
+                                                       is_full=True)
+                    fresh = fresh_mamut.refresh_ordered_prods(order_num)
+                    assert refreshed == full == fresh == batch[order_num]
+    finally:
+        conn.close()
+
+
+def test_unchanged_order_is_not_reloaded(mamut, monkeypatch):
+    with contextlib.redirect_stdout(io.StringIO()):
+        first = mamut.get_ordered_prods(ORDER_NUMS[0])
+        loaded = _count_loads(mamut, monkeypatch)
+        second = mamut.get_ordered_prods(ORDER_NUMS[0])
+    assert loaded == []
+    assert second == first
+
+
+def test_refresh_returns_copy_per_caller(mamut):
+    first = mamut.refresh_ordered_prods(ORDER_NUMS[0])
+    expected = copy.deepcopy(first)
+    first.non_stor['ENDRET'] = 1.
+    first.has_FP00_prod = not first.has_FP00_prod
+    second = mamut.refresh_ordered_prods(ORDER_NUMS[0])
+    assert second is not first
+    assert second == expected
+
+
+def test_orders_refresh_independently(mamut):
+    # Lås for én ordre skal ikke stoppe oppdatering av andre ordrer
+    with mamut._order_lock(ORDER_NUMS[0]):
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            future = executor.submit(mamut.refresh_ordered_prods,
+                                     ORDER_NUMS[1])
+            assert future.result(timeout=10.).num == ORDER_NUMS[1]
+
+
+def _categorize_lines(conn, order_num) -> dict:
+    """Inndeling per ordrelinje, som opprinnelig get_ordered_prods."""
+    categories = dict(mouthpcs={}, sn_devices={}, other_stor={},
+                      non_stor={})
+    flags = dict(has_FP00_prod=False, has_lic_renewal_prods=False)
+    for qtyorder, prod_num, usestore in conn.execute("""
+            SELECT g_orderl.qtyorder, g_orderl.prodid, g_prod.usestore
+            FROM g_orderl
+            JOIN g_order ON g_orderl.linkid=g_order.linkid
+            JOIN g_prod ON g_prod.prodid=g_orderl.prodid
+            WHERE g_order.orderid = ?
+            AND g_orderl.repstrucorder = 0
+            ORDER BY g_orderl.uniqueid""", [order_num]):
+        if prod_num in MOUTHPIECES_PROD_NUMS:
+            category, qty = 'mouthpcs', qtyorder
+        elif prod_num in SN_PROD_NUMS:
+            category, qty = 'sn_devices', abs(qtyorder)
+        elif usestore:
+            category, qty = 'other_stor', qtyorder
+        else:
+            category, qty = 'non_stor', qtyorder
+            if prod_num == 'FP00':
+                flags['has_FP00_prod'] = True
+            if prod_num in LIC_RENEWAL_PROD_NUMS:
+                flags['has_lic_renewal_prods'] = True
+        categories[category][prod_num] = \
+            categories[category].get(prod_num, 0.) + qty
+    return dict(categories, **flags)
+
+
+def test_categories_follow_line_order(source_path, mamut):
+    batch = mamut.get_ordered_prods_batch(ORDER_NUMS)
+    conn = sqlite3.connect(source_path)
+    try:
+        for order_num in ORDER_NUMS:
+            expected = _categorize_lines(conn, order_num)
+            ordered_prods = batch[order_num]
+            for name, value in expected.items():
+                actual = getattr(ordered_prods, name)
+                assert actual == pytest.approx(value) \
+                    if isinstance(value, dict) else actual == value
+                if isinstance(value, dict):
+                    assert list(actual) == list(value)
+    finally:
+        conn.close()
+
+
+def test_prod_class_index_shared_per_process(backend):
+    managers = [okn_ext_classes.MamutManager(backend=backend)
+                for __ in range(2)]
+    try:
+        assert all(manager.prod_class_index
+                   is okn_ext_classes.PROD_CLASS_INDEX
+                   for manager in managers)
+        # Munnstykker går foran apparater, som i get_ordered_prods
+        for prod_num in SN_PROD_NUMS:
+            category, __ = managers[0].classify_prod(prod_num)
+            assert category == (
+                okn_ext_classes.ProdClassIndex.MOUTHPIECE
+                if prod_num in MOUTHPIECES_PROD_NUMS
+                else okn_ext_classes.ProdClassIndex.SN_DEVICE)
+    finally:
+        for manager in managers:
+            manager.close()